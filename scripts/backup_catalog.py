@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Catalog of complete backups in the backup bucket.
+
+Every node writes an entry `catalog/<timestamp>/<node>.json` once all of its shards are stored. The entry lists the
+S3 key, size, extracted size and SHA-256 checksum of every shard, the shards the whole backup is expected to contain
+across all nodes, and carries the completion marker. `catalog/latest.json` points to the newest backup whose entries
+together contain every expected shard, so finding the backup to restore is a single small read instead of a bucket
+listing. It is only moved forward by the node which completes the backup, and never to a coordinated backup whose
+shards were not all snapshotted at their planned generation.
+"""
+
+import hashlib
+import json
+import re
+
+from datetime import datetime
+
+CATALOG_PREFIX = 'catalog'
+LATEST_KEY = CATALOG_PREFIX + '/latest.json'
+CATALOG_VERSION = 1
+
+REGEX_TIMESTAMP_PREFIX = '^([0-9]{12})/$'
+REGEX_CATALOG_PREFIX = '^' + CATALOG_PREFIX + '/([0-9]{12})/$'
+REGEX_SPLIT_SHARD = '^(.+_shard)([0-9]+)_([0-9]+)$'
+
+
+class StreamChecksum:
+    """Wraps a readable stream and computes the size and SHA-256 checksum of everything read from it."""
+
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1):
+        data = self.__stream.read(size)
+        self.__sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def hexdigest(self):
+        return self.__sha256.hexdigest()
+
+
+def get_entry_key(timestamp: str, node_name: str):
+    return get_entry_prefix(timestamp) + node_name + '.json'
+
+
+def get_backup_name(collection_name: str, shard_name: str):
+    """Returns the name a shard is stored under, shards which were split once are numbered consecutively."""
+    backup_name = collection_name + '_' + shard_name
+    match = re.match(REGEX_SPLIT_SHARD, backup_name)
+    if match:
+        return match.group(1) + str(2 * int(match.group(2)) + int(match.group(3)) - 1)
+    return backup_name
+
+
+def get_entry_prefix(timestamp: str):
+    return CATALOG_PREFIX + '/' + timestamp + '/'
+
+
+def create_shard(key: str, size: int, sha256: str, extracted_size: int = None):
+    """`extracted_size` is the size of the snapshot, which a restore needs on disk besides the archive."""
+    shard = {'key': key, 'size': size, 'sha256': sha256}
+    if extracted_size is not None:
+        shard['extracted_size'] = extracted_size
+    return shard
+
+
+def create_coordination(coordinator: str, planned_generations: dict, generations: dict):
+    """Describes the part of a coordinated backup stored by one node, generations are given by core name."""
+    return {
+        'coordinator': coordinator,
+        'generations': generations,
+        'consistent': all(generations.get(core_name) == generation
+                          for core_name, generation in planned_generations.items()),
+    }
+
+
+def create_entry(timestamp: str, node_name: str, layout: str, shards: dict, coordination: dict = None,
+                 expected_shards: list = None):
+    """
+    `shards` maps the backup name of every shard, e.g. `collection_shard1`, to its `create_shard` record.
+    `coordination` is the `create_coordination` record of a coordinated backup. `expected_shards` are the backup
+    names of the shards stored by all nodes together, by default only the shards of this entry.
+    """
+    entry = {
+        'version': CATALOG_VERSION,
+        'timestamp': timestamp,
+        'node': node_name,
+        'layout': layout,
+        'collections': sorted(set(backup_name.split('_shard')[0] for backup_name in shards)),
+        'shards': shards,
+        'size': sum(shard['size'] for shard in shards.values()),
+        'finished': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'complete': True,
+    }
+    if coordination is not None:
+        entry['coordination'] = coordination
+    if expected_shards is not None:
+        entry['expected_shards'] = sorted(expected_shards)
+    return entry
+
+
+def get_missing_shards(entries: list):
+    """Returns the backup names which the entries of the nodes of one backup expect, but which no node has stored."""
+    expected = set()
+    stored = set()
+    for entry in entries:
+        stored.update(entry['shards'])
+        expected.update(entry.get('expected_shards', entry['shards']))
+    return sorted(expected - stored)
+
+
+def is_consistent(entries: list):
+    """Returns whether every shard of a coordinated backup was snapshotted at its planned generation."""
+    return all(entry.get('coordination', {}).get('consistent', True) for entry in entries)
+
+
+def is_complete(entries: list, require_consistent: bool = False):
+    """
+    Returns whether the entries of one backup contain every expected shard. With `require_consistent` the shards of a
+    coordinated backup also have to be snapshotted at a consistent point in time.
+    """
+    return bool(entries) and not get_missing_shards(entries) and (not require_consistent or is_consistent(entries))
+
+
+def create_latest(entry_key: str, entry: dict):
+    return {
+        'version': CATALOG_VERSION,
+        'timestamp': entry['timestamp'],
+        'entry': entry_key,
+        'finished': entry['finished'],
+    }
+
+
+def dumps(content: dict):
+    return json.dumps(content, indent=2, sort_keys=True).encode('utf-8')
+
+
+def loads(data: bytes, key: str):
+    content = json.loads(data.decode('utf-8'))
+    if content.get('version') != CATALOG_VERSION:
+        raise Exception('Unsupported catalog version [{}] in [{}]'.format(content.get('version'), key))
+    return content
+
+
+def is_newer(timestamp: str, latest: dict):
+    return latest is None or timestamp >= latest['timestamp']
+
+
+def get_catalog_timestamps(prefixes: list):
+    """Returns the backup timestamps of a listing of the catalog prefix, newest first."""
+    return sorted((match.group(1) for match in (re.match(REGEX_CATALOG_PREFIX, prefix) for prefix in prefixes)
+                   if match), reverse=True)
+
+
+def find_latest_timestamp(prefixes: list):
+    """Returns the newest backup timestamp of a bucket listing, for buckets written before the catalog existed."""
+    timestamps = [match.group(1) for match in (re.match(REGEX_TIMESTAMP_PREFIX, prefix) for prefix in prefixes)
+                  if match]
+    return max(timestamps) if timestamps else None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cluster-wide backup plan shared through ZooKeeper.
+
+In coordinated mode the backup jobs of all nodes agree on one plan per backup run. The first node which takes the
+coordinator lock commits all collections once, records the index generation of the elected replica of every shard
+and publishes the plan with one backup ID. Nodes which take the lock later in the same run join this plan instead of
+creating their own, so all shards end up under one prefix. Every node only snapshots the planned replicas it hosts
+and checks the `segments_<generation>` file of each snapshot against the plan. The ID of the last plan of every node is
+kept in ZooKeeper as well, so a restarted job does not execute the same plan twice.
+"""
+
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+
+PLAN_VERSION = 1
+ZK_ROOT = '/solr_backup'
+LOCK_PATH = ZK_ROOT + '/lock'
+PLAN_PATH = ZK_ROOT + '/plan'
+NODES_PATH = ZK_ROOT + '/nodes'
+
+# A plan is joined by all backup jobs which start within this time after it was created
+DEFAULT_PLAN_WINDOW_IN_SECONDS = 1800
+DEFAULT_LOCK_TIMEOUT_IN_SECONDS = 900
+
+SEGMENTS_PREFIX = 'segments_'
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def to_base36(number: int):
+    """Formats a number like Java's `Long.toString(number, Character.MAX_RADIX)`, which Lucene uses for generations."""
+    if number == 0:
+        return '0'
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36_DIGITS[remainder])
+    return ''.join(reversed(digits))
+
+
+def get_segments_file_name(generation: int):
+    return SEGMENTS_PREFIX + to_base36(generation)
+
+
+def get_snapshot_generation(snapshot_dir: str):
+    """Returns the generation of the commit point in a snapshot directory or None if it has no segments file."""
+    generations = [int(file_name[len(SEGMENTS_PREFIX):], 36) for file_name in os.listdir(snapshot_dir)
+                   if file_name.startswith(SEGMENTS_PREFIX)]
+    return max(generations) if generations else None
+
+
+def get_plan_window(start_delay: float = 0, interval: float = None):
+    """
+    Returns the plan window for jobs which start up to `start_delay` seconds after the scheduled time of their run,
+    e.g. staggered or deferred by load. The window never reaches into the next run `interval` seconds later.
+    """
+    plan_window = DEFAULT_PLAN_WINDOW_IN_SECONDS + start_delay
+    return min(plan_window, interval) if interval else plan_window
+
+
+def create_plan_shard(collection_name: str, shard_name: str, node_name: str, generation: int):
+    return {'collection': collection_name, 'shard': shard_name, 'node': node_name, 'generation': generation}
+
+
+def create_plan(backup_id: str, coordinator: str, shards: dict):
+    """`shards` maps the core name of the planned replica of every shard to its `create_plan_shard` record."""
+    return {
+        'version': PLAN_VERSION,
+        'backup_id': backup_id,
+        'coordinator': coordinator,
+        'created': time.time(),
+        'shards': shards,
+    }
+
+
+def dumps(plan: dict):
+    return json.dumps(plan, sort_keys=True).encode('utf-8')
+
+
+def loads(data: bytes):
+    plan = json.loads(data.decode('utf-8'))
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError('Unsupported backup plan version [{}]'.format(plan.get('version')))
+    return plan
+
+
+class BackupCoordinator:
+
+    def __init__(self, zk, node_name: str, plan_window: float = DEFAULT_PLAN_WINDOW_IN_SECONDS,
+                 lock_timeout: float = DEFAULT_LOCK_TIMEOUT_IN_SECONDS):
+        """`zk` is a started kazoo client."""
+        self.__zk = zk
+        self.__node_name = node_name
+        self.__plan_window = plan_window
+        self.__lock_timeout = lock_timeout
+
+    def get_plan(self, create_plan_function):
+        """
+        Returns the plan of the current backup run. If no node started the run yet, this node becomes its coordinator
+        and creates the plan with `create_plan_function()` while it holds the lock.
+        """
+        with self.locked():
+            plan = self.read_plan()
+            # A plan which this node has already executed belongs to the previous run
+            if (plan is not None and plan['backup_id'] != self.__read_last_backup_id() and
+                    time.time() - plan['created'] < self.__plan_window):
+                logging.info('Joining backup [{}] planned by [{}].'.format(plan['backup_id'], plan['coordinator']))
+                self.__write_last_backup_id(plan['backup_id'])
+                return plan
+            logging.info('Coordinating the backup of the cluster.')
+            plan = create_plan_function()
+            self.__zk.ensure_path(ZK_ROOT)
+            if self.__zk.exists(PLAN_PATH):
+                self.__zk.set(PLAN_PATH, dumps(plan))
+            else:
+                self.__zk.create(PLAN_PATH, dumps(plan))
+            logging.info('Published plan for backup [{}] of [{}] shards.'.format(plan['backup_id'],
+                                                                                 len(plan['shards'])))
+            self.__write_last_backup_id(plan['backup_id'])
+            return plan
+
+    @contextmanager
+    def locked(self):
+        """Holds the lock which serializes the backup jobs of all nodes for the duration of the block."""
+        lock = self.__zk.Lock(LOCK_PATH, self.__node_name)
+        # Raises a `LockTimeout` if the coordinator of the run holds the lock for too long
+        lock.acquire(timeout=self.__lock_timeout)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def read_plan(self):
+        if not self.__zk.exists(PLAN_PATH):
+            return None
+        data, stat = self.__zk.get(PLAN_PATH)
+        return loads(data) if data else None
+
+    def __read_last_backup_id(self):
+        path = self.__get_node_path()
+        if not self.__zk.exists(path):
+            return None
+        data, stat = self.__zk.get(path)
+        return data.decode('utf-8') if data else None
+
+    def __write_last_backup_id(self, backup_id: str):
+        path = self.__get_node_path()
+        self.__zk.ensure_path(NODES_PATH)
+        if self.__zk.exists(path):
+            self.__zk.set(path, backup_id.encode('utf-8'))
+        else:
+            self.__zk.create(path, backup_id.encode('utf-8'))
+
+    def __get_node_path(self):
+        return NODES_PATH + '/' + self.__node_name
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Staggered and load-aware scheduling of backups.
+
+Scheduled backups of all nodes fire at the same time. A `StaggeredJob` delays the run of every node by an offset
+within a window, which is derived from a hash of the node name, so the nodes start one after another and every node
+keeps its place in the order across runs. The backup ID is still taken from the scheduled time, so all nodes store
+their shards under the same prefix.
+
+A `LoadGate` samples the request counters and request time percentiles of the search handlers of the local cores from
+`admin/mbeans`. It defers a backup, and pauses it between shards, while the local query rate or 99th percentile
+request time is above its threshold, for at most a maximum deferral per wait.
+"""
+
+import hashlib
+import logging
+import time
+
+from datetime import datetime
+from scripts import solr_client
+
+MBEANS_PATH = '/admin/mbeans?stats=true&cat=QUERYHANDLER&wt=json'
+SEARCH_HANDLER_CLASS_SUFFIX = 'SearchHandler'
+
+DEFAULT_SAMPLE_INTERVAL_IN_SECONDS = 15
+DEFAULT_MAX_DEFERRAL_IN_SECONDS = 3600
+
+
+def get_stagger_offset(node_name: str, window: int):
+    """Returns the delay of the node in seconds, evenly distributed over `[0, window)` for different node names."""
+    if window <= 0:
+        return 0
+    digest = hashlib.sha256(node_name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % window
+
+
+class StaggeredJob:
+
+    def __init__(self, function, node_name: str, window: int, sleep=time.sleep):
+        """`function(backup_id=...)` is called `get_stagger_offset(node_name, window)` seconds after the job fired."""
+        self.__function = function
+        self.__sleep = sleep
+        self.offset = get_stagger_offset(node_name, window)
+
+    def __call__(self, **kwargs):
+        backup_id = datetime.utcnow().strftime('%Y%m%d%H%M')
+        logging.info('Starting backup [{}] after a stagger delay of [{}] seconds.'.format(backup_id, self.offset))
+        self.__sleep(self.offset)
+        return self.__function(backup_id=backup_id, **kwargs)
+
+
+class LoadSample:
+
+    def __init__(self, requests: int, p99: float, timestamp: float):
+        self.requests = requests
+        self.p99 = p99
+        self.timestamp = timestamp
+
+
+def get_search_handler_stats(response: dict):
+    """Returns the stats of the search handlers from an `admin/mbeans` response by handler name."""
+    # The categories are returned as a flat list of alternating names and values
+    mbeans = response.get('solr-mbeans', [])
+    handlers = dict(zip(mbeans[::2], mbeans[1::2])).get('QUERYHANDLER', {})
+    return {name: handler.get('stats') or {} for name, handler in handlers.items()
+            if name.startswith('/') and handler.get('class', '').endswith(SEARCH_HANDLER_CLASS_SUFFIX)}
+
+
+class QueryStats:
+
+    def __init__(self, http_client: solr_client.SolrHttpClient, solr_base_url: str, get_cores, clock=time.time):
+        """`get_cores` returns the names of the local cores."""
+        self.__http_client = http_client
+        self.__solr_base_url = solr_base_url
+        self.__get_cores = get_cores
+        self.__clock = clock
+
+    def sample(self):
+        """Returns the request count summed over the search handlers of all local cores and their highest p99."""
+        requests = 0
+        p99 = 0.0
+        for core_name in self.__get_cores():
+            try:
+                response = self.__http_client.get_json(self.__solr_base_url + '/' + core_name + MBEANS_PATH)
+            except solr_client.SolrError as e:
+                logging.debug('Could not read query stats of [{}]: {}'.format(core_name, e))
+                continue
+            for stats in get_search_handler_stats(response).values():
+                requests += int(stats.get('requests', 0))
+                p99 = max(p99, float(stats.get('99thPcRequestTime', 0.0)))
+        return LoadSample(requests, p99, self.__clock())
+
+
+class LoadGate:
+
+    def __init__(self, query_stats: QueryStats, max_query_rate: float = None, max_p99: float = None,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL_IN_SECONDS,
+                 max_deferral: float = DEFAULT_MAX_DEFERRAL_IN_SECONDS, sleep=time.sleep, clock=time.time):
+        """
+        `max_query_rate` is given in requests per second over all local cores, `max_p99` in milliseconds, None
+        disables the threshold.
+        """
+        self.__query_stats = query_stats
+        self.__max_query_rate = max_query_rate
+        self.__max_p99 = max_p99
+        self.__sample_interval = sample_interval
+        self.__max_deferral = max_deferral
+        self.__sleep = sleep
+        self.__clock = clock
+
+    def wait(self, description: str):
+        """
+        Blocks until the query load is below the thresholds or the maximum deferral has passed and returns the number
+        of seconds it waited.
+        """
+        if self.__max_query_rate is None and self.__max_p99 is None:
+            return 0
+        started = self.__clock()
+        previous = self.__query_stats.sample()
+        # The p99 is known from the first sample, only the query rate needs a second one
+        if self.__max_query_rate is None and not self.__is_overloaded(0, previous.p99):
+            return 0
+        while True:
+            self.__sleep(self.__sample_interval)
+            current = self.__query_stats.sample()
+            query_rate = (current.requests - previous.requests) / max(current.timestamp - previous.timestamp, 1e-3)
+            waited = current.timestamp - started
+            if not self.__is_overloaded(query_rate, current.p99):
+                if waited > self.__sample_interval:
+                    logging.info('Query load dropped, continuing [{}] after [{:.0f}] seconds.'
+                                 .format(description, waited))
+                return waited
+            if waited >= self.__max_deferral:
+                logging.warning('Query load is still high after [{:.0f}] seconds, continuing [{}] anyway.'
+                                .format(waited, description))
+                return waited
+            logging.info('Deferring [{}], local query rate is [{:.1f}/s] and p99 request time [{:.0f} ms].'
+                         .format(description, query_rate, current.p99))
+            previous = current
+
+    def __is_overloaded(self, query_rate: float, p99: float):
+        return (self.__max_query_rate is not None and query_rate > self.__max_query_rate) or \
+            (self.__max_p99 is not None and p99 > self.__max_p99)
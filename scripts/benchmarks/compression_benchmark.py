@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Measures archive throughput of the block-parallel codecs against `tar -czf` on a synthetic Lucene-like segment set.
+
+    python3 -m scripts.benchmarks.compression_benchmark --size-mb 256 --workers 1 2 4 8
+"""
+
+import io
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from scripts import compression
+
+SNAPSHOT_NAME = 'snapshot.benchmark_shard1'
+WORDS = ['solr', 'lucene', 'shard', 'replica', 'collection', 'segment', 'index', 'query', 'document', 'field',
+         'backup', 'restore', 'cluster', 'leader', 'commit', 'merge', 'token', 'term', 'score', 'facet']
+
+# Share of the segment set per file type, roughly matching a text heavy index
+FILE_TYPES = [('fdt', 0.35), ('doc', 0.2), ('pos', 0.2), ('tim', 0.1), ('dvd', 0.1), ('nvd', 0.05)]
+
+
+def generate_segment_file(extension: str, size: int, rng: random.Random):
+    if extension == 'fdt':
+        # Stored fields are LZ4 compressed by Lucene, mix incompressible blocks with plain text
+        chunks = []
+        while sum(map(len, chunks)) < size:
+            chunks.append(os.urandom(2048))
+            chunks.append(' '.join(rng.choice(WORDS) for _ in range(300)).encode('utf-8'))
+        return b''.join(chunks)[:size]
+    elif extension in ('doc', 'pos'):
+        # Postings are packed blocks of small deltas
+        return bytes(rng.getrandbits(5) for _ in range(size))
+    elif extension == 'tim':
+        terms = sorted('{}{}'.format(rng.choice(WORDS), rng.randint(0, 100000)) for _ in range(size // 8))
+        return '\n'.join(terms).encode('utf-8')[:size]
+    elif extension == 'dvd':
+        return b''.join(struct.pack('<q', 1460000000000 + rng.randint(0, 10 ** 6)) for _ in range(size // 8))
+    else:
+        return bytes(rng.randint(100, 110) for _ in range(size))
+
+
+def generate_snapshot(directory: str, size: int, segments: int = 4):
+    rng = random.Random(42)
+    snapshot_dir = os.path.join(directory, SNAPSHOT_NAME)
+    os.makedirs(snapshot_dir)
+    for segment in range(segments):
+        for extension, share in FILE_TYPES:
+            file_name = os.path.join(snapshot_dir, '_{}.{}'.format(segment, extension))
+            with open(file_name, 'wb') as f:
+                f.write(generate_segment_file(extension, int(size * share / segments), rng))
+    return snapshot_dir
+
+
+def measure(function):
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+
+def benchmark_codec(directory: str, size: int, codec, workers: int):
+    archive = io.BytesIO()
+    compress_time, _ = measure(lambda: compression.write_archive(archive, directory, SNAPSHOT_NAME, codec,
+                                                                 workers=workers))
+    destination = tempfile.mkdtemp(dir=directory)
+    archive.seek(0)
+    decompress_time, _ = measure(lambda: compression.extract_archive(archive, destination, codec, workers=workers))
+    shutil.rmtree(destination)
+    return compress_time, decompress_time, len(archive.getvalue())
+
+
+def benchmark_tar(directory: str):
+    archive_file_name = os.path.join(directory, 'backup.tar.gz')
+    compress_time, _ = measure(lambda: subprocess.check_call(['tar', '-czf', archive_file_name, '-C', directory,
+                                                              SNAPSHOT_NAME]))
+    destination = tempfile.mkdtemp(dir=directory)
+    decompress_time, _ = measure(lambda: subprocess.check_call(['tar', '-xzf', archive_file_name, '-C',
+                                                                destination]))
+    archive_size = os.path.getsize(archive_file_name)
+    shutil.rmtree(destination)
+    os.remove(archive_file_name)
+    return compress_time, decompress_time, archive_size
+
+
+def print_result(name: str, workers: int, size: int, result):
+    compress_time, decompress_time, archive_size = result
+    cores = min(workers, os.cpu_count() or 1)
+    mb = size / (1024 * 1024)
+    print('{:<14} {:>7} {:>8.1f} {:>13.1f} {:>10.1f} {:>15.1f} {:>7.3f}'.format(
+        name, workers, mb / compress_time, mb / compress_time / cores, mb / decompress_time,
+        mb / decompress_time / cores, archive_size / size))
+
+
+def main():
+    parser = ArgumentParser(description='Compression benchmark on a synthetic Lucene-like segment set')
+    parser.add_argument('--size-mb', type=int, default=128, help='Size of the synthetic segment set')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                        help='Numbers of compression workers to measure')
+    args = parser.parse_args(sys.argv[1:])
+
+    directory = tempfile.mkdtemp()
+    try:
+        snapshot_dir = generate_snapshot(directory, args.size_mb * 1024 * 1024)
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, f)) for f in os.listdir(snapshot_dir))
+        print('Segment set of {:.1f} MB on {} cores'.format(size / (1024 * 1024), os.cpu_count()))
+        print('{:<14} {:>7} {:>8} {:>13} {:>10} {:>15} {:>7}'.format(
+            'codec', 'workers', 'comp MB/s', 'comp MB/s/core', 'dec MB/s', 'dec MB/s/core', 'ratio'))
+        print_result('tar -czf', 1, size, benchmark_tar(directory))
+        codecs = [(compression.CODEC_GZIP, 1), (compression.CODEC_GZIP, 6)]
+        if compression.zstandard is not None:
+            codecs += [(compression.CODEC_ZSTD, 1), (compression.CODEC_ZSTD, 3)]
+        for codec_name, level in codecs:
+            for workers in args.workers:
+                result = benchmark_codec(directory, size, compression.get_codec(codec_name, level), workers)
+                print_result('{}-{}'.format(codec_name, level), workers, size, result)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compares the query latency under the fixed heap share of 30% with the index-aware sizing of `jvm_sizing`.
+
+Dropping the page cache needs root on the host, so the page cache is simulated: every query reads blocks of the
+index with a Zipf distribution through an LRU cache of the size left next to the heap. Cache misses cost the read
+latency of the disk, hits the latency of a memory mapped read.
+
+    python3 -m scripts.benchmarks.jvm_sizing_benchmark --queries 20000 --miss-latency-ms 0.5
+"""
+
+import bisect
+import random
+import sys
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from scripts import jvm_sizing
+
+GB = jvm_sizing.GB
+BLOCK_SIZE = 1024 * 1024
+BLOCKS_PER_QUERY = 40
+HIT_LATENCY_MS = 0.002
+FIXED_HEAP_PERCENT = 30
+
+# Memory, cores and index size of typical nodes
+SCENARIOS = [(16 * GB, 4, 6 * GB), (30 * GB, 4, 22 * GB), (61 * GB, 8, 40 * GB), (122 * GB, 16, 70 * GB),
+             (122 * GB, 16, 150 * GB)]
+
+
+def get_page_cache_size(total_memory: int, heap_size: int):
+    os_reserve = max(jvm_sizing.MIN_OS_RESERVE, total_memory * jvm_sizing.OS_RESERVE_PERCENT // 100)
+    return max(0, total_memory - os_reserve - heap_size)
+
+
+def zipf_distribution(blocks: int, exponent: float):
+    cumulative = []
+    total = 0.0
+    for rank in range(1, blocks + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return [value / total for value in cumulative]
+
+
+def simulate(index_size: int, page_cache_size: int, queries: int, miss_latency_ms: float, exponent: float):
+    """Returns the cache hit rate and the median and 99th percentile query latency in milliseconds."""
+    blocks = max(1, index_size // BLOCK_SIZE)
+    capacity = page_cache_size // BLOCK_SIZE
+    distribution = zipf_distribution(blocks, exponent)
+    # Hot blocks are spread over the index instead of being its first blocks
+    layout = list(range(blocks))
+    rng = random.Random(42)
+    rng.shuffle(layout)
+    # The index has just been written by a restore or replication, so the page cache holds its most recent blocks
+    cache = OrderedDict((block, True) for block in layout[max(0, blocks - capacity):])
+    hits = 0
+    latencies = []
+    for _ in range(queries):
+        latency = 0.0
+        for _ in range(BLOCKS_PER_QUERY):
+            block = layout[min(bisect.bisect_left(distribution, rng.random()), blocks - 1)]
+            if block in cache:
+                cache.move_to_end(block)
+                hits += 1
+                latency += HIT_LATENCY_MS
+            else:
+                latency += miss_latency_ms
+                if capacity:
+                    cache[block] = True
+                    if len(cache) > capacity:
+                        cache.popitem(last=False)
+        latencies.append(latency)
+    measured = sorted(latencies)
+    return (hits / (queries * BLOCKS_PER_QUERY), measured[len(measured) // 2],
+            measured[int(len(measured) * 0.99)])
+
+
+def main():
+    parser = ArgumentParser(description='Query latency under fixed and index-aware JVM sizing')
+    parser.add_argument('--queries', type=int, default=20000, help='Number of simulated queries per scenario')
+    parser.add_argument('--miss-latency-ms', type=float, default=0.5, help='Read latency of the disk')
+    parser.add_argument('--zipf', type=float, default=0.8, help='Skew of the block accesses')
+    args = parser.parse_args(sys.argv[1:])
+
+    print('{:>6} {:>5} {:>9} {:<8} {:>8} {:>10} {:>8} {:>8} {:>8}'.format(
+        'memory', 'cores', 'index', 'sizing', 'heap', 'page cache', 'hit rate', 'p50 ms', 'p99 ms'))
+    for total_memory, core_count, index_size in SCENARIOS:
+        computed = jvm_sizing.compute_sizing(total_memory, core_count, index_size)
+        for name, heap_size in [('fixed', total_memory * FIXED_HEAP_PERCENT // 100), ('computed', computed.heap_size)]:
+            page_cache_size = get_page_cache_size(total_memory, heap_size)
+            hit_rate, p50, p99 = simulate(index_size, page_cache_size, args.queries, args.miss_latency_ms, args.zipf)
+            print('{:>4.0f}GB {:>5} {:>7.0f}GB {:<8} {:>6.1f}GB {:>8.1f}GB {:>8.3f} {:>8.2f} {:>8.2f}'.format(
+                total_memory / GB, core_count, index_size / GB, name, heap_size / GB, page_cache_size / GB,
+                hit_rate, p50, p99))
+
+
+if __name__ == '__main__':
+    main()
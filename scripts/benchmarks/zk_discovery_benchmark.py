@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Measures the cold-start time of the ZooKeeper ensemble discovery against a local Exhibitor stand-in with and without
+a cached ensemble, for a healthy, a slow and an unreachable Exhibitor.
+
+    python3 -m scripts.benchmarks.zk_discovery_benchmark --slow-delay 10 --runs 5
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from scripts import get_zk_servers
+
+
+class ExhibitorHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = json.dumps({'servers': self.server.servers, 'port': self.server.zk_port}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Exhibitor(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, servers: list, zk_port: int, delay: float):
+        super().__init__(('127.0.0.1', 0), ExhibitorHandler)
+        self.servers = servers
+        self.zk_port = zk_port
+        self.delay = delay
+        self.api = 'http://127.0.0.1:{}/exhibitor/v1'.format(self.server_port)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+
+def get_unused_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_start(exhibitor_api: str, cache_file: str):
+    """Returns the seconds until the connect string is known or None if discovery failed."""
+    start = time.time()
+    try:
+        cluster_list = get_zk_servers.discover(exhibitor_api, cache_file)
+    except Exception:
+        return None
+    get_zk_servers.get_connect_string(get_zk_servers.order_servers(cluster_list['servers'], cluster_list['port']),
+                                      cluster_list['port'])
+    return time.time() - start
+
+
+def main():
+    parser = ArgumentParser(description='Cold-start benchmark of the ZooKeeper ensemble discovery')
+    parser.add_argument('--slow-delay', type=float, default=10, help='Response delay of the slow Exhibitor')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs per scenario')
+    args = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.ERROR)
+
+    # One reachable ZooKeeper stand-in and two addresses which refuse connections
+    zk_server = socket.socket()
+    zk_server.bind(('127.0.0.1', 0))
+    zk_server.listen(16)
+    servers = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+    zk_port = zk_server.getsockname()[1]
+
+    directory = tempfile.mkdtemp()
+    try:
+        scenarios = [
+            ('healthy', Exhibitor(servers, zk_port, 0).api),
+            ('slow', Exhibitor(servers, zk_port, args.slow_delay).api),
+            ('unreachable', 'http://127.0.0.1:{}/exhibitor/v1'.format(get_unused_port())),
+        ]
+        print('{:<12} {:>14} {:>14}'.format('exhibitor', 'no cache (s)', 'cache (s)'))
+        for name, exhibitor_api in scenarios:
+            results = []
+            for cached in (False, True):
+                cache_file = os.path.join(directory, name + '.json')
+                if cached:
+                    get_zk_servers.write_cache(cache_file, {'servers': servers, 'port': zk_port})
+                elif os.path.exists(cache_file):
+                    os.remove(cache_file)
+                times = [measure_start(exhibitor_api, cache_file) for _ in range(args.runs if cached else 1)]
+                results.append('failed' if None in times else '{:.3f}'.format(min(times)))
+            print('{:<12} {:>14} {:>14}'.format(name, *results))
+    finally:
+        zk_server.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup of a SolrCloud node.
+
+Independent phases run concurrently: the lookup of the latest backup runs while the ZooKeeper ensemble is
+discovered, the collection reload after a configuration update and the launch of the backup job run while Solr starts.
+Solr is started as soon as the ensemble is known and the configurations are uploaded. The restore of the latest
+backup is started once the local Solr has loaded its cores and is awaited, so its result is known. The duration of
+every phase is logged and written to `/data/logs/bootstrap_timings.json` to track the time to serving across releases.
+"""
+
+import json
+import logging
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+from concurrent.futures import Future
+from threading import Lock, Thread
+from scripts import check_and_update_solr_configs
+from scripts import get_zk_servers
+from scripts import jvm_sizing
+from scripts import solr_client
+
+DATA_DIR = '/data'
+LOG_DIR = '/data/logs'
+BACKUP_DIR = '/backup'
+TIMINGS_FILE = '/data/logs/bootstrap_timings.json'
+SOLR_BIN = '/opt/solr/bin/solr'
+LOCAL_URL = 'http://localhost:8983/solr'
+CORE_STATUS_URL = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+
+BACKUP_INTERVALS = ['weekly', 'daily', 'hourly', 'test']
+JAVA_OPTS = [
+    '-javaagent:/opt/jolokia-jvm-1.3.2-agent.jar=port=8778,host=0.0.0.0',
+    '-Xloggc:/data/logs/solr_gc.log',
+    '-Dcom.sun.management.jmxremote',
+    '-Dcom.sun.management.jmxremote.port=48983',
+    '-Dcom.sun.management.jmxremote.authenticate=false',
+    '-Dcom.sun.management.jmxremote.ssl=false',
+]
+
+DEFAULT_SOLR_START_TIMEOUT_IN_SECONDS = 600
+POLL_INTERVAL_IN_SECONDS = 1
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+
+class PhaseTimer:
+    """Records start, duration and outcome of every phase relative to the start of the bootstrap."""
+
+    def __init__(self):
+        self.__started = time.time()
+        self.__phases = []
+        self.__lock = Lock()
+
+    def run(self, name: str, function, *args):
+        """Runs a phase and returns its result, exceptions are recorded and raised again."""
+        start = time.time()
+        logging.info('Phase [{}] started.'.format(name))
+        status = STATUS_FAILED
+        try:
+            result = function(*args)
+            status = STATUS_OK if result is not False else STATUS_FAILED
+            return result
+        finally:
+            self.record(name, start, time.time(), status)
+
+    def record(self, name: str, start: float, end: float, status: str):
+        logging.info('Phase [{}] finished with status [{}] after [{:.1f}] seconds.'.format(name, status, end - start))
+        with self.__lock:
+            self.__phases.append({'phase': name, 'start': round(start - self.__started, 3),
+                                  'duration': round(end - start, 3), 'status': status})
+
+    def get_report(self):
+        with self.__lock:
+            phases = sorted(self.__phases, key=lambda phase: phase['start'])
+            return {'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.__started)),
+                    'total': round(time.time() - self.__started, 3), 'phases': phases}
+
+    def format_report(self):
+        report = self.get_report()
+        lines = ['{:<16} {:>9} {:>12} {:>8}'.format('phase', 'start (s)', 'duration (s)', 'status')]
+        lines.extend('{:<16} {:>9.1f} {:>12.1f} {:>8}'.format(phase['phase'], phase['start'], phase['duration'],
+                                                               phase['status']) for phase in report['phases'])
+        lines.append('{:<16} {:>9} {:>12.1f}'.format('total', '', report['total']))
+        return '\n'.join(lines)
+
+
+def prepare_directories():
+    shutil.copy('/solr.xml', DATA_DIR)
+    shutil.copy('/zoo.cfg', DATA_DIR)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+
+
+def discover_zk_hosts(exhibitor_api: str):
+    cache_file = os.getenv('ZK_SERVERS_CACHE', get_zk_servers.DEFAULT_CACHE_FILE)
+    cluster_list = get_zk_servers.discover(exhibitor_api, cache_file)
+    port = cluster_list['port']
+    return get_zk_servers.get_connect_string(get_zk_servers.order_servers(cluster_list['servers'], port), port)
+
+
+def get_backup_command(command: str, *args):
+    return ([sys.executable, '-m', 'scripts.solrcloud_backup'] + shlex.split(os.getenv('SOLR_BACKUP_OPTIONS', '')) +
+            ['-b', os.environ['SOLR_BACKUP_BUCKET']] + list(args) + [command])
+
+
+def find_latest_backup():
+    """Returns the timestamp of the newest complete backup or None if there is none."""
+    result = subprocess.run(get_backup_command('latest'), stdout=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def get_solr_command(sizing: jvm_sizing.Sizing):
+    java_opts = ' '.join(([os.environ['JAVA_OPTS']] if os.getenv('JAVA_OPTS') else []) + JAVA_OPTS)
+    return [SOLR_BIN, 'start', '-cloud', '-f', '-s', DATA_DIR, '-m', sizing.get_heap_option(), '-a', java_opts]
+
+
+def start_solr():
+    sizing = jvm_sizing.size_jvm(DATA_DIR)
+    env = dict(os.environ)
+    if sizing.gc_tune:
+        env['GC_TUNE'] = sizing.gc_tune
+    return subprocess.Popen(get_solr_command(sizing), env=env)
+
+
+def wait_for_cores(http_client, solr_process, timeout: float = DEFAULT_SOLR_START_TIMEOUT_IN_SECONDS):
+    """Waits until the local Solr answers the core status, which it does once all cores are loaded."""
+    deadline = time.time() + timeout
+    while True:
+        if solr_process.poll() is not None:
+            raise RuntimeError('Solr exited with code [{}] during startup'.format(solr_process.returncode))
+        try:
+            status = http_client.get_json(CORE_STATUS_URL, solr_client.STATUS)
+            if status.get('initFailures'):
+                logging.warning('Cores failed to load: [{}]'.format(', '.join(sorted(status['initFailures']))))
+            return sorted(status.get('status', {}))
+        except solr_client.SolrError as e:
+            if time.time() >= deadline:
+                raise solr_client.RequestTimeout('Solr not ready after [{}] seconds: {}'.format(timeout, e))
+        time.sleep(POLL_INTERVAL_IN_SECONDS)
+
+
+def sync_configs(zk_hosts: str):
+    return check_and_update_solr_configs.sync_configs(zk_hosts, check_and_update_solr_configs.get_local_configs())
+
+
+def write_report(timer: PhaseTimer):
+    logging.info('Bootstrap phase timings:\n' + timer.format_report())
+    try:
+        with open(TIMINGS_FILE, 'w') as f:
+            json.dump(timer.get_report(), f, indent=2)
+    except OSError as e:
+        logging.warning('Could not write bootstrap timings to [{}]: {}'.format(TIMINGS_FILE, e))
+
+
+def is_true(value: str):
+    return (value or '').lower() == 'true'
+
+
+def run_in_background(function, *args):
+    """Runs the function in a daemon thread and returns its future, so an early exit does not wait for it."""
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    Thread(target=run, daemon=True).start()
+    return future
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    exhibitor_api = os.getenv('ZK_API')
+    if not exhibitor_api:
+        logging.error('Missing environment variable [ZK_API].')
+        return 1
+    backup_interval = os.getenv('BACKUP_INTERVAL')
+    backup_enabled = backup_interval in BACKUP_INTERVALS
+    restore_enabled = is_true(os.getenv('RESTORE_LATEST_BACKUP'))
+    if (backup_enabled or restore_enabled) and not os.getenv('SOLR_BACKUP_BUCKET'):
+        logging.error('Parameter SOLR_BACKUP_BUCKET is empty')
+        return 1
+
+    timer = PhaseTimer()
+    timer.run('prepare', prepare_directories)
+    latest = run_in_background(timer.run, 'latest_lookup', find_latest_backup) if restore_enabled else None
+    try:
+        zk_hosts = timer.run('zk_discovery', discover_zk_hosts, exhibitor_api)
+    except Exception as e:
+        logging.error('Could not get list of Zookeeper servers: {}'.format(e))
+        return 1
+    os.environ['ZK_HOST'] = zk_hosts
+
+    try:
+        updated_collections = timer.run('config_sync', sync_configs, zk_hosts)
+    except Exception as e:
+        logging.error('Configurations could not be updated: {}'.format(e))
+        updated_collections = []
+
+    solr = timer.run('solr_start', start_solr)
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda received, frame: solr.send_signal(received))
+
+    tasks = []
+    if updated_collections and os.getenv('SOLR_BASE_URL'):
+        tasks.append(run_in_background(timer.run, 'config_reload', check_and_update_solr_configs.reload_collections,
+                                       os.environ['SOLR_BASE_URL'], updated_collections))
+    if backup_enabled:
+        timer.run('backup_daemon', subprocess.Popen, get_backup_command('backup', '-c', backup_interval))
+    else:
+        logging.info('Backup job is not configured to be started')
+
+    http_client = solr_client.SolrHttpClient()
+    try:
+        cores = timer.run('solr_ready', wait_for_cores, http_client, solr)
+        logging.info('Solr is ready with [{}] cores.'.format(len(cores)))
+        timestamp = latest.result() if latest else None
+        if timestamp:
+            logging.info('Start to restore latest backup [{}]'.format(timestamp))
+            tasks.append(run_in_background(timer.run, 'restore', lambda: subprocess.call(
+                get_backup_command('restore', '-t', timestamp)) == 0))
+        elif restore_enabled:
+            logging.info('No complete backup found, startup with empty index')
+        for task in tasks:
+            try:
+                task.result()
+            except Exception as e:
+                logging.error('Bootstrap task failed: {}'.format(e))
+    except Exception as e:
+        logging.error('Solr did not become ready: {}'.format(e))
+    finally:
+        http_client.close()
+        write_report(timer)
+
+    return solr.wait()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,81 +1,96 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import logging
 import os
-import subprocess
 import sys
-import urllib.error
-import urllib.request
 
-EXHIBITOR = os.environ.get('ZK_HOST')
-if not EXHIBITOR:
-    print("ERROR Environment variable ZK_HOST not set.")
-    sys.exit(1)
+from kazoo.client import KazooClient
+from kazoo.exceptions import KazooException
+from kazoo.handlers.threading import KazooTimeoutError
+from scripts import collection_reload
+from scripts import config_sync
+from scripts import solr_client
+from scripts import workers
 
-SOLR_BASE_URL = os.environ.get('SOLR_BASE_URL')
-if not SOLR_BASE_URL:
-    print("ERROR Environment variable SOLR_BASE_URL not set.")
-    sys.exit(1)
-
-ENV = os.environ.get('ENVIRONMENT')
-
-SOLR_API = SOLR_BASE_URL + '/admin/collections'
 ENVIRONMENTS = ['live', 'test']
-ZK_CLI = '/opt/solr/server/scripts/cloud-scripts/zkcli.sh'
 CONFIG_DIR = os.path.join(os.getcwd(), 'configs')
+ZK_CONNECT_TIMEOUT_IN_SECONDS = 30
+
+
+def get_local_configs():
+    """Returns the local config directory of every remote config name, per environment."""
+    local_configs = {}
+    for env in ENVIRONMENTS:
+        for local_config in sorted(os.listdir(CONFIG_DIR)):
+            if env == 'live':
+                remote_config = local_config
+            else:
+                remote_config = local_config + '-' + env
+            local_configs[remote_config] = os.path.join(CONFIG_DIR, local_config)
+    return local_configs
+
+
+def get_config_name(remote_config: str):
+    return remote_config.replace('_', '')
+
+
+def sync_configs(zk_hosts: str, local_configs: dict):
+    """Updates the changed configurations in ZooKeeper and returns the names of the updated collections."""
+    collection_names = {get_config_name(remote_config): remote_config for remote_config in local_configs}
+    zk = KazooClient(hosts=zk_hosts, timeout=ZK_CONNECT_TIMEOUT_IN_SECONDS)
+    zk.start(timeout=ZK_CONNECT_TIMEOUT_IN_SECONDS)
+    try:
+        updated = config_sync.sync_configs(zk, {get_config_name(remote_config): config_dir
+                                                for remote_config, config_dir in local_configs.items()})
+    finally:
+        zk.stop()
+        zk.close()
+    return [collection_names[config_name] for config_name in sorted(updated)]
+
+
+def reload_collections(solr_base_url: str, collection_names: list):
+    """Reloads the collections concurrently and returns False if any of them failed to reload."""
+    if not collection_names:
+        return True
+    http_client = solr_client.SolrHttpClient()
+    coordinator = collection_reload.ReloadCoordinator(
+        http_client, solr_base_url,
+        max_parallel=int(os.environ.get('SOLR_RELOAD_MAX_PARALLEL', collection_reload.DEFAULT_MAX_PARALLEL)),
+        reload_timeout=float(os.environ.get('SOLR_RELOAD_TIMEOUT',
+                                            collection_reload.DEFAULT_RELOAD_TIMEOUT_IN_SECONDS)))
+    try:
+        coordinator.reload(collection_names)
+    except workers.TaskFailure as e:
+        logging.error('Could not reload collections: {}'.format(e))
+        return False
+    finally:
+        http_client.close()
+    return True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    zk_hosts = os.environ.get('ZK_HOST')
+    if not zk_hosts:
+        print("ERROR Environment variable ZK_HOST not set.")
+        return 1
+
+    solr_base_url = os.environ.get('SOLR_BASE_URL')
+    if not solr_base_url:
+        print("ERROR Environment variable SOLR_BASE_URL not set.")
+        return 1
+
+    try:
+        updated_collections = sync_configs(zk_hosts, get_local_configs())
+    except (KazooException, KazooTimeoutError, OSError) as e:
+        print("ERROR Configurations could not be updated: {}".format(e))
+        return 1
+
+    if not reload_collections(solr_base_url, updated_collections):
+        return 1
+    return 0
+
 
-for env in ENVIRONMENTS:
-    for local_config in os.listdir(CONFIG_DIR):
-        no_remote_version = False
-
-        if env == 'live':
-            remote_config = local_config
-        else:
-            remote_config = local_config + '-' + env
-
-        print("INFO Check version of configuration for [{}].".format(remote_config))
-        local_version_file = open(os.path.join(CONFIG_DIR, local_config, 'version'))
-        local_version = local_version_file.read()
-        print("INFO Local version is [{}].".format(local_version))
-        try:
-            output = subprocess.check_output([ZK_CLI, '-zkhost', EXHIBITOR, '-cmd', 'getfile', '/configs/' +
-                                              remote_config.replace('_', '') + '/version', remote_config +
-                                              '_version'], universal_newlines=True)
-            print("DEBUG " + str(output))
-        except subprocess.CalledProcessError as err:
-            no_remote_version = True
-            print("WARN Could not get version for [{}] from Exhibitor, will try to update configuration anyway."
-                  .format(remote_config))
-
-        if not no_remote_version and os.path.isfile(remote_config + '_version'):
-            remote_version_file = open(remote_config + '_version')
-            remote_version = remote_version_file.read()
-            print("INFO Remote version is [{}].".format(local_version))
-
-        if no_remote_version or (remote_version is not None and local_version != remote_version):
-            print("INFO Update configuration for [{}].".format(remote_config))
-            try:
-                output = subprocess.check_output([ZK_CLI, '-zkhost', EXHIBITOR, '-cmd', 'upconfig', '-confdir',
-                                                  os.path.join(CONFIG_DIR, local_config), '-confname',
-                                                  remote_config.replace('_', '')], universal_newlines=True)
-
-                # Reload collections after configuration update
-                collection_name = remote_config
-                url = SOLR_API + '?action=RELOAD&name=' + collection_name + '&wt=json'
-                try:
-                    request = urllib.request.Request(url)
-                    response = urllib.request.urlopen(request)
-                    code = response.getcode()
-                    response.close()
-                    if code != 200:
-                        print('ERROR Could not reload collection [{}], unexpected status code from Solr: [{}]'
-                              .format(collection_name, code))
-                        sys.exit(1)
-                except Exception as e:
-                    print('ERROR Could not reload collection [{}], failed sending request to Solr [{}]: {}'
-                          .format(collection_name, url, e))
-                    sys.exit(1)
-
-            except subprocess.CalledProcessError as err:
-                print("ERROR Configuration [{}] could not be updated.".format(remote_config))
-                sys.exit(1)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+View of the SolrCloud cluster state as returned by the CLUSTERSTATUS action of the collections API.
+
+Every node of the cluster runs its own backup job. Each job uses the cluster state to find out which of its local
+cores is the elected replica of its shard: the active leader or, while a shard has no active leader, the active
+replica with the lowest core name on a live node. Only elected replicas are backed up, so every shard is stored once
+per cluster instead of once per replica. On restore only elected replicas download their shard from S3, the other
+replicas copy the index from them.
+"""
+
+URL_PATH = '/admin/collections?action=CLUSTERSTATUS&wt=json'
+
+STATE_ACTIVE = 'active'
+
+
+class ClusterState:
+
+    def __init__(self, cluster: dict):
+        self.__live_nodes = set(cluster.get('live_nodes', []))
+        self.__replicas = {}
+        self.__shards = {}
+        for collection_name, collection in cluster.get('collections', {}).items():
+            for shard_name, shard in collection.get('shards', {}).items():
+                self.__shards[(collection_name, shard_name)] = shard
+                for replica in shard.get('replicas', {}).values():
+                    self.__replicas[replica['core']] = (collection_name, shard_name, replica)
+
+    @staticmethod
+    def from_response(response: dict):
+        """Returns the cluster state of a CLUSTERSTATUS response or None if Solr does not run in cloud mode."""
+        if not response or 'cluster' not in response:
+            return None
+        return ClusterState(response['cluster'])
+
+    def get_shard(self, core_name: str):
+        """Returns the collection and shard name of a core or None if the core is not part of the cluster."""
+        if core_name not in self.__replicas:
+            return None
+        collection_name, shard_name, replica = self.__replicas[core_name]
+        return collection_name, shard_name
+
+    def get_elected_replica(self, collection_name: str, shard_name: str):
+        """Returns the replica which is responsible for the shard or None if the shard has no active replica."""
+        shard = self.__shards.get((collection_name, shard_name))
+        # Parent shards of a split stay in the cluster state as inactive shards
+        if shard is None or shard.get('state', STATE_ACTIVE) != STATE_ACTIVE:
+            return None
+        candidates = [replica for replica in shard.get('replicas', {}).values() if self.__is_available(replica)]
+        leaders = [replica for replica in candidates if replica.get('leader') == 'true']
+        if leaders:
+            return leaders[0]
+        return min(candidates, key=lambda replica: replica['core']) if candidates else None
+
+    def is_elected(self, core_name: str):
+        shard = self.get_shard(core_name)
+        if shard is None:
+            return False
+        elected_replica = self.get_elected_replica(*shard)
+        return elected_replica is not None and elected_replica['core'] == core_name
+
+    def get_node_name(self, core_name: str):
+        """Returns the node which hosts the core or None if the core is not part of the cluster."""
+        if core_name not in self.__replicas:
+            return None
+        return self.__replicas[core_name][2].get('node_name')
+
+    def get_node_cores(self, node_name: str, shards: list):
+        """Returns the core names of the replicas of the given collection and shard names which the node hosts."""
+        return sorted(replica['core'] for shard in shards for replica in self.__shards.get(shard, {})
+                      .get('replicas', {}).values() if replica.get('node_name') == node_name)
+
+    @staticmethod
+    def get_core_url(replica: dict):
+        return replica['base_url'] + '/' + replica['core']
+
+    def has_collection(self, collection_name: str):
+        return any(name == collection_name for name, shard_name in self.__shards)
+
+    def get_replica_nodes(self, collection_name: str):
+        """
+        Returns the live nodes which host a replica of one of the collection's active shards. Nodes which are gone are
+        left out, they load the current configuration when they come back.
+        """
+        return sorted({replica.get('node_name') for (name, shard_name), shard in self.__shards.items()
+                       if name == collection_name and shard.get('state', STATE_ACTIVE) == STATE_ACTIVE
+                       for replica in shard.get('replicas', {}).values()
+                       if replica.get('node_name') in self.__live_nodes})
+
+    def get_active_shards(self):
+        """Returns the collection and shard name of every active shard."""
+        return sorted(key for key, shard in self.__shards.items() if shard.get('state', STATE_ACTIVE) == STATE_ACTIVE)
+
+    def get_shard_count(self):
+        return len(self.get_active_shards())
+
+    def __is_available(self, replica: dict):
+        return replica.get('state') == STATE_ACTIVE and replica.get('node_name') in self.__live_nodes
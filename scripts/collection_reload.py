@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Concurrent reload of collections after a configuration update.
+
+Collections are reloaded on a bounded pool, so one slow reload does not hold back the others. The RELOAD action of the
+collections API returns once every node has answered the reload of its cores. A reload only counts as done when every
+live node which hosts a replica of the collection reported its cores as reloaded. The latency of every reload is
+logged and returned, a failing collection does not stop the reload of the other collections.
+"""
+
+import logging
+import time
+import urllib.parse
+
+from scripts import cluster_state
+from scripts import solr_client
+from scripts import workers
+
+DEFAULT_MAX_PARALLEL = 4
+DEFAULT_RELOAD_TIMEOUT_IN_SECONDS = 300
+
+
+class ReloadCoordinator:
+
+    def __init__(self, http_client: solr_client.SolrHttpClient, solr_base_url: str,
+                 max_parallel: int = DEFAULT_MAX_PARALLEL, reload_timeout: float = DEFAULT_RELOAD_TIMEOUT_IN_SECONDS):
+        self.__http_client = http_client
+        self.__solr_base_url = solr_base_url
+        self.__max_parallel = max_parallel
+        self.__reload_policy = solr_client.RetryPolicy(attempts=solr_client.RELOAD.attempts,
+                                                       read_timeout=reload_timeout, retry_timeouts=False)
+
+    def reload(self, collection_names: list):
+        """
+        Reloads the collections and returns the reload latency in seconds by collection name. Raises a `TaskFailure`
+        listing every collection which failed to reload on any of its nodes.
+        """
+        pool = workers.TaskPool('reload', max(1, min(self.__max_parallel, len(collection_names))))
+        futures = {collection_name: pool.submit(collection_name, self.__reload_collection, collection_name)
+                   for collection_name in collection_names}
+        try:
+            pool.wait()
+        finally:
+            latencies = {collection_name: future.result() for collection_name, future in futures.items()
+                         if future.result() is not None}
+            if latencies:
+                logging.info('Reload latencies: {}'.format(', '.join(
+                    '{}={:.1f}s'.format(collection_name, latency) for collection_name, latency in
+                    sorted(latencies.items()))))
+        return latencies
+
+    def __reload_collection(self, collection_name: str):
+        nodes = self.__get_replica_nodes(collection_name)
+        started = time.time()
+        logging.info('Reload collection [{}].'.format(collection_name))
+        response = self.__http_client.get_json(self.__get_url('RELOAD', name=collection_name), self.__reload_policy)
+        if response.get('failure'):
+            raise solr_client.SolrError('Reload failed on [{}]'.format(', '.join(sorted(response['failure']))))
+        # Every node answers the reload of its cores with its own response header
+        succeeded = response.get('success', {})
+        missing_nodes = [node for node in nodes
+                         if succeeded.get(node, {}).get('responseHeader', {}).get('status') != 0]
+        if missing_nodes:
+            raise solr_client.SolrError('Nodes [{}] did not report a reload of collection [{}]'
+                                        .format(', '.join(missing_nodes), collection_name))
+        latency = time.time() - started
+        logging.info('Collection [{}] reloaded on [{}] nodes in [{:.1f}] seconds.'
+                     .format(collection_name, len(nodes), latency))
+        return latency
+
+    def __get_replica_nodes(self, collection_name: str):
+        url = self.__get_url('CLUSTERSTATUS', collection=collection_name)
+        state = cluster_state.ClusterState.from_response(self.__http_client.get_json(url, solr_client.STATUS))
+        if state is None or not state.has_collection(collection_name):
+            raise solr_client.SolrError('Collection [{}] is missing in the cluster state'.format(collection_name))
+        return state.get_replica_nodes(collection_name)
+
+    def __get_url(self, action: str, **params):
+        params['action'] = action
+        params['wt'] = 'json'
+        return self.__solr_base_url + '/admin/collections?' + urllib.parse.urlencode(sorted(params.items()))
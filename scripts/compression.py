@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Block-parallel compression of shard archives.
+
+The uncompressed stream is split into fixed size blocks which are compressed independently on a thread pool (zlib and
+zstd release the GIL) and written in order. Every block is a complete gzip member or zstd frame, so the output can be
+read by the standard `gzip`/`tar -xz` and `zstd` tools. Each block carries its compressed size (in a gzip extra
+field or in a preceding zstd skippable frame), which allows decompressing blocks in parallel as well. Streams
+without these size markers, e.g. archives created by `tar -czf`, are decompressed sequentially.
+"""
+
+import io
+import logging
+import os
+import struct
+import tarfile
+import threading
+import zlib
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_GZIP = 'gzip'
+CODEC_ZSTD = 'zstd'
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 1
+READ_CHUNK_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_FLAG_EXTRA = 0x04
+# Extra subfield holding the total size of the gzip member as unsigned 32 bit integer
+GZIP_BLOCK_SIZE_SUBFIELD = b'PB'
+
+ZSTD_SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+ZSTD_FRAME_MAGIC = 0xFD2FB528
+# Skippable frames of other writers may use any magic number from 0x184D2A50 to 0x184D2A5F
+ZSTD_SKIPPABLE_FRAME_MAGIC_MASK = 0xFFFFFFF0
+ZSTD_BLOCK_TYPE_RLE = 1
+
+
+class GzipCodec:
+
+    name = CODEC_GZIP
+    extension = '.tar.gz'
+    default_level = 6
+
+    def __init__(self, level: int = None):
+        self.level = self.default_level if level is None else level
+
+    def compress_block(self, data: bytes):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(data) + compressor.flush()
+        extra = GZIP_BLOCK_SIZE_SUBFIELD + struct.pack('<H', 4)
+        header_size = 10 + 2 + len(extra) + 4
+        member_size = header_size + len(deflated) + 8
+        header = GZIP_MAGIC + struct.pack('<BBIBB', zlib.DEFLATED, GZIP_FLAG_EXTRA, 0, 0, 255)
+        header += struct.pack('<H', len(extra) + 4) + extra + struct.pack('<I', member_size)
+        trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+        return header + deflated + trailer
+
+    @staticmethod
+    def decompress_block(data: bytes):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def iter_blocks(self, fileobj):
+        """Yields (data, is_compressed_block) tuples, decompressing foreign members sequentially."""
+        while True:
+            header = _read_exactly(fileobj, 10)
+            if not header:
+                return
+            member_size = None
+            prefix = header
+            if header[:2] == GZIP_MAGIC and header[3] & GZIP_FLAG_EXTRA:
+                extra_length_bytes = _read_exactly(fileobj, 2)
+                extra = _read_exactly(fileobj, struct.unpack('<H', extra_length_bytes)[0])
+                prefix += extra_length_bytes + extra
+                member_size = self.__get_member_size(extra)
+            if member_size is None:
+                yield from self.__iter_sequential(prefix, fileobj)
+                return
+            yield prefix + _read_exactly(fileobj, member_size - len(prefix)), True
+
+    @staticmethod
+    def __get_member_size(extra: bytes):
+        position = 0
+        while position + 4 <= len(extra):
+            subfield_id = extra[position:position + 2]
+            subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if subfield_id == GZIP_BLOCK_SIZE_SUBFIELD and subfield_length == 4:
+                return struct.unpack('<I', extra[position + 4:position + 8])[0]
+            position += 4 + subfield_length
+        return None
+
+    @staticmethod
+    def __iter_sequential(prefix: bytes, fileobj):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = prefix
+        while data:
+            output = decompressor.decompress(data)
+            if output:
+                yield output, False
+            if decompressor.eof:
+                # Concatenated gzip members, continue with the next one
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if data:
+                    continue
+            data = fileobj.read(READ_CHUNK_SIZE)
+
+
+class ZstdCodec:
+
+    name = CODEC_ZSTD
+    extension = '.tar.zst'
+    default_level = 3
+
+    def __init__(self, level: int = None):
+        if zstandard is None:
+            raise Exception('Codec [{}] requires the python package zstandard.'.format(self.name))
+        self.level = self.default_level if level is None else level
+        self.__local = threading.local()
+
+    def compress_block(self, data: bytes):
+        # Compressor contexts must not be shared between threads
+        if not hasattr(self.__local, 'compressor'):
+            self.__local.compressor = zstandard.ZstdCompressor(level=self.level)
+        frame = self.__local.compressor.compress(data)
+        return struct.pack('<III', ZSTD_SKIPPABLE_FRAME_MAGIC, 4, len(frame)) + frame
+
+    @staticmethod
+    def decompress_block(data: bytes):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    def iter_blocks(self, fileobj):
+        """Yields (data, is_compressed_block) tuples, decompressing foreign frames sequentially."""
+        while True:
+            header = _read_exactly(fileobj, 12)
+            if not header:
+                return
+            if len(header) == 12:
+                magic, length, frame_size = struct.unpack('<III', header)
+                if magic == ZSTD_SKIPPABLE_FRAME_MAGIC and length == 4:
+                    yield _read_exactly(fileobj, frame_size), True
+                    continue
+            yield from self.__iter_sequential(_PrefixedReader(header, fileobj))
+            return
+
+    @staticmethod
+    def __iter_sequential(fileobj):
+        """
+        Decompresses the frames of the stream one after another. The stream reader of zstandard 0.11 stops after the
+        first frame, so the end of every frame is found from its block headers and each frame gets its own
+        decompressor. Only one block is held in memory at a time.
+        """
+        while True:
+            magic_bytes = _read_exactly(fileobj, 4)
+            if not magic_bytes:
+                return
+            if len(magic_bytes) < 4:
+                raise Exception('Compressed stream ends within a frame')
+            magic = struct.unpack('<I', magic_bytes)[0]
+            if magic & ZSTD_SKIPPABLE_FRAME_MAGIC_MASK == ZSTD_SKIPPABLE_FRAME_MAGIC & ZSTD_SKIPPABLE_FRAME_MAGIC_MASK:
+                _read_all(fileobj, struct.unpack('<I', _read_all(fileobj, 4))[0])
+                continue
+            if magic != ZSTD_FRAME_MAGIC:
+                raise Exception('Invalid zstd frame magic number [{:#x}]'.format(magic))
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            descriptor = _read_all(fileobj, 1)
+            single_segment = descriptor[0] & 0x20
+            # Window descriptor, dictionary ID and frame content size follow the frame header descriptor
+            header_size = (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor[0] & 0x03] + \
+                (1 if single_segment else 0, 2, 4, 8)[descriptor[0] >> 6]
+            decompressor.decompress(magic_bytes + descriptor + _read_all(fileobj, header_size))
+            last_block = False
+            while not last_block:
+                block_header = _read_all(fileobj, 3)
+                block_header_value = int.from_bytes(block_header, 'little')
+                last_block = block_header_value & 0x01
+                # An RLE block repeats a single byte block size times
+                block_size = 1 if (block_header_value >> 1) & 0x03 == ZSTD_BLOCK_TYPE_RLE else block_header_value >> 3
+                data = decompressor.decompress(block_header + _read_all(fileobj, block_size))
+                if data:
+                    yield data, False
+            if descriptor[0] & 0x04:
+                # Content checksum
+                data = decompressor.decompress(_read_all(fileobj, 4))
+                if data:
+                    yield data, False
+
+
+CODECS = {
+    CODEC_GZIP: GzipCodec,
+    CODEC_ZSTD: ZstdCodec,
+}
+
+
+def get_codec(name: str, level: int = None):
+    if name not in CODECS:
+        raise Exception('Unknown compression codec [{}], supported codecs are: {}'.format(name, ', '.join(CODECS)))
+    return CODECS[name](level)
+
+
+class ParallelCompressWriter(io.RawIOBase):
+    """Writable stream which compresses blocks on a thread pool and writes them in order to `fileobj`."""
+
+    def __init__(self, fileobj, codec, workers: int = DEFAULT_WORKERS, block_size: int = DEFAULT_BLOCK_SIZE,
+                 throttle=None):
+        """
+        With a `throttle`, blocks are only read at its read rate and at most as many blocks as its current parallelism
+        are compressed at the same time.
+        """
+        super().__init__()
+        self.__fileobj = fileobj
+        self.__codec = codec
+        self.__block_size = block_size
+        self.__max_pending = 2 * workers
+        self.__throttle = throttle
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__pending = deque()
+        self.__buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.__buffer += data
+        while len(self.__buffer) >= self.__block_size:
+            self.__submit(bytes(self.__buffer[:self.__block_size]))
+            del self.__buffer[:self.__block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.__buffer:
+                self.__submit(bytes(self.__buffer))
+                self.__buffer = bytearray()
+            while self.__pending:
+                self.__fileobj.write(self.__pending.popleft().result())
+        finally:
+            self.__executor.shutdown(wait=True)
+            super().close()
+
+    def __submit(self, block: bytes):
+        max_pending = self.__max_pending
+        if self.__throttle is not None:
+            self.__throttle.consume(len(block))
+            max_pending = min(max_pending, self.__throttle.get_parallelism())
+        # Bound the number of blocks in flight, this provides back pressure if the consumer is slow
+        while len(self.__pending) >= max_pending:
+            self.__fileobj.write(self.__pending.popleft().result())
+        self.__pending.append(self.__executor.submit(self.__codec.compress_block, block))
+
+
+class ParallelDecompressReader(io.RawIOBase):
+    """Readable stream which decompresses the blocks of `fileobj` on a thread pool."""
+
+    def __init__(self, fileobj, codec, workers: int = DEFAULT_WORKERS):
+        super().__init__()
+        self.__codec = codec
+        self.__blocks = codec.iter_blocks(fileobj)
+        self.__max_pending = 2 * workers
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__pending = deque()
+        self.__buffer = b''
+        self.__position = 0
+        self.__exhausted = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while self.__position >= len(self.__buffer):
+            self.__fill_pending()
+            if not self.__pending:
+                return 0
+            self.__buffer = self.__pending.popleft().result()
+            self.__position = 0
+        size = min(len(target), len(self.__buffer) - self.__position)
+        target[:size] = self.__buffer[self.__position:self.__position + size]
+        self.__position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.__executor.shutdown(wait=True)
+            super().close()
+
+    def __fill_pending(self):
+        while not self.__exhausted and len(self.__pending) < self.__max_pending:
+            try:
+                data, is_compressed_block = next(self.__blocks)
+            except StopIteration:
+                self.__exhausted = True
+                return
+            if is_compressed_block:
+                self.__pending.append(self.__executor.submit(self.__codec.decompress_block, data))
+            else:
+                future = Future()
+                future.set_result(data)
+                self.__pending.append(future)
+
+
+def write_archive(fileobj, directory: str, source: str, codec, workers: int = DEFAULT_WORKERS,
+                  block_size: int = DEFAULT_BLOCK_SIZE, throttle=None):
+    """Writes `directory`/`source` as compressed tar archive to `fileobj`, optionally limited by a `throttle`."""
+    logging.debug('Compressing [{}] with codec [{}], level [{}] and [{}] workers'
+                  .format(os.path.join(directory, source), codec.name, codec.level, workers))
+    with ParallelCompressWriter(fileobj, codec, workers=workers, block_size=block_size, throttle=throttle) as writer:
+        with tarfile.open(fileobj=writer, mode='w|') as archive:
+            archive.add(os.path.join(directory, source), arcname=source)
+
+
+def extract_archive(fileobj, destination: str, codec, workers: int = DEFAULT_WORKERS):
+    """Extracts the compressed tar archive read from `fileobj` into `destination`."""
+    with ParallelDecompressReader(fileobj, codec, workers=workers) as reader:
+        with tarfile.open(fileobj=io.BufferedReader(reader, READ_CHUNK_SIZE), mode='r|') as archive:
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(destination, filter='data')
+            else:
+                archive.extractall(destination)
+
+
+def _read_exactly(fileobj, size: int):
+    data = b''
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _read_all(fileobj, size: int):
+    """Reads `size` bytes and raises if the stream ends before."""
+    data = _read_exactly(fileobj, size)
+    if len(data) < size:
+        raise Exception('Compressed stream ends within a frame')
+    return data
+
+
+class _PrefixedReader(io.RawIOBase):
+
+    def __init__(self, prefix: bytes, fileobj):
+        super().__init__()
+        self.__prefix = prefix
+        self.__fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        if self.__prefix:
+            size = min(len(target), len(self.__prefix))
+            target[:size] = self.__prefix[:size]
+            self.__prefix = self.__prefix[size:]
+            return size
+        data = self.__fileobj.read(len(target))
+        target[:len(data)] = data
+        return len(data)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Synchronisation of the local Solr configurations with the config sets in ZooKeeper.
+
+All remote config trees are read over one ZooKeeper session with pipelined asynchronous requests. Every local file is
+compared with its remote counterpart by SHA-256 content hash and only new or changed files are written, so no manual
+version bump is needed. Remote files without a local counterpart, e.g. a managed schema written by Solr, are kept.
+"""
+
+import hashlib
+import logging
+import os
+
+from kazoo.exceptions import NoNodeError
+
+ZK_CONFIGS_PATH = '/configs'
+DEFAULT_TIMEOUT_IN_SECONDS = 30
+
+
+def hash_content(content: bytes):
+    return hashlib.sha256(content).hexdigest()
+
+
+def read_local_config(config_dir: str):
+    """Returns the content of every file below `config_dir` by its path relative to `config_dir`."""
+    files = {}
+    for root, dirs, file_names in os.walk(config_dir):
+        for file_name in file_names:
+            full_file_name = os.path.join(root, file_name)
+            with open(full_file_name, 'rb') as f:
+                files[os.path.relpath(full_file_name, config_dir).replace(os.sep, '/')] = f.read()
+    return files
+
+
+def read_remote_configs(zk, config_names: list, timeout: float = DEFAULT_TIMEOUT_IN_SECONDS):
+    """
+    Returns the content of every file of the given config sets by config name and relative path. All nodes of one
+    tree level are requested at once, so reading all trees takes one round trip per level instead of one per node.
+    Config sets which do not exist yet are returned without files.
+    """
+    configs = {config_name: {} for config_name in config_names}
+    level = [(config_name, '') for config_name in config_names]
+    while level:
+        requests = [(config_name, relative_path, zk.get_children_async(get_remote_path(config_name, relative_path)))
+                    for config_name, relative_path in level]
+        leaves = []
+        level = []
+        for config_name, relative_path, request in requests:
+            children = _get_result(request, timeout)
+            if children is None:
+                continue
+            if not children and relative_path:
+                leaves.append((config_name, relative_path))
+            level.extend((config_name, _join(relative_path, child)) for child in sorted(children))
+
+        requests = [(config_name, relative_path, zk.get_async(get_remote_path(config_name, relative_path)))
+                    for config_name, relative_path in leaves]
+        for config_name, relative_path, request in requests:
+            result = _get_result(request, timeout)
+            if result is not None:
+                configs[config_name][relative_path] = result[0] or b''
+    return configs
+
+
+def get_changed_files(local_files: dict, remote_files: dict):
+    """Returns the relative paths of all local files which are missing remotely or differ in their content hash."""
+    return sorted(relative_path for relative_path, content in local_files.items()
+                  if relative_path not in remote_files or
+                  hash_content(remote_files[relative_path]) != hash_content(content))
+
+
+def write_files(zk, config_name: str, local_files: dict, remote_files: dict, relative_paths: list,
+                timeout: float = DEFAULT_TIMEOUT_IN_SECONDS):
+    """Writes the given local files to the remote config set, all writes are sent at once."""
+    for parent in sorted(set(os.path.dirname(relative_path) for relative_path in relative_paths
+                             if relative_path not in remote_files)):
+        zk.ensure_path(get_remote_path(config_name, parent))
+    requests = []
+    for relative_path in relative_paths:
+        path = get_remote_path(config_name, relative_path)
+        if relative_path in remote_files:
+            requests.append((path, zk.set_async(path, local_files[relative_path])))
+        else:
+            requests.append((path, zk.create_async(path, local_files[relative_path])))
+    for path, request in requests:
+        request.get(timeout=timeout)
+        logging.debug('Wrote [{}]'.format(path))
+
+
+def sync_configs(zk, local_configs: dict, timeout: float = DEFAULT_TIMEOUT_IN_SECONDS):
+    """
+    `local_configs` maps remote config names to local config directories. Returns the changed files of every config
+    set which had to be updated.
+    """
+    remote_configs = read_remote_configs(zk, sorted(local_configs), timeout)
+    updated = {}
+    for config_name, config_dir in sorted(local_configs.items()):
+        local_files = read_local_config(config_dir)
+        changed_files = get_changed_files(local_files, remote_configs[config_name])
+        if not changed_files:
+            logging.info('Configuration [{}] is up to date.'.format(config_name))
+            continue
+        logging.info('Updating [{}] of [{}] files of configuration [{}]: [{}]'
+                     .format(len(changed_files), len(local_files), config_name, ', '.join(changed_files)))
+        write_files(zk, config_name, local_files, remote_configs[config_name], changed_files, timeout)
+        updated[config_name] = changed_files
+    return updated
+
+
+def get_remote_path(config_name: str, relative_path: str = ''):
+    config_path = ZK_CONFIGS_PATH + '/' + config_name
+    return config_path + '/' + relative_path if relative_path else config_path
+
+
+def _join(path: str, child: str):
+    return path + '/' + child if path else child
+
+
+def _get_result(request, timeout: float):
+    try:
+        return request.get(timeout=timeout)
+    except NoNodeError:
+        return None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Content-addressed layout for incremental backups.
+
+Lucene segment files never change once written, so every file of a snapshot is stored only once under the key
+`objects/<sha256[:2]>/<sha256>`. A backup timestamp only contains a small JSON manifest per shard which lists the
+files of the snapshot directory and the content hashes they reference.
+"""
+
+import hashlib
+import json
+import os
+
+OBJECTS_PREFIX = 'objects'
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_name: str):
+    sha256 = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        while chunk:
+            sha256.update(chunk)
+            chunk = f.read(HASH_CHUNK_SIZE)
+    return sha256.hexdigest()
+
+
+def get_object_key(sha256: str):
+    return OBJECTS_PREFIX + '/' + sha256[:2] + '/' + sha256
+
+
+def get_manifest_file_name(timestamp: str, backup_name: str):
+    return 'manifest_' + timestamp + '_' + backup_name + '.json'
+
+
+def create_manifest(snapshot_dir: str):
+    files = []
+    for root, dirs, file_names in os.walk(snapshot_dir):
+        for file_name in sorted(file_names):
+            full_file_name = os.path.join(root, file_name)
+            files.append({
+                'name': os.path.relpath(full_file_name, snapshot_dir),
+                'size': os.path.getsize(full_file_name),
+                'sha256': hash_file(full_file_name),
+            })
+    return {
+        'version': MANIFEST_VERSION,
+        'snapshot': os.path.basename(os.path.normpath(snapshot_dir)),
+        'files': files,
+    }
+
+
+def write_manifest(manifest: dict, file_name: str):
+    with open(file_name, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def read_manifest(file_name: str):
+    with open(file_name) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Exception('Unsupported manifest version [{}] in [{}]'.format(manifest.get('version'), file_name))
+    # Names are joined into local paths on restore, so they must not point outside of the snapshot directory
+    unsafe_names = [name for name in [manifest['snapshot']] + [entry['name'] for entry in manifest['files']]
+                    if not is_relative_name(name)]
+    if unsafe_names:
+        raise Exception('Manifest [{}] contains paths outside of its snapshot: [{}]'
+                        .format(file_name, ', '.join(unsafe_names)))
+    return manifest
+
+
+def is_relative_name(name: str):
+    """Returns whether `name` is a relative path which stays below the directory it is joined to."""
+    return bool(name) and not os.path.isabs(name) and '..' not in name.split('/')
+
+
+def verify_file(file_name: str, entry: dict):
+    return os.path.getsize(file_name) == entry['size'] and hash_file(file_name) == entry['sha256']
@@ -1,38 +1,132 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+"""
+Prints the ZooKeeper connect string of the Exhibitor managed ensemble.
+
+The last known ensemble is cached on the data volume. With a cache Exhibitor only gets a short timeout and the cached
+ensemble is used if Exhibitor is slow or unreachable, so a restarting node does not depend on Exhibitor being
+available. The client port of every server is probed concurrently and the connect string is ordered by the measured
+connect latency, servers which could not be reached come last. The ZooKeeper client of Solr shuffles the servers of
+the connect string, so the order does not make Solr connect to the nearest server first. It only shows the
+reachability and latency of the ensemble at startup in the log and in the printed connect string.
+"""
+
 import json
+import logging
 import os
+import socket
 import sys
+import time
 import urllib.request
 
-EXHIBITOR_API = os.getenv('ZK_API')
-if not EXHIBITOR_API:
-    print("Missing environment variable [ZK_API].")
-    sys.exit(1)
+from concurrent.futures import ThreadPoolExecutor
 
+DEFAULT_CACHE_FILE = '/data/zk_servers.json'
+# Exhibitor timeout without a cached ensemble to fall back to
+EXHIBITOR_TIMEOUT_IN_SECONDS = 30
+EXHIBITOR_TIMEOUT_WITH_CACHE_IN_SECONDS = 3
+PROBE_TIMEOUT_IN_SECONDS = 1
 
-def get_cluster_list():
-    url = EXHIBITOR_API + '/cluster/list'
-    try:
-        request = urllib.request.Request(url)
-        response = urllib.request.urlopen(request)
+
+def get_cluster_list(exhibitor_api: str, timeout: float):
+    url = exhibitor_api + '/cluster/list'
+    with urllib.request.urlopen(urllib.request.Request(url), timeout=timeout) as response:
         code = response.getcode()
-        content = response.readall().decode('utf-8')
-        response.close()
-        if code != 200:
-            print('ERROR Received unexpected status code from Exhibitor: [{}]'.format(code))
-            exit(1)
-        return json.loads(content)
+        content = response.read().decode('utf-8')
+    if code != 200:
+        raise ValueError('Received unexpected status code from Exhibitor [{}]: [{}]'.format(url, code))
+    cluster_list = json.loads(content)
+    if not cluster_list.get('servers') or not cluster_list.get('port'):
+        raise ValueError('Received empty cluster list from Exhibitor [{}]: {}'.format(url, content))
+    return cluster_list
+
+
+def read_cache(cache_file: str):
+    """Returns the cached cluster list or None if there is no valid cache."""
+    try:
+        with open(cache_file) as f:
+            cluster_list = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cluster_list, dict) or not cluster_list.get('servers') or not cluster_list.get('port'):
+        return None
+    return cluster_list
+
+
+def write_cache(cache_file: str, cluster_list: dict):
+    temp_file = cache_file + '.tmp'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump({'servers': cluster_list['servers'], 'port': cluster_list['port']}, f)
+        os.rename(temp_file, cache_file)
+    except OSError as e:
+        logging.warning('Could not cache ZooKeeper servers in [{}]: {}'.format(cache_file, e))
+
+
+def discover(exhibitor_api: str, cache_file: str):
+    """Returns the cluster list from Exhibitor and falls back to the cached one if Exhibitor does not answer in time."""
+    cached = read_cache(cache_file)
+    timeout = EXHIBITOR_TIMEOUT_WITH_CACHE_IN_SECONDS if cached else EXHIBITOR_TIMEOUT_IN_SECONDS
+    try:
+        cluster_list = get_cluster_list(exhibitor_api, timeout)
+    except Exception as e:
+        if not cached:
+            raise
+        logging.warning('Failed getting cluster list from Exhibitor, using cached servers [{}]: {}'
+                        .format(', '.join(cached['servers']), e))
+        return cached
+    if cluster_list != cached:
+        write_cache(cache_file, cluster_list)
+    return cluster_list
+
+
+def probe_server(host: str, port: int, timeout: float = PROBE_TIMEOUT_IN_SECONDS):
+    """Returns the time it took to connect to the client port or None if the server could not be reached."""
+    start = time.time()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.time() - start
+    except OSError:
+        return None
+
+
+def order_servers(servers: list, port: int, probe=probe_server):
+    """Orders the servers by connect latency, unreachable servers keep their order at the end."""
+    if not servers:
+        return []
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        latencies = list(executor.map(lambda server: probe(server, port), servers))
+    for server, latency in zip(servers, latencies):
+        logging.debug('ZooKeeper server [{}] latency: {}'.format(
+            server, 'unreachable' if latency is None else '{:.1f} ms'.format(latency * 1000)))
+    ranked = sorted((latency, index) for index, latency in enumerate(latencies) if latency is not None)
+    unreachable = [index for index, latency in enumerate(latencies) if latency is None]
+    return [servers[index] for latency, index in ranked] + [servers[index] for index in unreachable]
+
+
+def get_connect_string(servers: list, port: int):
+    return ','.join('{}:{}'.format(server, port) for server in servers)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    exhibitor_api = os.getenv('ZK_API')
+    if not exhibitor_api:
+        logging.error('Missing environment variable [ZK_API].')
+        return 1
+
+    try:
+        cluster_list = discover(exhibitor_api, os.getenv('ZK_SERVERS_CACHE', DEFAULT_CACHE_FILE))
     except Exception as e:
-        print('ERROR Failed sending request to Exhibitor [{}]: {}'.format(url, e))
-        exit(1)
+        logging.error('Failed getting cluster list from Exhibitor [{}]: {}'.format(exhibitor_api, e))
+        return 1
 
+    port = cluster_list['port']
+    # Output list of currently active Zookeeper servers, nearest first, the ZooKeeper client shuffles them anyway
+    print(get_connect_string(order_servers(cluster_list['servers'], port), port))
+    return 0
 
-cluster_list = get_cluster_list()
-servers = cluster_list['servers']
-port = cluster_list['port']
 
-output = ','.join(map(lambda x: x + ':' + str(port), servers))
-# Output list of currently active Zookeeper servers
-print(output)
+if __name__ == '__main__':
+    sys.exit(main())
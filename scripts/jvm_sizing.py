@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Sizing of the Solr JVM heap from the machine memory and the size of the local index.
+
+Lucene reads its segments through memory mapped files, so query latency depends on how much of the index stays in
+the OS page cache. The heap gets what the cores need plus headroom for garbage collection, a larger heap would only
+lengthen GC pauses. Everything else is left to the page cache. Large heaps use G1 to keep pauses short. Every
+decision is logged with its reason.
+
+    python3 -m scripts.jvm_sizing --data-dir /data
+"""
+
+import logging
+import os
+import sys
+
+from argparse import ArgumentParser
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+MEMINFO_FILE = '/proc/meminfo'
+CORE_PROPERTIES = 'core.properties'
+DEFAULT_DATA_DIR = '/data'
+
+# Heap share used while the index size is unknown, e.g. before the restore of a new node
+DEFAULT_HEAP_PERCENT = 30
+MAX_HEAP_PERCENT = 50
+# Above this heap size the JVM can no longer use compressed object pointers
+MAX_HEAP = 31 * GB
+BASE_HEAP = 512 * MB
+HEAP_PER_CORE = 64 * MB
+# Heap needed for term dictionaries, caches and merges grows with the index
+HEAP_PER_INDEX_PERCENT = 5
+# Headroom on top of the needed heap for garbage and cache churn
+HEAP_HEADROOM_PERCENT = 100
+# Memory left to the OS, the Solr process outside the heap and the backup job
+MIN_OS_RESERVE = 512 * MB
+OS_RESERVE_PERCENT = 10
+# Share of the index which should stay in the page cache
+HOT_INDEX_PERCENT = 100
+G1_MIN_HEAP = 4 * GB
+
+G1_GC_TUNE = ' '.join([
+    '-XX:+UseG1GC', '-XX:MaxGCPauseMillis=250', '-XX:+ParallelRefProcEnabled', '-XX:G1HeapRegionSize=8m',
+    '-XX:InitiatingHeapOccupancyPercent=75'])
+
+
+class Sizing:
+
+    def __init__(self, heap_size: int, page_cache_size: int, gc_tune, reasons: list):
+        """`gc_tune` replaces the GC settings of `bin/solr`, None keeps its defaults."""
+        self.heap_size = heap_size
+        self.page_cache_size = page_cache_size
+        self.gc_tune = gc_tune
+        self.reasons = reasons
+
+    def get_heap_option(self):
+        """Returns the heap size in the format of the `-m` option of `bin/solr`."""
+        return '{}m'.format(self.heap_size // MB)
+
+
+def get_total_memory(meminfo_file: str = MEMINFO_FILE):
+    with open(meminfo_file) as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    raise ValueError('MemTotal missing in [{}]'.format(meminfo_file))
+
+
+def get_directory_size(directory: str):
+    size = 0
+    for root, dirs, file_names in os.walk(directory):
+        for file_name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                # Segments are deleted by merges while the directory is walked
+                pass
+    return size
+
+
+def get_local_index(data_dir: str):
+    """Returns the number of cores below `data_dir` and the total size of their data directories."""
+    core_count = 0
+    index_size = 0
+    for root, dirs, file_names in os.walk(data_dir):
+        if CORE_PROPERTIES in file_names:
+            core_count += 1
+            index_size += get_directory_size(os.path.join(root, 'data'))
+            dirs[:] = []
+    return core_count, index_size
+
+
+def compute_sizing(total_memory: int, core_count: int, index_size: int,
+                   default_heap_percent: int = DEFAULT_HEAP_PERCENT):
+    reasons = []
+    os_reserve = max(MIN_OS_RESERVE, total_memory * OS_RESERVE_PERCENT // 100)
+    available = max(0, total_memory - os_reserve)
+    max_heap = min(MAX_HEAP, total_memory * MAX_HEAP_PERCENT // 100)
+    min_heap = min(max_heap, BASE_HEAP + core_count * HEAP_PER_CORE + index_size * HEAP_PER_INDEX_PERCENT // 100)
+    reasons.append('{:.1f} GB memory, {:.1f} GB reserved for the OS, {} cores with {:.1f} GB index'.format(
+        total_memory / GB, os_reserve / GB, core_count, index_size / GB))
+
+    if index_size == 0:
+        heap_size = total_memory * default_heap_percent // 100
+        reasons.append('index size unknown, using {}% of the memory'.format(default_heap_percent))
+    else:
+        hot_index = index_size * HOT_INDEX_PERCENT // 100
+        target_heap = min_heap * (100 + HEAP_HEADROOM_PERCENT) // 100
+        heap_size = min(target_heap, available - hot_index)
+        if heap_size == target_heap:
+            reasons.append('heap gets the {:.1f} GB needed by {} cores plus {}% headroom, page cache gets the rest'
+                           .format(min_heap / GB, core_count, HEAP_HEADROOM_PERCENT))
+        elif heap_size >= min_heap:
+            reasons.append('headroom of the heap limited, so {:.1f} GB page cache keeps the whole index resident'
+                           .format(hot_index / GB))
+        else:
+            reasons.append('index does not fit into the page cache next to the minimum heap of {:.1f} GB'
+                           .format(min_heap / GB))
+    if heap_size > max_heap:
+        heap_size = max_heap
+        reasons.append('heap capped at {:.1f} GB'.format(max_heap / GB))
+    if heap_size < min_heap:
+        heap_size = min(min_heap, max(available, BASE_HEAP))
+        reasons.append('heap raised to the {:.1f} GB needed by {} cores'.format(heap_size / GB, core_count))
+    heap_size = heap_size // MB * MB
+
+    if heap_size >= G1_MIN_HEAP:
+        gc_tune = G1_GC_TUNE
+        reasons.append('G1 for a heap of at least {} GB'.format(G1_MIN_HEAP // GB))
+    else:
+        gc_tune = None
+        reasons.append('default CMS settings of Solr for a heap below {} GB'.format(G1_MIN_HEAP // GB))
+    return Sizing(heap_size, max(0, available - heap_size), gc_tune, reasons)
+
+
+def size_jvm(data_dir: str = DEFAULT_DATA_DIR, default_heap_percent: int = DEFAULT_HEAP_PERCENT):
+    core_count, index_size = get_local_index(data_dir)
+    sizing = compute_sizing(get_total_memory(), core_count, index_size, default_heap_percent)
+    logging.info('JVM heap [{}], page cache [{:.1f} GB]: {}'.format(
+        sizing.get_heap_option(), sizing.page_cache_size / GB, '; '.join(sizing.reasons)))
+    return sizing
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    parser = ArgumentParser(description='Prints the Solr heap size for the local index')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Solr home with the core directories')
+    parser.add_argument('--default-heap-percent', type=int, default=DEFAULT_HEAP_PERCENT,
+                        help='Heap share of the memory while the index size is unknown')
+    args = parser.parse_args(sys.argv[1:])
+    # The heap size is the only output on stdout, so scripts can capture it
+    print(size_jvm(args.data_dir, args.default_heap_percent).get_heap_option())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Event-driven scheduling of shard restores.
+
+The scheduler polls the locally hosted cores and hands every core to the restore pool exactly once, as soon as it
+appears. A restore which has to wait for another core, e.g. a replica waiting for the elected replica of its shard,
+hands its core back and is submitted again after the poll interval, so it does not block a slot of the pool. The
+scheduler tracks the state of every core and finishes as soon as every core expected on this node is restored. While
+the expected cores are unknown, it finishes once all known cores are restored and no new core appeared for the
+settle time. When the timeout is reached, it stops and reports every core which is not restored by then as failed,
+including expected cores which never appeared.
+"""
+
+import logging
+import time
+
+from threading import Condition
+from scripts import workers
+
+STATE_PENDING = 'pending'
+STATE_WAITING = 'waiting'
+STATE_DOWNLOADING = 'downloading'
+STATE_EXTRACTING = 'extracting'
+STATE_RESTORING = 'restoring'
+STATE_REPLICATING = 'replicating'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+TERMINAL_STATES = [STATE_DONE, STATE_FAILED]
+
+DEFAULT_POLL_INTERVAL_IN_SECONDS = 5
+
+
+class RestoreDeferred(Exception):
+    """Raised by `restore_core` if the core can not be restored yet, the scheduler submits it again later."""
+    pass
+
+
+class RestoreScheduler:
+
+    def __init__(self, get_local_cores, restore_core, pool_size: int, timeout: float, settle_time: float,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL_IN_SECONDS, order_cores=None, get_expected_cores=None):
+        """
+        `get_local_cores` returns the names of the locally hosted cores, `restore_core(core_name, report_state)`
+        restores a single core and reports its progress through `report_state(state)`. `order_cores` returns the
+        new cores of a poll in the order in which they are handed to the restore pool. `get_expected_cores(core_names)`
+        returns the names of all cores this node has to restore, given the cores it hosts so far, or None if they are
+        not known.
+        """
+        self.__get_local_cores = get_local_cores
+        self.__restore_core = restore_core
+        self.__order_cores = order_cores
+        self.__get_expected_cores = get_expected_cores
+        self.__pool_size = pool_size
+        self.__timeout = timeout
+        self.__settle_time = settle_time
+        self.__poll_interval = poll_interval
+        self.__states = {}
+        # Deferred cores by the time at which they are submitted again
+        self.__deferred = {}
+        self.__condition = Condition()
+
+    def get_states(self):
+        with self.__condition:
+            return dict(self.__states)
+
+    def run(self):
+        """Restores all local cores and raises a `TaskFailure` if any of them failed or was not restored in time."""
+        pool = workers.TaskPool('restore', self.__pool_size)
+        started = time.time()
+        last_change = started
+        local_cores = []
+        timed_out = False
+        failures = []
+        try:
+            while True:
+                local_cores = self.__get_local_cores()
+                new_cores = [core_name for core_name in local_cores if core_name not in self.__states]
+                now = time.time()
+                if new_cores:
+                    last_change = now
+                    if self.__order_cores:
+                        new_cores = self.__order_cores(new_cores)
+                    logging.info('Scheduling restore of new cores [{}].'.format(', '.join(new_cores)))
+                with self.__condition:
+                    due_cores = sorted(core_name for core_name, due in self.__deferred.items() if due <= now)
+                    for core_name in due_cores:
+                        del self.__deferred[core_name]
+                for core_name in new_cores + due_cores:
+                    self.__set_state(core_name, STATE_PENDING)
+                    pool.submit(core_name, self.__run_restore, core_name)
+
+                expected_cores = None
+                if self.__get_expected_cores is not None:
+                    with self.__condition:
+                        idle = not self.__unfinished()
+                    if idle:
+                        expected_cores = self.__get_expected_cores(local_cores)
+
+                with self.__condition:
+                    if self.__is_finished(now, last_change, expected_cores):
+                        break
+                    if now - started >= self.__timeout:
+                        logging.warning('Restore timed out, unfinished cores: [{}]'.format(self.__unfinished()))
+                        timed_out = True
+                        break
+                    wait = min(self.__poll_interval, self.__timeout - (now - started))
+                    if expected_cores is None and self.__states and not self.__unfinished():
+                        wait = min(wait, self.__settle_time - (now - last_change))
+                    if self.__deferred:
+                        wait = min(wait, min(self.__deferred.values()) - now)
+                    # Wake up early when a core changes its state, so the last restore ends the run immediately
+                    self.__condition.wait(timeout=max(wait, 0))
+        finally:
+            try:
+                pool.wait()
+            except workers.TaskFailure as e:
+                failures = e.failures
+        if timed_out:
+            for core_name in self.__get_timed_out_cores(local_cores):
+                self.__set_state(core_name, STATE_FAILED)
+                failures.append((core_name, TimeoutError('Core [{}] was not restored within [{}] seconds'
+                                                         .format(core_name, self.__timeout))))
+        logging.info('Restore states: [{}]'.format(self.get_states()))
+        if failures:
+            raise workers.TaskFailure('restore', failures)
+
+    def __get_timed_out_cores(self, local_cores: list):
+        """Returns the cores which are not restored, including expected cores which did not appear at all."""
+        expected_cores = []
+        if self.__get_expected_cores is not None:
+            expected_cores = self.__get_expected_cores(local_cores) or []
+        with self.__condition:
+            return sorted(set(self.__unfinished()) |
+                          set(core_name for core_name in expected_cores if core_name not in self.__states))
+
+    def __is_finished(self, now: float, last_change: float, expected_cores):
+        if self.__unfinished():
+            return False
+        if expected_cores is not None:
+            return all(self.__states.get(core_name) in TERMINAL_STATES for core_name in expected_cores)
+        return self.__states and now - last_change >= self.__settle_time
+
+    def __unfinished(self):
+        return [core_name for core_name, state in self.__states.items() if state not in TERMINAL_STATES]
+
+    def __run_restore(self, core_name: str):
+        try:
+            self.__restore_core(core_name, lambda state: self.__set_state(core_name, state))
+            self.__set_state(core_name, STATE_DONE)
+        except RestoreDeferred as e:
+            logging.debug('Restore of [{}] is deferred: {}'.format(core_name, e))
+            with self.__condition:
+                self.__deferred[core_name] = time.time() + self.__poll_interval
+            self.__set_state(core_name, STATE_WAITING)
+        except Exception:
+            self.__set_state(core_name, STATE_FAILED)
+            raise
+
+    def __set_state(self, core_name: str, state: str):
+        with self.__condition:
+            logging.debug('Core [{}] is [{}]'.format(core_name, state))
+            self.__states[core_name] = state
+            self.__condition.notify_all()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+In-process S3 transfers.
+
+All transfers of a backup or restore run share one boto3 client, so its pool of keep-alive connections is reused
+across files instead of starting an aws cli process per file. Objects above the multipart threshold are uploaded as
+parallel multipart parts and downloaded with parallel ranged GETs. Every transfer updates the byte counters of
+`TransferStats` and reports its progress to an optional listener.
+
+With a `TransferJournal` multipart uploads and ranged downloads of files above the multipart threshold record every
+completed part, so a transfer which was interrupted continues after its last completed part. Parts are only reused if
+their MD5 still matches the ETag of the uploaded part or the content of the partially downloaded file.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from scripts import transfer_journal
+from threading import Lock
+
+import boto3
+
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+MB = 1024 * 1024
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_CHUNK_SIZE = 16 * MB
+DEFAULT_MULTIPART_THRESHOLD = 16 * MB
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+DEFAULT_MAX_ATTEMPTS = 5
+
+# S3 limits a multipart upload to this number of parts
+MAX_PARTS = 10000
+
+
+class S3TransferError(Exception):
+    pass
+
+
+class TransferStats:
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__counters = {'uploaded_bytes': 0, 'uploaded_files': 0, 'downloaded_bytes': 0, 'downloaded_files': 0}
+
+    def add(self, name: str, value: int):
+        with self.__lock:
+            self.__counters[name] += value
+
+    def get(self):
+        with self.__lock:
+            return dict(self.__counters)
+
+
+class S3Transfer:
+
+    def __init__(self, endpoint_url: str = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+                 max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS, progress_listener=None, journal=None):
+        """
+        `max_concurrency` is the number of parts or ranges transferred in parallel per object, `max_pool_connections`
+        the number of connections kept alive for all transfers together. `progress_listener(key, bytes)` is called
+        with the number of bytes transferred since its last call. File transfers above the multipart threshold are
+        resumable if a `journal` is given.
+        """
+        config = Config(max_pool_connections=max_pool_connections, retries={'max_attempts': DEFAULT_MAX_ATTEMPTS},
+                        # S3 stand-ins usually do not resolve buckets from virtual host names
+                        s3={'addressing_style': 'path' if endpoint_url else 'auto'})
+        self.__client = boto3.session.Session().client('s3', endpoint_url=endpoint_url, config=config)
+        self.__max_concurrency = max_concurrency
+        self.__chunk_size = chunk_size
+        self.__multipart_threshold = multipart_threshold
+        self.__progress_listener = progress_listener
+        self.__journal = journal
+        self.__stats = TransferStats()
+
+    def get_stats(self):
+        return self.__stats.get()
+
+    def upload_file(self, file_name: str, bucket: str, key: str):
+        logging.debug('Uploading [{}] to [s3://{}/{}]'.format(file_name, bucket, key))
+        if self.__journal is not None and os.path.getsize(file_name) >= self.__multipart_threshold:
+            return self.__transfer('Uploading [{}]'.format(file_name), key, 'uploaded', self.__upload_parts,
+                                   file_name, bucket, key)
+        self.__transfer('Uploading [{}]'.format(file_name), key, 'uploaded', self.__client.upload_file,
+                        file_name, bucket, key, Config=self.__get_transfer_config())
+
+    def download_file(self, bucket: str, key: str, file_name: str):
+        logging.debug('Downloading [s3://{}/{}] to [{}]'.format(bucket, key, file_name))
+        if self.__journal is not None:
+            return self.__transfer('Downloading [{}]'.format(key), key, 'downloaded', self.__download_journaled,
+                                   bucket, key, file_name)
+        self.__transfer('Downloading [{}]'.format(key), key, 'downloaded', self.__client.download_file,
+                        bucket, key, file_name, Config=self.__get_transfer_config())
+
+    def upload_stream(self, stream, bucket: str, key: str, expected_size: int = None):
+        """Uploads everything read from `stream` while it is produced. `expected_size` is an upper bound."""
+        logging.debug('Uploading stream to [s3://{}/{}]'.format(bucket, key))
+        self.__transfer('Uploading stream', key, 'uploaded', self.__client.upload_fileobj,
+                        stream, bucket, key, Config=self.__get_transfer_config(expected_size))
+
+    def download_stream(self, bucket: str, key: str, stream):
+        """Writes the object to `stream` in order, while later ranges are already downloaded."""
+        logging.debug('Downloading [s3://{}/{}] to stream'.format(bucket, key))
+        self.__transfer('Downloading [{}]'.format(key), key, 'downloaded', self.__client.download_fileobj,
+                        bucket, key, stream, Config=self.__get_transfer_config())
+
+    def put_bytes(self, data: bytes, bucket: str, key: str):
+        """Stores a small object with a single request."""
+        try:
+            self.__client.put_object(Bucket=bucket, Key=key, Body=data)
+        except (BotoCoreError, ClientError) as e:
+            raise S3TransferError('Storing [s3://{}/{}] failed: {}'.format(bucket, key, e))
+        self.__stats.add('uploaded_bytes', len(data))
+
+    def get_bytes(self, bucket: str, key: str):
+        """Returns the content of a small object or None if it does not exist."""
+        try:
+            data = self.__client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise S3TransferError('Reading [s3://{}/{}] failed: {}'.format(bucket, key, e))
+        except BotoCoreError as e:
+            raise S3TransferError('Reading [s3://{}/{}] failed: {}'.format(bucket, key, e))
+        self.__stats.add('downloaded_bytes', len(data))
+        return data
+
+    def get_size(self, bucket: str, key: str):
+        """Returns the size of an object from a HEAD request or None if it does not exist."""
+        try:
+            return self.__client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise S3TransferError('Reading size of [s3://{}/{}] failed: {}'.format(bucket, key, e))
+        except BotoCoreError as e:
+            raise S3TransferError('Reading size of [s3://{}/{}] failed: {}'.format(bucket, key, e))
+
+    def list_keys(self, bucket: str, prefix: str = ''):
+        """Returns the keys of all objects below `prefix`."""
+        keys = []
+        for page in self.__list_pages(bucket, prefix):
+            keys.extend(content['Key'] for content in page.get('Contents', []))
+        return keys
+
+    def list_prefixes(self, bucket: str, prefix: str = '', delimiter: str = '/'):
+        """Returns the common prefixes directly below `prefix`, i.e. the 'directories' of a listing."""
+        prefixes = []
+        for page in self.__list_pages(bucket, prefix, Delimiter=delimiter):
+            prefixes.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+        return prefixes
+
+    def __list_pages(self, bucket: str, prefix: str, **kwargs):
+        try:
+            paginator = self.__client.get_paginator('list_objects_v2')
+            return list(paginator.paginate(Bucket=bucket, Prefix=prefix, **kwargs))
+        except (BotoCoreError, ClientError) as e:
+            raise S3TransferError('Listing [s3://{}/{}] failed: {}'.format(bucket, prefix, e))
+
+    def discard_transfers(self, direction: str):
+        """
+        Forgets all journaled transfers in the given direction, e.g. of a run which is not resumed. Their multipart
+        uploads are aborted, S3 would otherwise keep their parts as incomplete uploads.
+        """
+        if self.__journal is None:
+            return
+        for bucket, key, transfer in self.__journal.get_transfers(direction):
+            if transfer.upload_id:
+                self.__abort_upload(bucket, key, transfer.upload_id)
+            self.__journal.finish_transfer(direction, bucket, key)
+
+    def __upload_parts(self, file_name: str, bucket: str, key: str, Callback):
+        size = os.path.getsize(file_name)
+        transfer = transfer_journal.Transfer(file_name, size, str(os.stat(file_name).st_mtime_ns),
+                                             self.__get_part_size(size))
+        previous = self.__journal.get_transfer(transfer_journal.UPLOAD, bucket, key)
+        parts = None
+        if transfer.matches(previous):
+            transfer.upload_id = previous.upload_id
+            parts = self.__get_uploaded_parts(bucket, key, transfer.upload_id)
+        if parts is None:
+            if previous is not None:
+                self.__abort_upload(bucket, key, previous.upload_id)
+            transfer.upload_id = self.__client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+            self.__journal.start_transfer(transfer_journal.UPLOAD, bucket, key, transfer)
+            parts = {}
+        else:
+            logging.info('Resuming upload of [{}] after [{}] completed parts'.format(file_name, len(parts)))
+
+        def upload_part(part_number):
+            with open(file_name, 'rb') as f:
+                f.seek((part_number - 1) * transfer.part_size)
+                data = f.read(transfer.part_size)
+            digest = hashlib.md5(data)
+            self.__client.upload_part(Bucket=bucket, Key=key, UploadId=transfer.upload_id, PartNumber=part_number,
+                                      Body=data, ContentMD5=base64.b64encode(digest.digest()).decode('ascii'))
+            self.__journal.add_part(transfer_journal.UPLOAD, bucket, key, part_number, digest.hexdigest())
+            Callback(len(data))
+            return part_number, digest.hexdigest()
+
+        missing = [number for number in range(1, self.__get_part_count(size, transfer.part_size) + 1)
+                   if number not in parts]
+        with ThreadPoolExecutor(self.__max_concurrency) as executor:
+            parts.update(executor.map(upload_part, missing))
+        self.__client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=transfer.upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': '"{}"'.format(parts[number])}
+                                       for number in sorted(parts)]})
+        self.__journal.finish_transfer(transfer_journal.UPLOAD, bucket, key)
+
+    def __get_uploaded_parts(self, bucket: str, key: str, upload_id: str):
+        """Returns the journaled parts whose ETag in S3 matches their MD5 or None if the upload does not exist."""
+        journaled = self.__journal.get_parts(transfer_journal.UPLOAD, bucket, key)
+        try:
+            paginator = self.__client.get_paginator('list_parts')
+            uploaded = {part['PartNumber']: part['ETag'].strip('"')
+                        for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id)
+                        for part in page.get('Parts', [])}
+        except ClientError as e:
+            logging.info('Upload [{}] of [s3://{}/{}] cannot be resumed: {}'.format(upload_id, bucket, key, e))
+            return None
+        return {number: md5 for number, md5 in journaled.items() if uploaded.get(number) == md5}
+
+    def __abort_upload(self, bucket: str, key: str, upload_id: str):
+        try:
+            self.__client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            logging.debug('Aborting upload [{}] of [s3://{}/{}] failed: {}'.format(upload_id, bucket, key, e))
+
+    def __download_journaled(self, bucket: str, key: str, file_name: str, Callback):
+        head = self.__client.head_object(Bucket=bucket, Key=key)
+        if head['ContentLength'] >= self.__multipart_threshold:
+            return self.__download_ranges(bucket, key, file_name, head, Callback)
+        # Small objects are fetched with a single GET and are not worth journaling
+        data = self.__client.get_object(Bucket=bucket, Key=key, IfMatch=head['ETag'])['Body'].read()
+        with open(file_name, 'wb') as f:
+            f.write(data)
+        Callback(len(data))
+
+    def __download_ranges(self, bucket: str, key: str, file_name: str, head: dict, Callback):
+        size = head['ContentLength']
+        transfer = transfer_journal.Transfer(file_name, size, head['ETag'], self.__get_part_size(size))
+        parts = {}
+        if transfer.matches(self.__journal.get_transfer(transfer_journal.DOWNLOAD, bucket, key)) and \
+                os.path.isfile(file_name) and os.path.getsize(file_name) == size:
+            parts = self.__get_downloaded_parts(bucket, key, file_name, transfer.part_size)
+            logging.info('Resuming download of [{}] after [{}] completed parts'.format(key, len(parts)))
+        else:
+            with open(file_name, 'wb') as f:
+                f.truncate(size)
+            self.__journal.start_transfer(transfer_journal.DOWNLOAD, bucket, key, transfer)
+
+        descriptor = os.open(file_name, os.O_WRONLY)
+        try:
+            def download_range(part_number):
+                start = (part_number - 1) * transfer.part_size
+                end = min(start + transfer.part_size, size) - 1
+                # The object must not change between the ranges of one download
+                data = self.__client.get_object(Bucket=bucket, Key=key, IfMatch=transfer.version,
+                                                Range='bytes={}-{}'.format(start, end))['Body'].read()
+                if len(data) != end - start + 1:
+                    raise OSError('Range [{}-{}] of [{}] has [{}] bytes'.format(start, end, key, len(data)))
+                os.pwrite(descriptor, data, start)
+                self.__journal.add_part(transfer_journal.DOWNLOAD, bucket, key, part_number,
+                                        hashlib.md5(data).hexdigest())
+                Callback(len(data))
+
+            missing = [number for number in range(1, self.__get_part_count(size, transfer.part_size) + 1)
+                       if number not in parts]
+            with ThreadPoolExecutor(self.__max_concurrency) as executor:
+                list(executor.map(download_range, missing))
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        self.__journal.finish_transfer(transfer_journal.DOWNLOAD, bucket, key)
+
+    def __get_downloaded_parts(self, bucket: str, key: str, file_name: str, part_size: int):
+        """Returns the journaled parts whose content in the file still matches their MD5."""
+        parts = {}
+        with open(file_name, 'rb') as f:
+            for number, md5 in sorted(self.__journal.get_parts(transfer_journal.DOWNLOAD, bucket, key).items()):
+                f.seek((number - 1) * part_size)
+                if hashlib.md5(f.read(part_size)).hexdigest() == md5:
+                    parts[number] = md5
+        return parts
+
+    def __get_part_size(self, size: int):
+        # Parts have to be large enough to fit the whole object into the maximum number of parts
+        return max(self.__chunk_size, -(-size // MAX_PARTS))
+
+    @staticmethod
+    def __get_part_count(size: int, part_size: int):
+        return -(-size // part_size)
+
+    def __get_transfer_config(self, expected_size: int = None):
+        chunk_size = self.__chunk_size
+        if expected_size:
+            # Parts have to be large enough to fit the whole stream into the maximum number of parts
+            chunk_size = max(chunk_size, -(-expected_size // MAX_PARTS))
+        return TransferConfig(multipart_threshold=self.__multipart_threshold, multipart_chunksize=chunk_size,
+                              max_concurrency=self.__max_concurrency, use_threads=True)
+
+    def __transfer(self, description: str, key: str, direction: str, function, *args, **kwargs):
+        def callback(transferred_bytes):
+            self.__stats.add(direction + '_bytes', transferred_bytes)
+            if self.__progress_listener:
+                self.__progress_listener(key, transferred_bytes)
+        try:
+            function(*args, Callback=callback, **kwargs)
+        except (BotoCoreError, ClientError, S3UploadFailedError, OSError) as e:
+            raise S3TransferError('{} failed: {}'.format(description, e))
+        self.__stats.add(direction + '_files', 1)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared HTTP client for the Solr admin APIs.
+
+Connections are kept alive and pooled per host, so the many status polls against the local Solr reuse a handful of
+TCP connections. Every request type has its own `RetryPolicy` with a read timeout and the number of attempts.
+Responses are decoded and validated as JSON once, a Solr error in the response header is raised as `SolrError`.
+Requests which trigger an action are never sent twice once they may have reached Solr.
+"""
+
+import http.client
+import json
+import logging
+import select
+import socket
+import time
+import urllib.parse
+
+from queue import Empty, Full, LifoQueue
+from threading import Lock
+
+DEFAULT_CONNECT_TIMEOUT_IN_SECONDS = 5
+DEFAULT_POOL_SIZE = 8
+
+# Status codes of a Solr which is starting up or temporarily overloaded
+RETRY_STATUS_CODES = [502, 503]
+GATEWAY_TIMEOUT_STATUS_CODE = 504
+
+# Errors of a pooled connection which has been closed by the server in the meantime
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class SolrError(Exception):
+    pass
+
+
+class RequestTimeout(SolrError):
+    pass
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts: int, read_timeout: float, retry_wait: float = 1, retry_timeouts: bool = True):
+        self.attempts = attempts
+        self.read_timeout = read_timeout
+        self.retry_wait = retry_wait
+        # Requests which trigger an action must not be repeated after a timeout, the action may be running already
+        self.retry_timeouts = retry_timeouts
+
+
+# Idempotent status requests, e.g. core status, backup details, index version
+STATUS = RetryPolicy(attempts=3, read_timeout=30)
+# Requests triggering an asynchronous action, e.g. replication backup or restore
+COMMAND = RetryPolicy(attempts=3, read_timeout=60, retry_timeouts=False)
+# Hard commits block until the commit is done
+COMMIT = RetryPolicy(attempts=1, read_timeout=600, retry_timeouts=False)
+# Collection reloads block until all replicas have reloaded
+RELOAD = RetryPolicy(attempts=2, read_timeout=180, retry_timeouts=False)
+
+
+class SolrHttpClient:
+
+    def __init__(self, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_IN_SECONDS,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        self.__connect_timeout = connect_timeout
+        self.__pool_size = pool_size
+        self.__pools = {}
+        self.__lock = Lock()
+
+    def get_json(self, url: str, policy: RetryPolicy = STATUS):
+        """Sends a GET request and returns the decoded JSON response."""
+        parsed_url = urllib.parse.urlsplit(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            can_retry = attempt < policy.attempts
+            try:
+                logging.debug('Send HTTP GET request to [{}]'.format(url))
+                status, body = self.__request(parsed_url, policy)
+            except socket.timeout:
+                if can_retry and policy.retry_timeouts:
+                    self.__wait_for_retry(url, 'timeout', policy)
+                    continue
+                raise RequestTimeout('Timed out after [{}] seconds waiting for Solr [{}]'
+                                     .format(policy.read_timeout, url))
+            except (OSError, http.client.HTTPException) as e:
+                if can_retry:
+                    self.__wait_for_retry(url, e, policy)
+                    continue
+                raise SolrError('Failed sending request to Solr [{}]: {}'.format(url, e))
+
+            if status == GATEWAY_TIMEOUT_STATUS_CODE:
+                if can_retry and policy.retry_timeouts:
+                    self.__wait_for_retry(url, status, policy)
+                    continue
+                raise RequestTimeout('Gateway timeout while waiting for Solr [{}]'.format(url))
+            if status in RETRY_STATUS_CODES and can_retry:
+                self.__wait_for_retry(url, status, policy)
+                continue
+            if status != 200:
+                raise SolrError('Received unexpected status code from Solr [{}]: [{}] {}'
+                                .format(url, status, self.__get_error_message(body)))
+            return self.__decode(url, body)
+
+    def close(self):
+        with self.__lock:
+            pools = list(self.__pools.values())
+            self.__pools = {}
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
+
+    def __request(self, parsed_url, policy: RetryPolicy):
+        path = parsed_url.path + ('?' + parsed_url.query if parsed_url.query else '')
+        connection, reused = self.__acquire(parsed_url)
+        try:
+            connection.sock.settimeout(policy.read_timeout)
+            connection.request('GET', path, headers={'Connection': 'keep-alive', 'Accept': 'application/json'})
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection, this is not a failure of the request
+            logging.debug('Pooled connection to [{}] was closed, reconnecting.'.format(parsed_url.netloc))
+            return self.__request(parsed_url, policy)
+        except Exception:
+            connection.close()
+            raise
+        try:
+            response = connection.getresponse()
+            body = response.read()
+        except socket.timeout:
+            connection.close()
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            if not policy.retry_timeouts:
+                # Solr may have received the request already, so an action must not be triggered a second time
+                raise SolrError('Connection to Solr [{}] was lost after sending the request: {}'
+                                .format(parsed_url.geturl(), e))
+            if not reused or not isinstance(e, STALE_CONNECTION_ERRORS):
+                raise
+            logging.debug('Pooled connection to [{}] was closed, reconnecting.'.format(parsed_url.netloc))
+            return self.__request(parsed_url, policy)
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.__release(parsed_url, connection)
+        return response.status, body
+
+    def __acquire(self, parsed_url):
+        try:
+            while True:
+                connection = self.__get_pool(parsed_url).get_nowait()
+                # An idle connection is only readable if the server has closed it
+                if not select.select([connection.sock], [], [], 0)[0]:
+                    return connection, True
+                connection.close()
+        except Empty:
+            if parsed_url.scheme == 'https':
+                connection = http.client.HTTPSConnection(parsed_url.hostname, parsed_url.port,
+                                                         timeout=self.__connect_timeout)
+            else:
+                connection = http.client.HTTPConnection(parsed_url.hostname, parsed_url.port,
+                                                        timeout=self.__connect_timeout)
+            connection.connect()
+            return connection, False
+
+    def __release(self, parsed_url, connection):
+        try:
+            self.__get_pool(parsed_url).put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def __get_pool(self, parsed_url):
+        key = (parsed_url.scheme, parsed_url.netloc)
+        with self.__lock:
+            if key not in self.__pools:
+                # The most recently used connection is reused first, idle ones time out on the server side
+                self.__pools[key] = LifoQueue(maxsize=self.__pool_size)
+            return self.__pools[key]
+
+    @staticmethod
+    def __wait_for_retry(url: str, reason, policy: RetryPolicy):
+        logging.warning('Request to Solr [{}] failed ([{}]) ... retrying'.format(url, reason))
+        time.sleep(policy.retry_wait)
+
+    @staticmethod
+    def __decode(url: str, body: bytes):
+        try:
+            content = json.loads(body.decode('utf-8'))
+        except ValueError as e:
+            raise SolrError('Received invalid JSON from Solr [{}]: {}'.format(url, e))
+        if not isinstance(content, dict):
+            raise SolrError('Received unexpected JSON from Solr [{}]: [{}]'.format(url, content))
+        status = content.get('responseHeader', {}).get('status', 0)
+        if status != 0:
+            raise SolrError('Solr [{}] returned status [{}]: {}'.format(url, status, content.get('error', '')))
+        return content
+
+    @staticmethod
+    def __get_error_message(body: bytes):
+        try:
+            return json.loads(body.decode('utf-8')).get('error', {}).get('msg', '')
+        except (ValueError, AttributeError):
+            return body[:200].decode('utf-8', 'replace')
@@ -1,26 +1,51 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
+import errno
 import logging
 import os
 import pytz
 import re
 import shutil
+import socket
 import subprocess
 import sys
 import time
-import urllib.error
-import urllib.request
+import urllib.parse
 
 from argparse import ArgumentParser
 from apscheduler.schedulers.blocking import BlockingScheduler
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
-from threading import Thread
+from kazoo.client import KazooClient
+from threading import Lock, Thread
+
+from scripts import backup_catalog
+from scripts import backup_coordination
+from scripts import backup_schedule
+from scripts import cluster_state
+from scripts import compression
+from scripts import content_store
+from scripts import restore_scheduler
+from scripts import s3_transfer
+from scripts import solr_client
+from scripts import throttle
+from scripts import transfer_journal
+from scripts import workers
 
 LOCAL_URL = 'http://localhost:8983/solr'
 BACKUP_ROOT_DIR = '/backup/'
 DATA_DIR = '/data/'
+# Hardlinks only work within one file system, so hardlink snapshots are kept on the data volume
+SNAPSHOT_ROOT_DIR = DATA_DIR + '.snapshots/'
+# Listing the files of a commit point reserves it only for Solr's `commitReserveDuration`, so the reservation is
+# renewed after every batch of linked files
+LINK_BATCH_SIZE = 100
+# The journal is kept next to the index, so it survives restarts of the backup job
+DEFAULT_JOURNAL_FILE = DATA_DIR + 'transfer_journal.db'
+# Interrupted runs are resumed within this time, older runs are discarded
+DEFAULT_RESUME_WINDOW_IN_SECONDS = 6 * 3600
 
 DO_NOT_DELETE = ['lost+found']
 
@@ -28,14 +53,23 @@ DEFAULT_COMMIT_WAIT_IN_SECONDS = 300
 
 DEFAULT_RETRY_COUNT = 60
 DEFAULT_RETRY_WAIT_IN_SECONDS = 60
+DEFAULT_STATUS_POLL_INITIAL_WAIT_IN_SECONDS = 0.25
+DEFAULT_SNAPSHOT_POOL_SIZE = 4
 
 DEFAULT_RESTORE_RETRY_COUNT = 60
 DEFAULT_RESTORE_RETRY_WAIT_IN_SECONDS = 60
+# Replicas which wait longer for the restore of the elected replica of their shard are restored from S3 instead
+DEFAULT_REPLICA_WAIT_IN_SECONDS = 10 * 60
+
+LEGACY_ARCHIVE_EXTENSION = '.tar.gz'
+# Snapshots of archives without a recorded extracted size are assumed to be this much larger than their archive
+ARCHIVE_EXPANSION_ESTIMATE = 1.5
 
 TIMESTAMP_MINUTE = 0
 TIMESTAMP_HOUR = 1
 TIMESTAMP_DOW_SCHEDULER = 'sun'
 TIMESTAMP_DOW_CRON = 0
+CRON_INTERVALS_IN_SECONDS = {'hourly': 3600, 'daily': 24 * 3600, 'weekly': 7 * 24 * 3600, 'test': 60}
 
 REGEX_SHARDED_CORES = "([a-z_]+)_(shard[0-9_]+)_(replica[0-9]+)"
 REGEX_SINGLE_CORE = "([a-z_]+)"
@@ -51,29 +85,175 @@ class BackupController:
     __retry_wait = DEFAULT_RETRY_WAIT_IN_SECONDS
     __restore_retry_count = DEFAULT_RESTORE_RETRY_COUNT
     __restore_retry_wait = DEFAULT_RESTORE_RETRY_WAIT_IN_SECONDS
+    __stream_to_s3 = False
+    __s3_endpoint_url = None
+    __s3_max_concurrency = s3_transfer.DEFAULT_MAX_CONCURRENCY
+    __s3_chunk_size = s3_transfer.DEFAULT_CHUNK_SIZE
+    __s3_transfer = None
+    __codec = None
+    __compression_workers = compression.DEFAULT_WORKERS
+    __incremental = False
+    __restore_from_leader = False
+    __replica_wait = DEFAULT_REPLICA_WAIT_IN_SECONDS
+    __stored_objects = None
+    __coordinator = None
+    __require_consistent = False
+    __hardlink_snapshots = False
+    __journal = None
+    __load_gate = None
+    __throttle_options = None
+    __throttle = None
+    __disk_space = None
 
     def __init__(self, wait_timeout: int):
         self.__wait_timeout = wait_timeout
-
-    def create_backup(self, bucket: str, cleanup=True):
+        self.__stored_objects_lock = Lock()
+        self.__pending_objects = {}
+        self.__s3_transfer_lock = Lock()
+        self.__catalog_shards = {}
+        self.__catalog_lock = Lock()
+        self.__node_name = socket.gethostname()
+        self.__snapshot_locks = {}
+        self.__snapshot_locks_lock = Lock()
+        self.__resource_limits = workers.ResourceLimits()
+        self.__pool_size = workers.DEFAULT_POOL_SIZE
+        self.__http_client = solr_client.SolrHttpClient()
+        self.__snapshot_pool_size = DEFAULT_SNAPSHOT_POOL_SIZE
+        self.__snapshot_timings = {}
+        self.__plan = None
+        self.__snapshot_generations = {}
+        self.__index_sizes = {}
+        self.__restore_catalog_shards = {}
+        self.__restore_sizes = {}
+        self.__restore_sizes_lock = Lock()
+        self.__replica_wait_deadlines = {}
+
+    def create_backup(self, bucket: str, cleanup=True, backup_id: str = None):
+        """
+        Creates a backup of all local shards and returns whether it succeeded. The backup ID defaults to the current
+        time, staggered jobs pass the time at which they were scheduled. An interrupted run is only resumed by a run
+        with the same backup ID.
+        """
+        timestamp = None
+        completed = False
         try:
-            if not set(os.listdir(BACKUP_ROOT_DIR)).issubset(set(DO_NOT_DELETE)):
+            self.__acquire_journal(transfer_journal.RUN_BACKUP)
+            resumed_timestamp = self.__get_resumable_run(transfer_journal.RUN_BACKUP)
+            if not set(os.listdir(BACKUP_ROOT_DIR)).issubset(set(DO_NOT_DELETE + [resumed_timestamp])):
                 raise Exception('Backup root directory contains unexpected files or dirs.')
 
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
-            self.__trigger_local_commit()
-            self.__backup_local_shards(timestamp=timestamp)
-            self.__store_local_backup_on_s3(bucket=bucket, timestamp=timestamp)
+            if self.__load_gate is not None:
+                self.__load_gate.wait('backup')
+            if self.__coordinator is not None:
+                # The coordinator of the run has committed all collections and chosen the replicas to back up
+                self.__plan = self.__coordinator.get_plan(self.__create_backup_plan)
+                timestamp = self.__plan['backup_id']
+                core_names = self.__get_planned_cores(self.__plan)
+            else:
+                self.__plan = None
+                timestamp = backup_id or datetime.utcnow().strftime('%Y%m%d%H%M')
+                core_names = self.__get_cores_to_back_up()
+                self.__trigger_local_commit(core_names)
+            if resumed_timestamp not in (None, timestamp):
+                # Shards of the interrupted run must not end up in the backup of a later run
+                self.__discard_run(transfer_journal.RUN_BACKUP, resumed_timestamp)
+            if self.__journal is not None:
+                self.__journal.start_run(transfer_journal.RUN_BACKUP, timestamp)
+            self.__backup_local_shards(bucket=bucket, timestamp=timestamp, core_names=core_names)
+            completed = True
+            return True
         except Exception as e:
             logging.error('ERROR Backup failed: {}'.format(e))
+            return False
+        finally:
+            self.__finish_run(transfer_journal.RUN_BACKUP, timestamp, completed, cleanup)
+            if self.__hardlink_snapshots:
+                # Links of failed shards would keep deleted segments on the data volume
+                self.__release_snapshot(SNAPSHOT_ROOT_DIR)
+
+    def restore_backup(self, bucket: str, timestamp: str, cleanup=True):
+        """Restores the backup with the given timestamp into the local cores and returns whether it succeeded."""
+        completed = False
+        try:
+            self.__acquire_journal(transfer_journal.RUN_RESTORE)
+            if self.__get_resumable_run(transfer_journal.RUN_RESTORE) not in (None, timestamp):
+                # Archives of the interrupted restore of another backup would only fill the backup volume
+                self.__clean_up_backup_dir()
+            if self.__journal is not None:
+                self.__journal.start_run(transfer_journal.RUN_RESTORE, timestamp)
+            self.__restore_latest_backup(bucket=bucket, timestamp=timestamp)
+            completed = True
+            return True
+        except Exception as e:
+            logging.error('ERROR Restore failed: {}'.format(e))
+            return False
         finally:
+            self.__finish_run(transfer_journal.RUN_RESTORE, timestamp, completed, cleanup)
+
+    def __acquire_journal(self, kind: str):
+        if self.__journal is not None:
+            self.__journal.acquire(kind)
+
+    def __get_resumable_run(self, kind: str):
+        """Returns the ID of an interrupted run of the given kind which can be resumed or None."""
+        if self.__journal is None:
+            return None
+        run_id, started = self.__journal.get_unfinished_run(kind)
+        if run_id is None:
+            return None
+        # Hardlink snapshots are released after every run, only the shards stored in S3 are resumed
+        has_run_dir = kind == transfer_journal.RUN_BACKUP and self.__hardlink_snapshots or \
+            os.path.isdir(BACKUP_ROOT_DIR + run_id)
+        if time.time() - started > DEFAULT_RESUME_WINDOW_IN_SECONDS or not has_run_dir:
+            self.__discard_run(kind, run_id)
+            return None
+        logging.info('Found interrupted {} [{}].'.format(kind, run_id))
+        return run_id
+
+    def __discard_run(self, kind: str, run_id: str):
+        logging.info('Discarding progress of interrupted {} [{}].'.format(kind, run_id))
+        self.__release_snapshot(BACKUP_ROOT_DIR + run_id)
+        # Only one run of each kind is in progress, so every unfinished transfer of its direction belongs to this run
+        self.__get_s3_transfer().discard_transfers(transfer_journal.UPLOAD if kind == transfer_journal.RUN_BACKUP
+                                                   else transfer_journal.DOWNLOAD)
+        self.__journal.finish_run(kind, run_id)
+
+    def __finish_run(self, kind: str, run_id: str, completed: bool, cleanup: bool):
+        if self.__journal is None:
             if cleanup:
                 self.__clean_up_backup_dir()
+            return
+        try:
+            if completed:
+                self.__journal.finish_run(kind, run_id)
+                if cleanup:
+                    self.__clean_up_backup_dir()
+            elif run_id is not None:
+                logging.info('Keeping progress of {} [{}] to resume it with the next run of the same ID.'
+                             .format(kind, run_id))
+        finally:
+            self.__journal.release(kind)
 
-    def restore_backup(self, bucket: str, timestamp: str, cleanup=True):
-        self.__restore_latest_backup(bucket=bucket, timestamp=timestamp)
-        if cleanup:
-            self.__clean_up_backup_dir()
+    def get_latest_backup(self, bucket: str):
+        """Returns the timestamp of the newest complete backup in the bucket or None if there is none."""
+        try:
+            latest = self.__read_latest_catalog_entry(bucket)
+            if latest is not None:
+                if backup_catalog.is_complete(list(self.__read_catalog_entries(bucket, latest['timestamp'])
+                                                   .values()), self.__require_consistent):
+                    return latest['timestamp']
+                logging.warning('Latest backup [{}] lacks shards of some nodes or is not consistent, looking for an '
+                                'older complete backup.'.format(latest['timestamp']))
+                return self.__find_latest_complete_backup(bucket)
+            logging.warning('No backup catalog in S3 bucket [{}], falling back to the newest backup prefix.'
+                            .format(bucket))
+            return backup_catalog.find_latest_timestamp(self.__get_s3_transfer().list_prefixes(bucket))
+        except Exception as e:
+            logging.error('ERROR Looking up latest backup failed: {}'.format(e))
+            return None
+
+    def set_http_client(self, http_client: solr_client.SolrHttpClient):
+        self.__http_client = http_client
 
     def set_retry_count(self, retry_count):
         self.__retry_count = retry_count
@@ -90,89 +270,479 @@ class BackupController:
     def set_store_backup_wait(self, wait):
         self.__store_backup_wait = wait
 
-    def __backup_local_shards(self, timestamp: str):
-        logging.info('Start creating local backup for timestamp [{}].'.format(timestamp))
-        for core_name in self.__get_local_cores():
-            sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
-            single_regex_match = re.match(REGEX_SINGLE_CORE, core_name)
-            if sharded_regex_match:
-                collection_name = sharded_regex_match.group(1)
-                shard_name = sharded_regex_match.group(2)
-                replica_name = sharded_regex_match.group(3)
-                full_shard_name = collection_name + '_' + shard_name
-                core_name = full_shard_name + '_' + replica_name
-            elif single_regex_match:
-                collection_name = single_regex_match.group(1)
-                full_shard_name = collection_name
-                core_name = full_shard_name
+    def set_stream_to_s3(self, stream_to_s3: bool):
+        self.__stream_to_s3 = stream_to_s3
+
+    def set_s3_endpoint_url(self, endpoint_url: str):
+        self.__s3_endpoint_url = endpoint_url
+
+    def set_s3_transfer_options(self, max_concurrency: int, chunk_size: int):
+        """Tunes the number of parallel parts or ranges per S3 transfer and the size of each part."""
+        self.__s3_max_concurrency = max_concurrency
+        self.__s3_chunk_size = chunk_size
+
+    def set_s3_transfer(self, transfer: s3_transfer.S3Transfer):
+        self.__s3_transfer = transfer
+
+    def set_compression(self, codec_name: str, level: int = None, workers: int = compression.DEFAULT_WORKERS):
+        """Use the in-process block-parallel compression instead of the tar command line tool."""
+        self.__codec = compression.get_codec(codec_name, level)
+        self.__compression_workers = workers
+
+    def set_resource_limits(self, limits: dict):
+        """Limits the number of shards which are compressed, archived or transferred at the same time."""
+        self.__resource_limits = workers.ResourceLimits(limits)
+
+    def set_pool_size(self, pool_size: int):
+        """Limits the number of shards which are processed at the same time."""
+        self.__pool_size = pool_size
+
+    def set_snapshot_pool_size(self, pool_size: int):
+        """Limits the number of cores which create a snapshot at the same time."""
+        self.__snapshot_pool_size = pool_size
+
+    def get_snapshot_timings(self):
+        """Returns the seconds from triggering until completion of the last snapshot of every core."""
+        return dict(self.__snapshot_timings)
+
+    def set_restore_from_leader(self, restore_from_leader: bool, replica_wait: float = DEFAULT_REPLICA_WAIT_IN_SECONDS):
+        """
+        Only elected replicas restore from S3, the other replicas fetch the index from them. A replica whose elected
+        replica is not restored within `replica_wait` seconds is restored from S3 instead.
+        """
+        self.__restore_from_leader = restore_from_leader
+        self.__replica_wait = replica_wait
+
+    def set_coordinator(self, coordinator: backup_coordination.BackupCoordinator, require_consistent: bool = False):
+        """
+        Backs up the shards of a cluster-wide plan shared with the backup jobs of the other nodes. A shard which was
+        committed again after the plan is recorded as inconsistent, unless `require_consistent` is set: then its backup
+        fails and only consistent backups count as complete.
+        """
+        self.__coordinator = coordinator
+        self.__require_consistent = require_consistent
+
+    def set_hardlink_snapshots(self, hardlink_snapshots: bool):
+        """
+        Snapshots shards by hardlinking the files of their latest commit on the data volume instead of copying them
+        to the backup volume with the replication handler. Archives of hardlink snapshots are always streamed.
+        """
+        self.__hardlink_snapshots = hardlink_snapshots
+
+    def set_journal(self, journal: transfer_journal.TransferJournal):
+        """
+        Records the progress of shards and S3 transfers, so interrupted runs keep their backup directory and are
+        resumed by the next run instead of starting from zero.
+        """
+        self.__journal = journal
+
+    def set_load_thresholds(self, max_query_rate: float = None, max_p99: float = None,
+                            sample_interval: float = backup_schedule.DEFAULT_SAMPLE_INTERVAL_IN_SECONDS,
+                            max_deferral: float = backup_schedule.DEFAULT_MAX_DEFERRAL_IN_SECONDS):
+        """
+        Defers backups and pauses them before every shard while the local query rate in requests per second or the
+        99th percentile request time in milliseconds is above the given threshold.
+        """
+        self.__load_gate = backup_schedule.LoadGate(self.__get_query_stats(), max_query_rate, max_p99, sample_interval,
+                                                    max_deferral)
+
+    def set_latency_budget(self, p99_budget: float, max_read_rate: int = throttle.DEFAULT_MAX_READ_RATE,
+                           min_read_rate: int = throttle.DEFAULT_MIN_READ_RATE,
+                           interval: float = throttle.DEFAULT_INTERVAL_IN_SECONDS):
+        """
+        Adapts the rate in bytes per second at which snapshots are read into archives and the number of compression
+        workers every interval, so the 99th percentile request time of the local cores stays below the budget in
+        milliseconds.
+        """
+        self.__throttle_options = (p99_budget, max_read_rate, min_read_rate, interval)
+
+    def set_disk_space_admission(self, headroom: int = workers.DEFAULT_DISK_HEADROOM):
+        """
+        Reserves the expected size of every snapshot, tarball and extraction on the backup volume and only starts it
+        once the free space minus `headroom` bytes covers it. Shards are processed largest first.
+        """
+        self.__disk_space = workers.DiskSpaceAdmission(BACKUP_ROOT_DIR, headroom)
+
+    def set_incremental(self, incremental: bool):
+        """Store snapshot files once in a content-addressed layout and only upload a manifest per backup."""
+        self.__incremental = incremental
+
+    def __get_cores_to_back_up(self):
+        local_cores = self.__get_local_cores()
+        self.__cluster_state = self.__get_cluster_state()
+        core_names = []
+        if self.__cluster_state is None:
+            # Without cluster state every node backs up one local replica of each of its shards
+            backup_names = set()
+            for core_name in local_cores:
+                backup_name = self.__get_backup_name(core_name)
+                if backup_name in backup_names:
+                    logging.info('Skipping core [{}] since another local replica of [{}] is backed up.'
+                                 .format(core_name, backup_name))
+                    continue
+                backup_names.add(backup_name)
+                core_names.append(core_name)
+            return core_names
+
+        for core_name in local_cores:
+            if self.__cluster_state.is_elected(core_name):
+                core_names.append(core_name)
             else:
-                raise Exception('Unknown core name format [{}]'.format(core_name))
+                logging.info('Skipping core [{}] since it is not the elected replica of its shard.'.format(core_name))
+        logging.info('Backing up [{}] of the [{}] active shards of the cluster on this node.'
+                     .format(len(core_names), self.__cluster_state.get_shard_count()))
+        return core_names
+
+    def __create_backup_plan(self):
+        state = self.__get_cluster_state()
+        if state is None:
+            raise Exception('Coordinated backups need the cluster state of SolrCloud.')
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+
+        # A commit on the collection is distributed to all of its replicas, so every collection is committed once
+        for collection_name in sorted(set(collection_name for collection_name, shard_name
+                                          in state.get_active_shards())):
+            logging.info('Triggering hard commit for [{}] ...'.format(collection_name))
+            if self.__send_http_request(LOCAL_URL + '/' + collection_name + '/update?commit=true&wt=json',
+                                        solr_client.COMMIT) is None:
+                logging.warning('Hard commit of [{}] timed out, its replicas may be planned with an older '
+                                'generation.'.format(collection_name))
+
+        shards = {}
+        for collection_name, shard_name in state.get_active_shards():
+            replica = state.get_elected_replica(collection_name, shard_name)
+            if replica is None:
+                logging.warning('Shard [{}] of [{}] has no active replica and is not backed up.'
+                                .format(shard_name, collection_name))
+                continue
+            url = cluster_state.ClusterState.get_core_url(replica) + '/replication?command=indexversion&wt=json'
+            shards[replica['core']] = backup_coordination.create_plan_shard(
+                collection_name, shard_name, replica.get('node_name'),
+                int(self.__send_http_request(url).get('generation', 0)))
+        return backup_coordination.create_plan(timestamp, self.__node_name, shards)
+
+    def __get_planned_cores(self, plan: dict):
+        local_cores = set(self.__get_local_cores())
+        core_names = sorted(core_name for core_name in plan['shards'] if core_name in local_cores)
+        logging.info('Backing up [{}] of the [{}] planned shards of backup [{}] on this node.'
+                     .format(len(core_names), len(plan['shards']), plan['backup_id']))
+        return core_names
+
+    def __check_snapshot_generation(self, core_name: str, snapshot_dir: str):
+        # The replication handler snapshots the latest commit, which is the planned one unless the core was
+        # committed again in the meantime
+        generation = backup_coordination.get_snapshot_generation(snapshot_dir)
+        if generation is None:
+            raise Exception('Snapshot [{}] of [{}] has no segments file'.format(snapshot_dir, core_name))
+        planned_generation = self.__plan['shards'][core_name]['generation']
+        if generation != planned_generation:
+            message = 'Snapshot of [{}] has generation [{}] instead of the planned [{}], backup [{}] is not a ' \
+                      'consistent point in time'.format(core_name, generation, planned_generation,
+                                                        self.__plan['backup_id'])
+            if self.__require_consistent:
+                raise Exception(message)
+            logging.warning(message + ', it is recorded as inconsistent.')
+        with self.__catalog_lock:
+            self.__snapshot_generations[core_name] = generation
+
+    def __get_cluster_state(self):
+        try:
+            return cluster_state.ClusterState.from_response(self.__send_http_request(LOCAL_URL +
+                                                                                     cluster_state.URL_PATH))
+        except solr_client.SolrError as e:
+            logging.warning('Could not get cluster state, Solr may not run in cloud mode: {}'.format(e))
+            return None
+
+    def __backup_local_shards(self, bucket: str, timestamp: str, core_names: list):
+        logging.info('Start creating backup for timestamp [{}].'.format(timestamp))
+        self.__snapshot_timings = {}
+        self.__catalog_shards = {}
+        self.__snapshot_generations = {}
+        if self.__incremental:
+            self.__stored_objects = self.__list_stored_objects(bucket)
+            self.__pending_objects = {}
+        if self.__disk_space is not None:
+            self.__index_sizes = self.__get_local_index_sizes()
+            # Large shards go first, so the backup does not end with a single large shard
+            core_names = sorted(core_names, key=lambda core_name: -self.__index_sizes.get(core_name, 0))
+        self.__throttle = self.__start_throttle()
+        try:
+            self.__backup_shards_in_pools(bucket, timestamp, core_names)
+        finally:
+            self.__stop_throttle()
+        self.__write_catalog_entry(bucket, timestamp)
+        logging.info('Successfully created backup for timestamp [{}], snapshots took [{}].'
+                     .format(timestamp, ', '.join('{}: {:.1f}s'.format(core_name, seconds) for core_name, seconds
+                                                  in sorted(self.__snapshot_timings.items()))))
+        logging.info('S3 transfer statistics: [{}]'.format(self.__get_s3_transfer().get_stats()))
+
+    def __backup_shards_in_pools(self, bucket: str, timestamp: str, core_names: list):
+        # Every shard is handed to the upload pool as soon as its own snapshot is complete. A shard keeps its upload
+        # slot until its archive is uploaded and the snapshot tasks block while the upload pool is full, so snapshots
+        # and compression cannot run ahead of the uploads by more than the pool sizes.
+        upload_pool = workers.TaskPool('upload', self.__pool_size)
+        snapshot_pool = workers.TaskPool('snapshot', self.__snapshot_pool_size)
+        for core_name in core_names:
+            snapshot_pool.submit(core_name, self.__backup_single_core_task, bucket, core_name, timestamp,
+                                 upload_pool)
+
+        snapshot_failure = None
+        try:
+            snapshot_pool.wait()
+        except workers.TaskFailure as e:
+            snapshot_failure = e
+        upload_pool.wait()
+        if snapshot_failure:
+            raise snapshot_failure
+
+    def __start_throttle(self):
+        if self.__throttle_options is None:
+            return None
+        p99_budget, max_read_rate, min_read_rate, interval = self.__throttle_options
+        adaptive_throttle = throttle.AdaptiveThrottle(lambda: self.__get_query_stats().sample().p99, p99_budget,
+                                                      self.__compression_workers, max_read_rate, min_read_rate,
+                                                      interval)
+        adaptive_throttle.start()
+        return adaptive_throttle
+
+    def __stop_throttle(self):
+        if self.__throttle is None:
+            return
+        self.__throttle.stop()
+        decisions = self.__throttle.get_decisions()
+        actions = [decision.action for decision in decisions]
+        logging.info('Throttle made [{}] decisions ({} decreases, {} increases), final read rate [{:.1f}] MB/s and '
+                     '[{}] compression workers.'.format(len(decisions), actions.count(throttle.ACTION_DECREASE),
+                                                        actions.count(throttle.ACTION_INCREASE),
+                                                        self.__throttle.get_read_rate() / throttle.MB,
+                                                        self.__throttle.get_parallelism()))
+        self.__throttle = None
+
+    def __get_query_stats(self):
+        return backup_schedule.QueryStats(self.__http_client, LOCAL_URL, self.__get_local_cores)
+
+    def __backup_single_core_task(self, bucket: str, core_name: str, timestamp: str, upload_pool):
+        started = time.time()
+        index_size = self.__index_sizes.get(core_name, 0)
+        sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
+        single_regex_match = re.match(REGEX_SINGLE_CORE, core_name)
+        if sharded_regex_match:
+            collection_name = sharded_regex_match.group(1)
+            shard_name = sharded_regex_match.group(2)
+            replica_name = sharded_regex_match.group(3)
+            full_shard_name = collection_name + '_' + shard_name
+            core_name = full_shard_name + '_' + replica_name
+            shard_number = shard_name[len('shard'):]
+        elif single_regex_match:
+            collection_name = single_regex_match.group(1)
+            full_shard_name = collection_name
+            core_name = full_shard_name
+            shard_number = ''
+        else:
+            raise Exception('Unknown core name format [{}]'.format(core_name))
 
-            url = LOCAL_URL + '/' + core_name + '/replication?command=backup&wt=json'
-            url += '&location=' + BACKUP_ROOT_DIR + timestamp
-            url += '&name=' + full_shard_name
-            logging.info('Creating backup for [{}] ...'.format(full_shard_name))
-            self.__send_http_request(url)
-
-            # Wait until backup is complete
-            check_url = LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
-            status = 'In Progress'
-            retry = 0
-            while status == 'In Progress' and retry < self.__retry_count:
-                response = json.loads(self.__send_http_request(check_url))
-                logging.debug('Status response: [{}]'.format(response))
-                if 'details' in response and 'backup' in response['details']\
-                        and len(response['details']['backup']) > 5:
-                    status = response['details']['backup'][5]
-                else:
-                    logging.info('Backup status could not be derived from response ... retrying')
-                    retry += 1
-                time.sleep(self.__retry_wait)
+        state, progress = self.__get_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name)
+        if state == transfer_journal.SHARD_STORED:
+            logging.info('Backup for [{}] was already stored by the interrupted run.'.format(full_shard_name))
+            self.__restore_shard_progress(progress)
+            return
+
+        if self.__load_gate is not None:
+            self.__load_gate.wait(full_shard_name)
+            started = time.time()
+        snapshot_root = self.__get_snapshot_root(timestamp)
+        if state is not None and os.path.isdir(snapshot_root + '/' + progress['snapshot']):
+            logging.info('Resuming backup for [{}] with the snapshot of the interrupted run.'.format(full_shard_name))
+            self.__restore_shard_progress(progress)
+        else:
+            snapshot_dir = snapshot_root + '/snapshot.' + full_shard_name
+            if self.__journal is not None:
+                # The remains of a snapshot of the interrupted run are replaced
+                self.__release_snapshot(snapshot_dir)
+            if self.__hardlink_snapshots:
+                self.__link_snapshot(core_name, snapshot_dir)
+                status = 'success'
+            else:
+                with self.__reserve_disk_space(full_shard_name, index_size):
+                    status = self.__replicate_snapshot(core_name, timestamp, full_shard_name)
 
             if status == 'success':
-                logging.info('Backup for [{}] successful'.format(full_shard_name))
+                if self.__plan is not None:
+                    self.__check_snapshot_generation(core_name, snapshot_dir)
+                self.__snapshot_timings[core_name] = time.time() - started
+                logging.info('Backup for [{}] successful after [{:.1f}] seconds'
+                             .format(full_shard_name, self.__snapshot_timings[core_name]))
             else:
                 raise Exception('Error while creating backup for [{}]'.format(full_shard_name))
-        logging.info('Successfully created local backup for timestamp [{}].'.format(timestamp))
+            self.__set_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name,
+                                      transfer_journal.SHARD_SNAPSHOT, {
+                                          'snapshot': 'snapshot.' + full_shard_name, 'core': core_name,
+                                          'generation': self.__snapshot_generations.get(core_name)})
 
-    def __store_local_backup_on_s3(self, bucket: str, timestamp: str):
-        regex_shard_backup_dir = "snapshot\.([a-z_]+)_shard([0-9_]+)"
-        regex_single_core_backup_dir = "snapshot\.([a-z_]+)"
-        backup_dir = BACKUP_ROOT_DIR + timestamp
-        logging.info('Start zipping and uploading of backup to S3.')
-        threads = []
-        for entry in os.listdir(backup_dir):
-            if entry.startswith('snapshot.'):
-                regex_shard_backup_dir_match = re.match(regex_shard_backup_dir, entry)
-                regex_single_core_backup_dir_match = re.match(regex_single_core_backup_dir, entry)
-                if regex_shard_backup_dir_match:
-                    collection_name = regex_shard_backup_dir_match.group(1)
-                    shard_number = regex_shard_backup_dir_match.group(2)
-                elif regex_single_core_backup_dir_match:
-                    collection_name = regex_single_core_backup_dir_match.group(1)
-                    shard_number = ''
-                else:
-                    raise Exception('Unknown core name format [{}]'.format(entry))
+        upload_pool.submit(full_shard_name, self.__store_single_backup_on_s3_task, bucket, timestamp, collection_name,
+                           shard_number)
+
+    def __get_local_index_sizes(self):
+        """Returns the index size in bytes of every local core."""
+        try:
+            response = self.__send_http_request(LOCAL_URL + '/admin/cores?action=STATUS&wt=json') or {}
+        except Exception as e:
+            logging.warning('Could not get index sizes of local cores: [{}]'.format(e))
+            return {}
+        return {core_name: int(status.get('index', {}).get('sizeInBytes', 0))
+                for core_name, status in response.get('status', {}).items()}
+
+    @contextmanager
+    def __reserve_disk_space(self, description: str, size: int):
+        if self.__disk_space is None or not size:
+            yield
+            return
+        with self.__disk_space.acquire(description, size):
+            yield
+
+    def __get_shard_progress(self, kind: str, run_id: str, name: str):
+        if self.__journal is None:
+            return None, None
+        return self.__journal.get_shard(kind, run_id, name)
+
+    def __set_shard_progress(self, kind: str, run_id: str, name: str, state: str, data: dict = None):
+        if self.__journal is not None:
+            self.__journal.set_shard(kind, run_id, name, state, data)
+
+    def __restore_shard_progress(self, progress: dict):
+        """Takes over the snapshot generation and the stored archive of a shard from the interrupted run."""
+        with self.__catalog_lock:
+            if progress.get('generation') is not None:
+                self.__snapshot_generations[progress['core']] = progress['generation']
+            if 'shard' in progress:
+                self.__catalog_shards[progress['backup_name']] = progress['shard']
+
+    def __replicate_snapshot(self, core_name: str, timestamp: str, full_shard_name: str):
+        """Lets the replication handler copy the latest commit to the backup volume and returns the final status."""
+        # The details of the previous backup of the core are still reported until the new one has started
+        check_url = LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
+        previous_backup = self.__get_backup_details(self.__send_http_request(check_url))
+
+        url = LOCAL_URL + '/' + core_name + '/replication?command=backup&wt=json'
+        url += '&location=' + BACKUP_ROOT_DIR + timestamp
+        url += '&name=' + full_shard_name
+        logging.info('Creating backup for [{}] ...'.format(full_shard_name))
+        self.__send_http_request(url, solr_client.COMMAND)
 
-                thread = Thread(target=self.__store_single_backup_on_s3_task,
-                                args=(bucket, timestamp, collection_name, shard_number))
-                thread.start()
-                threads.append(thread)
+        # Wait until backup is complete
+        status = 'In Progress'
+        retry = 0
+        delays = workers.exponential_backoff(DEFAULT_STATUS_POLL_INITIAL_WAIT_IN_SECONDS, self.__retry_wait)
+        while status == 'In Progress' and retry < self.__retry_count:
+            time.sleep(next(delays))
+            response = self.__send_http_request(check_url)
+            logging.debug('Status response: [{}]'.format(response))
+            backup = self.__get_backup_details(response)
+            if backup is None or len(backup) <= 5:
+                logging.info('Backup status could not be derived from response ... retrying')
+                retry += 1
+            elif backup == previous_backup:
+                # The backup command may have timed out or been dropped, so a snapshot which never starts counts too
+                logging.info('Backup of [{}] has not started yet ... retrying'.format(full_shard_name))
+                retry += 1
+            else:
+                status = backup[5]
+        if status == 'In Progress':
+            raise Exception('Backup of [{}] did not finish after [{}] status checks'
+                            .format(full_shard_name, self.__retry_count))
+        return status
+
+    def __link_snapshot(self, core_name: str, snapshot_dir: str):
+        """Hardlinks the files of the latest commit of the core into the snapshot directory."""
+        index_path = self.__send_http_request(LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json')\
+            .get('details', {}).get('indexPath')
+        if not index_path:
+            raise Exception('Index path of [{}] is unknown'.format(core_name))
+        # A coordinated backup links the planned commit point as long as it still exists
+        planned_generation = None
+        if self.__plan is not None and core_name in self.__plan['shards']:
+            planned_generation = self.__plan['shards'][core_name]['generation']
+        retry = 0
+        while True:
+            generation = planned_generation or self.__get_index_generation(core_name)
+            file_list = self.__reserve_commit_point(core_name, generation)
+            if file_list is not None:
+                if self.__link_commit_point(core_name, index_path, generation, file_list, snapshot_dir):
+                    break
+                # The links of a commit point which was deleted while it was linked are useless
+                self.__release_snapshot(snapshot_dir)
+            if planned_generation is not None:
+                logging.warning('Planned commit point [{}] of [{}] is gone, linking the latest commit point instead.'
+                                .format(planned_generation, core_name))
+                planned_generation = None
+                continue
+            retry += 1
+            if retry >= self.__retry_count:
+                raise Exception('Could not link the files of generation [{}] of [{}]'.format(generation, core_name))
+            logging.info('Commit point [{}] of [{}] is gone ... retrying'.format(generation, core_name))
+        logging.info('Linked [{}] files of generation [{}] of [{}] into [{}].'
+                     .format(len(file_list), generation, core_name, snapshot_dir))
+
+    def __reserve_commit_point(self, core_name: str, generation: int):
+        """
+        Lists the files of a commit point, which keeps merges from deleting them for a while. Returns None if the
+        commit point is gone.
+        """
+        url = LOCAL_URL + '/' + core_name + '/replication?command=filelist&generation=' + str(generation)
+        response = self.__send_http_request(url + '&wt=json')
+        if 'filelist' not in response:
+            logging.info('Could not list files of generation [{}] of [{}]: {}'
+                         .format(generation, core_name, response.get('message', response.get('status'))))
+            return None
+        return response['filelist']
+
+    def __link_commit_point(self, core_name: str, index_path: str, generation: int, file_list: list,
+                            snapshot_dir: str):
+        """Returns whether all files were linked, False if the commit point was deleted in the meantime."""
+        os.makedirs(snapshot_dir)
+        for number, entry in enumerate(file_list):
+            # Once linked, the files stay on the volume until the links are released
+            if number > 0 and number % LINK_BATCH_SIZE == 0 and \
+                    self.__reserve_commit_point(core_name, generation) is None:
+                return False
+            source = os.path.join(index_path, entry['name'])
+            link = os.path.join(snapshot_dir, entry['name'])
+            try:
+                os.link(source, link)
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    raise Exception('Snapshot [{}] is not on the file system of the index [{}]'
+                                    .format(snapshot_dir, index_path))
+                if e.errno == errno.ENOENT:
+                    logging.info('File [{}] of generation [{}] of [{}] was deleted before it was linked.'
+                                 .format(entry['name'], generation, core_name))
+                    return False
+                raise
+            if os.path.getsize(link) != entry['size']:
+                raise Exception('Linked file [{}] of [{}] has [{}] instead of [{}] bytes'
+                                .format(entry['name'], core_name, os.path.getsize(link), entry['size']))
+        return True
+
+    def __get_snapshot_root(self, timestamp: str):
+        return (SNAPSHOT_ROOT_DIR if self.__hardlink_snapshots else BACKUP_ROOT_DIR) + timestamp
 
-        # Check that all threads have been finished before finishing
-        for thread in threads:
-            thread.join()
-        logging.info('Finished zipping and uploading of backup to S3.')
+    @staticmethod
+    def __release_snapshot(snapshot_dir: str):
+        if os.path.isdir(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+            logging.info('Released snapshot [{}]'.format(snapshot_dir))
 
     def __store_single_backup_on_s3_task(self, bucket: str, timestamp: str, collection_name: str, shard_number: str):
-        backup_dir = BACKUP_ROOT_DIR + timestamp
+        backup_dir = self.__get_snapshot_root(timestamp)
         shard_number_parts = shard_number.split('_')
         logging.info("Create archive for collection [{}], shard number [{}]".format(collection_name, shard_number))
 
         if shard_number != '':
-            core_backup_dir_name = 'snapshot.' + collection_name + '_shard' + shard_number
+            full_shard_name = collection_name + '_shard' + shard_number
         else:
-            core_backup_dir_name = 'snapshot.' + collection_name
+            full_shard_name = collection_name
+        core_backup_dir_name = 'snapshot.' + full_shard_name
+        state, progress = self.__get_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name)
 
         # Normalize shard and backup directory name if it is split (only one-time splits are supported)
         if len(shard_number_parts) > 1:
@@ -180,21 +750,64 @@ class BackupController:
             second_shard_number_part = shard_number_parts[1]
             new_shard_number = str(2 * int(first_shard_number_part) + int(second_shard_number_part) - 1)
             new_shard_backup_dir_name = 'snapshot.' + collection_name + '_shard' + new_shard_number
-            os.rename(backup_dir + '/' + core_backup_dir_name, backup_dir + '/' + new_shard_backup_dir_name)
+            # The snapshot of an interrupted run may have been renamed already
+            if progress is None or progress['snapshot'] != new_shard_backup_dir_name:
+                os.rename(backup_dir + '/' + core_backup_dir_name, backup_dir + '/' + new_shard_backup_dir_name)
+                progress = dict(progress or {}, snapshot=new_shard_backup_dir_name)
+                self.__set_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name, state, progress)
             shard_number = new_shard_number
             core_backup_dir_name = new_shard_backup_dir_name
 
         if shard_number != '':
-            backup_file_name = 'backup_' + timestamp + '_' + collection_name + '_shard' + shard_number + '.tar.gz'
+            backup_name = collection_name + '_shard' + shard_number
         else:
-            backup_file_name = 'backup_' + timestamp + '_' + collection_name + '.tar.gz'
+            backup_name = collection_name
+        backup_file_name = 'backup_' + timestamp + '_' + backup_name + self.__get_archive_extension()
 
         full_backup_file_name = backup_dir + '/' + backup_file_name
 
+        try:
+            if self.__incremental:
+                shard = self.__store_incremental_backup(bucket, timestamp, backup_name, backup_dir,
+                                                        core_backup_dir_name)
+            else:
+                # Restores reserve and verify the extracted size of the archive
+                snapshot_size = self.__get_directory_size(backup_dir + '/' + core_backup_dir_name)
+                if self.__stream_to_s3 or self.__hardlink_snapshots:
+                    shard = self.__stream_single_backup_to_s3(bucket, timestamp, backup_file_name, backup_dir,
+                                                              core_backup_dir_name, snapshot_size)
+                else:
+                    shard = self.__zip_and_upload_single_backup(bucket, timestamp, full_backup_file_name,
+                                                                backup_dir, core_backup_dir_name, full_shard_name,
+                                                                snapshot_size)
+        finally:
+            if self.__hardlink_snapshots:
+                self.__release_snapshot(backup_dir + '/' + core_backup_dir_name)
+        with self.__catalog_lock:
+            self.__catalog_shards[backup_name] = shard
+        self.__set_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name,
+                                  transfer_journal.SHARD_STORED, dict(progress or {}, backup_name=backup_name,
+                                                                      shard=shard))
+
+        logging.info("Successfully created archive for collection [{}], shard number [{}]"
+                     .format(collection_name, shard_number))
+
+    def __zip_and_upload_single_backup(self, bucket: str, timestamp: str, full_backup_file_name: str,
+                                       backup_dir: str, core_backup_dir_name: str, full_shard_name: str,
+                                       snapshot_size: int):
+        state, progress = self.__get_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name)
+        if state == transfer_journal.SHARD_ARCHIVED and os.path.isfile(full_backup_file_name):
+            logging.info('Resuming upload of [{}] of the interrupted run.'.format(full_backup_file_name))
+            return self.__upload_single_backup(bucket, timestamp, full_backup_file_name, progress['sha256'],
+                                               snapshot_size)
+
         zip_result = -1
         retry = 0
         while zip_result != 0 and retry < self.__retry_count:
-            zip_result = self.__zip_backup_file(full_backup_file_name, backup_dir, core_backup_dir_name)
+            # The tarball is at most as large as the snapshot
+            with self.__reserve_disk_space(full_backup_file_name, snapshot_size), \
+                    self.__resource_limits.acquire(workers.RESOURCE_DISK, workers.RESOURCE_CPU):
+                zip_result = self.__zip_backup_file(full_backup_file_name, backup_dir, core_backup_dir_name)
             if zip_result != 0:
                 logging.warning('Creating tarball [{}] failed with result code [{}] ... retrying'
                                 .format(full_backup_file_name, zip_result))
@@ -203,14 +816,178 @@ class BackupController:
         if zip_result != 0:
             raise Exception('Creating tarball [{}] failed with result code [{}]'
                             .format(full_backup_file_name, zip_result))
-
-        upload_result = self.__upload_file_to_s3(bucket=bucket, prefix=timestamp, file_name=full_backup_file_name)
+        with self.__resource_limits.acquire(workers.RESOURCE_DISK):
+            sha256 = content_store.hash_file(full_backup_file_name)
+        self.__set_shard_progress(transfer_journal.RUN_BACKUP, timestamp, full_shard_name,
+                                  transfer_journal.SHARD_ARCHIVED, dict(progress or {}, sha256=sha256))
+        return self.__upload_single_backup(bucket, timestamp, full_backup_file_name, sha256, snapshot_size)
+
+    def __upload_single_backup(self, bucket: str, timestamp: str, full_backup_file_name: str, sha256: str,
+                               snapshot_size: int):
+        with self.__resource_limits.acquire(workers.RESOURCE_NETWORK):
+            upload_result = self.__upload_file_to_s3(bucket=bucket, prefix=timestamp, file_name=full_backup_file_name)
         if upload_result != 0:
             raise Exception('Uploading [{}] to S3  failed with result code [{}]'
-                            .format(full_backup_file_name, zip_result))
-
-        logging.info("Successfully created archive for collection [{}], shard number [{}]"
-                     .format(collection_name, shard_number))
+                            .format(full_backup_file_name, upload_result))
+        return backup_catalog.create_shard(timestamp + '/' + os.path.basename(full_backup_file_name),
+                                           os.path.getsize(full_backup_file_name), sha256, snapshot_size)
+
+    def __store_incremental_backup(self, bucket: str, timestamp: str, backup_name: str, backup_dir: str,
+                                   core_backup_dir_name: str):
+        snapshot_dir = backup_dir + '/' + core_backup_dir_name
+        with self.__resource_limits.acquire(workers.RESOURCE_DISK):
+            manifest = content_store.create_manifest(snapshot_dir)
+        uploaded_files = 0
+        uploaded_size = 0
+        # Objects which the upload of another shard is still storing, the manifest must wait for them
+        awaited_objects = []
+        for entry in manifest['files']:
+            key = content_store.get_object_key(entry['sha256'])
+            with self.__stored_objects_lock:
+                if key in self.__stored_objects:
+                    continue
+                if key in self.__pending_objects:
+                    awaited_objects.append((entry, self.__pending_objects[key]))
+                    continue
+                pending = Future()
+                self.__pending_objects[key] = pending
+            stored = False
+            try:
+                with self.__resource_limits.acquire(workers.RESOURCE_NETWORK):
+                    upload_result = self.__upload_object_to_s3(bucket, key, snapshot_dir + '/' + entry['name'])
+                if upload_result != 0:
+                    raise Exception('Uploading [{}] of [{}] to S3 failed with result code [{}]'
+                                    .format(entry['name'], core_backup_dir_name, upload_result))
+                stored = True
+            finally:
+                with self.__stored_objects_lock:
+                    del self.__pending_objects[key]
+                    if stored:
+                        self.__stored_objects.add(key)
+                pending.set_result(stored)
+            uploaded_files += 1
+            uploaded_size += entry['size']
+        for entry, pending in awaited_objects:
+            if not pending.result():
+                raise Exception('Uploading [{}] of [{}] to S3 failed in the backup of another shard'
+                                .format(entry['name'], core_backup_dir_name))
+
+        # The manifest is uploaded last, so it only references objects which are already stored
+        manifest_file_name = backup_dir + '/' + content_store.get_manifest_file_name(timestamp, backup_name)
+        content_store.write_manifest(manifest, manifest_file_name)
+        upload_result = self.__upload_file_to_s3(bucket=bucket, prefix=timestamp, file_name=manifest_file_name)
+        if upload_result != 0:
+            raise Exception('Uploading [{}] to S3 failed with result code [{}]'
+                            .format(manifest_file_name, upload_result))
+        logging.info('Uploaded [{}] of [{}] files ([{}] of [{}] bytes) of [{}], the rest is already stored.'
+                     .format(uploaded_files, len(manifest['files']), uploaded_size,
+                             sum(entry['size'] for entry in manifest['files']), core_backup_dir_name))
+        snapshot_size = sum(entry['size'] for entry in manifest['files'])
+        return backup_catalog.create_shard(timestamp + '/' + os.path.basename(manifest_file_name), snapshot_size,
+                                           content_store.hash_file(manifest_file_name), snapshot_size)
+
+    def __stream_single_backup_to_s3(self, bucket: str, timestamp: str, backup_file_name: str, backup_dir: str,
+                                     core_backup_dir_name: str, snapshot_size: int):
+        # The snapshot is tarred and compressed into a pipe which is uploaded as S3 multipart parts while it is
+        # produced, so no tarball is ever written to the backup volume.
+        stream_result = -1
+        retry = 0
+        checksum = None
+        while stream_result != 0 and retry < self.__retry_count:
+            with self.__resource_limits.acquire(workers.RESOURCE_DISK, workers.RESOURCE_CPU,
+                                                workers.RESOURCE_NETWORK):
+                stream_result, checksum = self.__stream_backup_file_to_s3(bucket=bucket, prefix=timestamp,
+                                                                          file_name=backup_file_name,
+                                                                          directory=backup_dir,
+                                                                          source=core_backup_dir_name)
+            if stream_result != 0:
+                logging.warning('Streaming [{}] to S3 failed with result code [{}] ... retrying'
+                                .format(backup_file_name, stream_result))
+                retry += 1
+                time.sleep(self.__retry_wait)
+        if stream_result != 0:
+            raise Exception('Streaming [{}] to S3 failed with result code [{}]'
+                            .format(backup_file_name, stream_result))
+        return backup_catalog.create_shard(timestamp + '/' + backup_file_name, checksum.size, checksum.hexdigest(),
+                                           snapshot_size)
+
+    def __write_catalog_entry(self, bucket: str, timestamp: str):
+        if not self.__catalog_shards:
+            logging.info('No shards were backed up, skipping catalog entry for timestamp [{}].'.format(timestamp))
+            return
+        coordination = None
+        if self.__plan is not None:
+            coordination = backup_catalog.create_coordination(
+                self.__plan['coordinator'],
+                {core_name: shard['generation'] for core_name, shard in self.__plan['shards'].items()
+                 if core_name in self.__snapshot_generations},
+                self.__snapshot_generations)
+        entry = backup_catalog.create_entry(timestamp, self.__node_name,
+                                            'incremental' if self.__incremental else 'archive', self.__catalog_shards,
+                                            coordination, self.__get_expected_backup_names())
+        entry_key = backup_catalog.get_entry_key(timestamp, self.__node_name)
+        self.__get_s3_transfer().put_bytes(backup_catalog.dumps(entry), bucket, entry_key)
+        logging.info('Wrote catalog entry [{}] for [{}] shards.'.format(entry_key, len(self.__catalog_shards)))
+
+        if self.__coordinator is not None:
+            # Nodes finishing at the same time would otherwise both see the backup as incomplete
+            with self.__coordinator.locked():
+                self.__advance_latest_catalog_entry(bucket, entry_key, entry)
+        else:
+            self.__advance_latest_catalog_entry(bucket, entry_key, entry)
+
+    def __get_expected_backup_names(self):
+        """Returns the backup names of the shards of all nodes or None if only the local shards are known."""
+        if self.__plan is not None:
+            return [backup_catalog.get_backup_name(shard['collection'], shard['shard'])
+                    for shard in self.__plan['shards'].values()]
+        if self.__cluster_state is not None:
+            return [backup_catalog.get_backup_name(collection_name, shard_name)
+                    for collection_name, shard_name in self.__cluster_state.get_active_shards()]
+        return None
+
+    def __advance_latest_catalog_entry(self, bucket: str, entry_key: str, entry: dict):
+        # The node which stores the last missing shard of the backup moves the pointer
+        entries = self.__read_catalog_entries(bucket, entry['timestamp'])
+        entries[entry_key] = entry
+        missing_shards = backup_catalog.get_missing_shards(list(entries.values()))
+        if missing_shards:
+            logging.info('Backup [{}] still lacks shards [{}] of other nodes, the latest backup is not moved yet.'
+                         .format(entry['timestamp'], ', '.join(missing_shards)))
+            return
+        if not backup_catalog.is_consistent(list(entries.values())):
+            if self.__require_consistent:
+                logging.error('Backup [{}] is complete, but some shards were not snapshotted at their planned '
+                              'generation, the latest backup is not moved.'.format(entry['timestamp']))
+                return
+            logging.warning('Backup [{}] is complete, but some shards were not snapshotted at their planned '
+                            'generation.'.format(entry['timestamp']))
+        # The pointer is written after the entries it points to and never moved back to an older backup
+        if backup_catalog.is_newer(entry['timestamp'], self.__read_latest_catalog_entry(bucket)):
+            self.__get_s3_transfer().put_bytes(backup_catalog.dumps(backup_catalog.create_latest(entry_key, entry)),
+                                               bucket, backup_catalog.LATEST_KEY)
+            logging.info('Backup [{}] is complete, it is the latest backup now.'.format(entry['timestamp']))
+
+    def __read_catalog_entries(self, bucket: str, timestamp: str):
+        """Returns the catalog entries of all nodes of the backup by key."""
+        entries = {}
+        for key in self.__get_s3_transfer().list_keys(bucket, backup_catalog.get_entry_prefix(timestamp)):
+            data = self.__get_s3_transfer().get_bytes(bucket, key)
+            if data is not None:
+                entries[key] = backup_catalog.loads(data, key)
+        return entries
+
+    def __find_latest_complete_backup(self, bucket: str):
+        prefixes = self.__get_s3_transfer().list_prefixes(bucket, backup_catalog.CATALOG_PREFIX + '/')
+        for timestamp in backup_catalog.get_catalog_timestamps(prefixes):
+            if backup_catalog.is_complete(list(self.__read_catalog_entries(bucket, timestamp).values()),
+                                          self.__require_consistent):
+                return timestamp
+        return None
+
+    def __read_latest_catalog_entry(self, bucket: str):
+        data = self.__get_s3_transfer().get_bytes(bucket, backup_catalog.LATEST_KEY)
+        return backup_catalog.loads(data, backup_catalog.LATEST_KEY) if data is not None else None
 
     def __restore_core(self, core_name: str, timestamp: str):
         sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
@@ -232,7 +1009,7 @@ class BackupController:
         url += '&location=' + BACKUP_ROOT_DIR + timestamp
         url += '&name=' + full_shard_name
         logging.info('Restoring backup for [{}] locally ...'.format(full_shard_name))
-        self.__send_http_request(url)
+        self.__send_http_request(url, solr_client.COMMAND)
 
         # Wait until backup restoration is complete
         check_url = LOCAL_URL + '/' + core_name + '/replication?command=restorestatus'
@@ -240,15 +1017,16 @@ class BackupController:
         status = 'In Progress'
         retry = 0
         response = None
+        delays = workers.exponential_backoff(DEFAULT_STATUS_POLL_INITIAL_WAIT_IN_SECONDS, self.__retry_wait)
         while status == 'In Progress' and retry < self.__retry_count:
-            response = json.loads(self.__send_http_request(check_url))
+            time.sleep(next(delays))
+            response = self.__send_http_request(check_url)
             logging.debug('Status response: [{}]'.format(response))
             if 'restorestatus' in response and 'status' in response['restorestatus']:
                 status = response['restorestatus']['status']
             else:
                 logging.info('Backup status could not be derived from response ... retrying')
                 retry += 1
-            time.sleep(self.__retry_wait)
 
         if status == 'success':
             logging.info('Restoring backup for [{}] successful'.format(full_shard_name))
@@ -260,8 +1038,9 @@ class BackupController:
             raise Exception('Error while restoring backup for [{}] locally: [{}]'
                             .format(full_shard_name, exception))
 
-    def __trigger_local_commit(self):
-        for core_name in self.__get_local_cores():
+    def __trigger_local_commit(self, core_names: list):
+        cores_by_collection = {}
+        for core_name in core_names:
             sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
             single_regex_match = re.match(REGEX_SINGLE_CORE, core_name)
             if sharded_regex_match:
@@ -270,89 +1049,363 @@ class BackupController:
                 collection_name = single_regex_match.group(1)
             else:
                 raise Exception('Unknown core name format [{}]'.format(core_name))
+            cores_by_collection.setdefault(collection_name, []).append(core_name)
 
+        # A commit on the collection is distributed to all of its replicas, so it is only sent once per collection
+        for collection_name, core_names in sorted(cores_by_collection.items()):
+            generations = {core_name: self.__get_index_generation(core_name) for core_name in core_names}
             url = LOCAL_URL + '/' + collection_name + '/update?commit=true&wt=json'
             logging.info('Triggering hard commit for [{}] ...'.format(collection_name))
-            self.__send_http_request(url)
-        logging.info('Waiting for hard commits to finish ...')
-        time.sleep(self.__wait_timeout)
-        logging.info('Successfully triggered hard commit for all locally hosted collections.')
+            if self.__send_http_request(url, solr_client.COMMIT) is None:
+                # The request timed out before the commit returned, so wait until it shows up in the index
+                self.__wait_for_commit(collection_name, generations)
+        logging.info('Successfully triggered hard commit for all collections which are backed up on this node.')
+
+    def __wait_for_commit(self, collection_name: str, generations: dict):
+        logging.info('Waiting for hard commit of [{}] to finish ...'.format(collection_name))
+        deadline = time.time() + self.__wait_timeout
+        delays = workers.exponential_backoff(DEFAULT_STATUS_POLL_INITIAL_WAIT_IN_SECONDS, self.__retry_wait)
+        pending = dict(generations)
+        while pending and time.time() < deadline:
+            time.sleep(min(next(delays), max(deadline - time.time(), 0)))
+            for core_name, generation in list(pending.items()):
+                if self.__get_index_generation(core_name) > generation:
+                    del pending[core_name]
+        if pending:
+            logging.warning('Hard commit of [{}] did not show up in cores [{}] within [{}] seconds.'
+                            .format(collection_name, ', '.join(sorted(pending)), self.__wait_timeout))
+
+    def __get_index_generation(self, core_name: str):
+        url = LOCAL_URL + '/' + core_name + '/replication?command=indexversion&wt=json'
+        return int(self.__send_http_request(url).get('generation', 0))
 
     def __restore_latest_backup(self, bucket: str, timestamp: str):
-        retry = 0
         logging.info('Start restoring backup for timestamp [{}] from S3 bucket [{}].'.format(timestamp, bucket))
 
         backup_dir = BACKUP_ROOT_DIR + timestamp
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
-
-        threads = []
-        while retry < self.__restore_retry_count:
-
-            for core_name in self.__get_local_cores():
-                sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
-                single_regex_match = re.match(REGEX_SINGLE_CORE, core_name)
-                if sharded_regex_match:
-                    collection_name = sharded_regex_match.group(1)
-                    shard_name = sharded_regex_match.group(2)
-                    shard_backup_dest = backup_dir + '/snapshot.' + collection_name + '_' + shard_name
-                elif single_regex_match:
-                    collection_name = single_regex_match.group(1)
-                    shard_backup_dest = backup_dir + '/snapshot.' + collection_name
-                else:
-                    raise Exception('Unknown core name format [{}]'.format(core_name))
-
-                if not os.path.isdir(shard_backup_dest):
-                    thread = Thread(target=self.__restore_single_backup_task,
-                                    args=(bucket, timestamp, collection_name, shard_name, core_name))
-                    thread.start()
-                    threads.append(thread)
-                else:
-                    logging.debug('Skipping shard [{}] of collection [{}] since it is already restored.'
-                                  .format(shard_name, collection_name))
-            time.sleep(self.__restore_retry_wait)
-            retry += 1
-
-        # Check that all threads have been finished before finishing
-        for thread in threads:
-            thread.join()
+        self.__restore_catalog_shards = self.__read_catalog_shards(bucket, timestamp)
+        self.__restore_sizes = {}
+        self.__replica_wait_deadlines = {}
+
+        # Cores are restored as soon as they appear, the run ends once the cores of all shards in the catalog which
+        # this node hosts are restored, or once no new cores appeared for one retry wait if they are not known
+        scheduler = restore_scheduler.RestoreScheduler(
+            get_local_cores=self.__get_local_cores,
+            restore_core=lambda core_name, report_state: self.__restore_single_backup_task(
+                bucket, timestamp, core_name, report_state),
+            pool_size=self.__pool_size,
+            timeout=self.__restore_retry_count * self.__restore_retry_wait,
+            settle_time=self.__restore_retry_wait,
+            poll_interval=min(restore_scheduler.DEFAULT_POLL_INTERVAL_IN_SECONDS, self.__restore_retry_wait),
+            order_cores=lambda core_names: self.__order_cores_for_restore(bucket, timestamp, core_names),
+            get_expected_cores=self.__get_expected_restore_cores)
+        scheduler.run()
 
         logging.info('Finished restoring backup for timestamp [{}] from S3 bucket [{}].'.format(timestamp, bucket))
+        logging.info('S3 transfer statistics: [{}]'.format(self.__get_s3_transfer().get_stats()))
 
-    def __restore_single_backup_task(self, bucket: str, timestamp: str, collection_name: str, shard_name: str,
-                                     core_name: str):
-        backup_file_name = 'backup_' + timestamp + '_' + collection_name + '_' + shard_name + '.tar.gz'
-        if os.path.isfile(BACKUP_ROOT_DIR + backup_file_name):
-            logging.debug('Skipping shard [{}] of collection [{}] since download has already been started.'
-                          .format(shard_name, collection_name))
+    def __read_catalog_shards(self, bucket: str, timestamp: str):
+        """Returns the catalog records of the shards of the backup stored by any node by backup name."""
+        shards = {}
+        try:
+            for entry in self.__read_catalog_entries(bucket, timestamp).values():
+                shards.update(entry['shards'])
+        except Exception as e:
+            logging.warning('Could not read the catalog of backup [{}]: {}'.format(timestamp, e))
+        return shards
+
+    def __get_expected_restore_cores(self, local_cores: list):
+        """
+        Returns the cores which this node has to restore or None if they are not known. They are known once the
+        cluster state contains every shard of the catalog of the backup, i.e. all collections have been created.
+        """
+        if not self.__restore_catalog_shards:
+            return None
+        try:
+            state = self.__get_cluster_state()
+            if state is None:
+                return None
+            shards = {backup_catalog.get_backup_name(*shard): shard for shard in state.get_active_shards()}
+            missing_shards = sorted(set(self.__restore_catalog_shards) - set(shards))
+            if missing_shards:
+                logging.info('Shards [{}] of the backup are not in the cluster state yet.'
+                             .format(', '.join(missing_shards)))
+                return None
+            node_name = self.__get_local_node_name(state, local_cores)
+            if node_name is None:
+                return None
+            return state.get_node_cores(node_name, [shards[backup_name] for backup_name
+                                                    in self.__restore_catalog_shards])
+        except Exception as e:
+            logging.warning('Could not determine the cores to restore on this node: {}'.format(e))
+            return None
+
+    def __get_local_node_name(self, state: cluster_state.ClusterState, local_cores: list):
+        for core_name in local_cores:
+            node_name = state.get_node_name(core_name)
+            if node_name is not None:
+                return node_name
+        # A node without cores yet only knows its name from the system info
+        return self.__send_http_request(LOCAL_URL + '/admin/info/system?wt=json').get('node')
+
+    def __get_restore_sizes(self, bucket: str, timestamp: str, backup_name: str):
+        """Returns the archive size and the extracted size of the backup of a shard."""
+        with self.__restore_sizes_lock:
+            if backup_name not in self.__restore_sizes:
+                self.__restore_sizes[backup_name] = self.__look_up_restore_sizes(bucket, timestamp, backup_name)
+            return self.__restore_sizes[backup_name]
+
+    def __look_up_restore_sizes(self, bucket: str, timestamp: str, backup_name: str):
+        shard = self.__restore_catalog_shards.get(backup_name)
+        if self.__incremental:
+            # Files are downloaded one by one, the manifest has the exact sizes
+            return 0, shard['size'] if shard else 0
+        if shard is not None:
+            archive_size = shard['size']
         else:
-            shard_backup_dest = BACKUP_ROOT_DIR + timestamp + '/snapshot.' + collection_name + '_' + shard_name
-            logging.info('Restoring backup for shard [{}] of collection [{}] ...'.format(shard_name, collection_name))
-            self.__download_file_from_s3(bucket, timestamp, backup_file_name, BACKUP_ROOT_DIR)
-            self.__unzip_backup_file(BACKUP_ROOT_DIR + backup_file_name, BACKUP_ROOT_DIR + timestamp)
-            if os.path.isdir(shard_backup_dest):
-                self.__restore_core(core_name, timestamp)
-                logging.info('Successfully restored backup for shard [{}] of collection [{}].'
-                             .format(shard_name, collection_name))
+            # Backups from before the catalog only have the size of their archive
+            archive_size = self.__get_s3_transfer().get_size(
+                bucket, timestamp + '/backup_' + timestamp + '_' + backup_name + self.__get_archive_extension()) or 0
+        extracted_size = shard.get('extracted_size') if shard else None
+        if extracted_size is None:
+            extracted_size = int(archive_size * ARCHIVE_EXPANSION_ESTIMATE)
+        return archive_size, extracted_size
+
+    def __order_cores_for_restore(self, bucket: str, timestamp: str, core_names: list):
+        if self.__disk_space is not None:
+            # Large shards go first, so the restore does not end with a single large download
+            core_names = sorted(core_names, key=lambda core_name: -sum(self.__get_restore_sizes_of_core(
+                bucket, timestamp, core_name)))
+        if not self.__restore_from_leader:
+            return core_names
+        # Elected replicas go first, the other replicas on this and other nodes wait for them to be restored
+        state = self.__get_cluster_state()
+        if state is None:
+            return core_names
+        return sorted(core_names, key=lambda core_name: not state.is_elected(core_name))
+
+    def __get_restore_sizes_of_core(self, bucket: str, timestamp: str, core_name: str):
+        try:
+            return self.__get_restore_sizes(bucket, timestamp, self.__get_backup_name(core_name))
+        except Exception as e:
+            logging.warning('Could not look up the backup size of [{}]: {}'.format(core_name, e))
+            return 0, 0
+
+    def __restore_single_backup_task(self, bucket: str, timestamp: str, core_name: str, report_state):
+        if self.__get_shard_progress(transfer_journal.RUN_RESTORE, timestamp, core_name)[0] == \
+                transfer_journal.CORE_RESTORED:
+            logging.info('Core [{}] was already restored by the interrupted run.'.format(core_name))
+            return
+        if self.__restore_from_leader:
+            source_replica = self.__get_restore_source_replica(core_name)
+            if source_replica is not None:
+                if self.__replicate_core(core_name, source_replica, report_state):
+                    return
+                logging.warning('Replicating [{}] from [{}] failed, restoring it from S3 instead.'
+                                .format(core_name, source_replica['core']))
+
+        backup_name = self.__get_backup_name(core_name)
+        shard_backup_dest = BACKUP_ROOT_DIR + timestamp + '/snapshot.' + backup_name
+
+        # Replicas of the same shard on this node share one snapshot directory, which is only prepared once
+        with self.__get_snapshot_lock(backup_name):
+            # The snapshot directory of an interrupted run may be incomplete
+            prepared = self.__journal is None or self.__get_shard_progress(
+                transfer_journal.RUN_RESTORE, timestamp, backup_name)[0] == transfer_journal.SHARD_PREPARED
+            if os.path.isdir(shard_backup_dest) and prepared:
+                logging.debug('Snapshot for [{}] is already prepared.'.format(backup_name))
             else:
-                logging.warning('Failed to prepare snapshot directory for shard [{}] of collection [{}].'
-                                .format(shard_name, collection_name))
-            os.remove(BACKUP_ROOT_DIR + backup_file_name)
+                if self.__journal is not None:
+                    self.__release_snapshot(shard_backup_dest)
+                try:
+                    self.__prepare_snapshot(bucket, timestamp, backup_name, report_state)
+                    if not os.path.isdir(shard_backup_dest):
+                        raise Exception('Failed to prepare snapshot directory for [{}].'.format(backup_name))
+                    self.__verify_snapshot_size(backup_name, shard_backup_dest)
+                except Exception:
+                    # Other replicas of the shard must not restore a partially extracted snapshot
+                    self.__release_snapshot(shard_backup_dest)
+                    raise
+                self.__set_shard_progress(transfer_journal.RUN_RESTORE, timestamp, backup_name,
+                                          transfer_journal.SHARD_PREPARED)
+
+        report_state(restore_scheduler.STATE_RESTORING)
+        self.__restore_core(core_name, timestamp)
+        self.__set_shard_progress(transfer_journal.RUN_RESTORE, timestamp, core_name, transfer_journal.CORE_RESTORED)
+        logging.info('Successfully restored backup for [{}] into core [{}].'.format(backup_name, core_name))
+
+    def __verify_snapshot_size(self, backup_name: str, snapshot_dir: str):
+        shard = self.__restore_catalog_shards.get(backup_name)
+        if shard is None or shard.get('extracted_size') is None:
+            return
+        size = self.__get_directory_size(snapshot_dir)
+        if size != shard['extracted_size']:
+            raise Exception('Snapshot [{}] has [{}] instead of [{}] bytes, it was not extracted completely.'
+                            .format(snapshot_dir, size, shard['extracted_size']))
+
+    def __get_restore_source_replica(self, core_name: str):
+        state = self.__get_cluster_state()
+        shard = state.get_shard(core_name) if state else None
+        if shard is None:
+            return None
+        elected_replica = state.get_elected_replica(*shard)
+        if elected_replica is None or elected_replica['core'] == core_name:
+            return None
+        return elected_replica
+
+    def __replicate_core(self, core_name: str, source_replica: dict, report_state):
+        """
+        Replicates the restored index of the source replica into the core and returns whether it succeeded. Raises
+        `RestoreDeferred` while the source replica is still being restored, so the wait does not block the pool.
+        """
+        source_url = cluster_state.ClusterState.get_core_url(source_replica)
+        try:
+            status = self.__send_http_request(source_url + '/replication?command=restorestatus&wt=json')\
+                .get('restorestatus', {}).get('status')
+        except solr_client.SolrError as e:
+            logging.debug('Getting the restore status of [{}] failed: {}'.format(source_replica['core'], e))
+            status = None
+        if status not in ['success', 'failed']:
+            deadline = self.__replica_wait_deadlines.setdefault(core_name, time.time() + self.__replica_wait)
+            if time.time() < deadline:
+                logging.info('Waiting for [{}] to be restored before replicating it into [{}] ...'
+                             .format(source_replica['core'], core_name))
+                raise restore_scheduler.RestoreDeferred('[{}] is not restored yet'.format(source_replica['core']))
+            logging.warning('[{}] was not restored within [{}] seconds.'.format(source_replica['core'],
+                                                                              self.__replica_wait))
+            return False
+        if status != 'success':
+            logging.warning('Restore of [{}] did not succeed: [{}]'.format(source_replica['core'], status))
+            return False
+
+        report_state(restore_scheduler.STATE_REPLICATING)
+
+        source_generation = int(self.__send_http_request(source_url + '/replication?command=indexversion&wt=json')
+                                .get('generation', 0))
+        url = LOCAL_URL + '/' + core_name + '/replication?command=fetchindex&wt=json'
+        url += '&masterUrl=' + urllib.parse.quote(source_url + '/replication', safe='')
+        logging.info('Replicating [{}] into [{}] ...'.format(source_replica['core'], core_name))
+        self.__send_http_request(url, solr_client.COMMAND)
+
+        generation = self.__wait_for_status(LOCAL_URL + '/' + core_name + '/replication?command=indexversion&wt=json',
+                                            lambda response: int(response.get('generation', 0)),
+                                            [source_generation])
+        if generation != source_generation:
+            logging.warning('Index of [{}] did not reach generation [{}] of [{}]'
+                            .format(core_name, source_generation, source_replica['core']))
+            return False
+        logging.info('Successfully replicated [{}] into [{}].'.format(source_replica['core'], core_name))
+        return True
+
+    def __wait_for_status(self, url: str, get_status, final_statuses: list):
+        """Polls the url until the status derived from its response is final or the restore timeout is over."""
+        deadline = time.time() + self.__restore_retry_count * self.__restore_retry_wait
+        delays = workers.exponential_backoff(DEFAULT_STATUS_POLL_INITIAL_WAIT_IN_SECONDS, self.__restore_retry_wait)
+        status = None
+        while True:
+            try:
+                status = get_status(self.__send_http_request(url))
+            except solr_client.SolrError as e:
+                logging.debug('Polling [{}] failed: {}'.format(url, e))
+            if status in final_statuses or time.time() >= deadline:
+                return status
+            time.sleep(min(next(delays), max(deadline - time.time(), 0)))
+
+    def __prepare_snapshot(self, bucket: str, timestamp: str, backup_name: str, report_state):
+        if self.__incremental:
+            download_file_name = content_store.get_manifest_file_name(timestamp, backup_name)
+        else:
+            download_file_name = 'backup_' + timestamp + '_' + backup_name + self.__get_archive_extension()
+
+        logging.info('Preparing snapshot for [{}] ...'.format(backup_name))
+        report_state(restore_scheduler.STATE_DOWNLOADING)
+        if self.__incremental:
+            with self.__resource_limits.acquire(workers.RESOURCE_NETWORK):
+                self.__download_file_from_s3(bucket, timestamp, download_file_name, BACKUP_ROOT_DIR)
+                self.__rebuild_snapshot_from_manifest(bucket, BACKUP_ROOT_DIR + download_file_name,
+                                                      BACKUP_ROOT_DIR + timestamp)
+            os.remove(BACKUP_ROOT_DIR + download_file_name)
+        elif self.__stream_to_s3:
+            with self.__reserve_disk_space(backup_name, self.__get_restore_sizes(bucket, timestamp, backup_name)[1]), \
+                    self.__resource_limits.acquire(workers.RESOURCE_DISK, workers.RESOURCE_CPU,
+                                                   workers.RESOURCE_NETWORK):
+                extract_result = self.__stream_backup_file_from_s3(bucket=bucket, prefix=timestamp,
+                                                                   file_name=download_file_name,
+                                                                   destination=BACKUP_ROOT_DIR + timestamp)
+            if extract_result != 0:
+                raise Exception('Streaming [{}] from S3 failed with result code [{}]'
+                                .format(download_file_name, extract_result))
+        else:
+            # The archive is only removed once it is extracted, so both need space at the same time
+            with self.__reserve_disk_space(backup_name, sum(self.__get_restore_sizes(bucket, timestamp, backup_name))):
+                with self.__resource_limits.acquire(workers.RESOURCE_NETWORK):
+                    download_result = self.__download_file_from_s3(bucket, timestamp, download_file_name,
+                                                                   BACKUP_ROOT_DIR)
+                if download_result != 0:
+                    raise Exception('Downloading [{}] from S3 failed with result code [{}]'
+                                    .format(download_file_name, download_result))
+                report_state(restore_scheduler.STATE_EXTRACTING)
+                with self.__resource_limits.acquire(workers.RESOURCE_DISK, workers.RESOURCE_CPU):
+                    extract_result = self.__unzip_backup_file(BACKUP_ROOT_DIR + download_file_name,
+                                                              BACKUP_ROOT_DIR + timestamp)
+                os.remove(BACKUP_ROOT_DIR + download_file_name)
+            if extract_result != 0:
+                raise Exception('Extracting [{}] failed with result code [{}]'
+                                .format(download_file_name, extract_result))
+
+    def __get_snapshot_lock(self, backup_name: str):
+        with self.__snapshot_locks_lock:
+            if backup_name not in self.__snapshot_locks:
+                self.__snapshot_locks[backup_name] = Lock()
+            return self.__snapshot_locks[backup_name]
+
+    def __rebuild_snapshot_from_manifest(self, bucket: str, manifest_file_name: str, destination: str):
+        manifest = content_store.read_manifest(manifest_file_name)
+        snapshot_dir = destination + '/' + manifest['snapshot']
+        with self.__reserve_disk_space(snapshot_dir, sum(entry['size'] for entry in manifest['files'])):
+            for entry in manifest['files']:
+                file_name = snapshot_dir + '/' + entry['name']
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                key = content_store.get_object_key(entry['sha256'])
+                download_result = self.__download_object_from_s3(bucket, key, file_name)
+                if download_result != 0 or not content_store.verify_file(file_name, entry):
+                    raise Exception('Downloading [{}] of [{}] from S3 failed with result code [{}]'
+                                    .format(entry['name'], manifest['snapshot'], download_result))
+        logging.info('Rebuilt [{}] from [{}] stored files.'.format(snapshot_dir, len(manifest['files'])))
 
     def __get_local_cores(self):
         logging.info('Getting locally hosted cores ...')
         try:
             url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
-            core_status_response = json.loads(self.__send_http_request(url))
+            core_status_response = self.__send_http_request(url)
             local_cores = []
             if 'status' in core_status_response:
-                local_cores = core_status_response['status'].keys()
+                local_cores = list(core_status_response['status'].keys())
             logging.info('Locally hosted cores are: [{}]'.format(local_cores))
             return local_cores
         except Exception as e:
             logging.warning('Could not get locally hosted cores: [{}]'.format(e))
             return []
 
+    @staticmethod
+    def __get_backup_details(response: dict):
+        if 'details' in response and 'backup' in response['details']:
+            return response['details']['backup']
+        return None
+
+    @staticmethod
+    def __get_backup_name(core_name: str):
+        sharded_regex_match = re.match(REGEX_SHARDED_CORES, core_name)
+        single_regex_match = re.match(REGEX_SINGLE_CORE, core_name)
+        if sharded_regex_match:
+            return sharded_regex_match.group(1) + '_' + sharded_regex_match.group(2)
+        elif single_regex_match:
+            return single_regex_match.group(1)
+        else:
+            raise Exception('Unknown core name format [{}]'.format(core_name))
+
     @staticmethod
     def __clean_up_backup_dir():
         logging.info('Cleaning up backup directory ...')
@@ -367,58 +1420,248 @@ class BackupController:
                 else:
                     logging.warning('Could not delete [{}]'.format(path))
 
-    @staticmethod
-    def __send_http_request(url: str):
+    def __send_http_request(self, url: str, policy: solr_client.RetryPolicy = solr_client.STATUS):
         try:
-            logging.debug('Send HTTP GET request to [{}]'.format(url))
-            request = urllib.request.Request(url)
-            response = urllib.request.urlopen(request)
-            code = response.getcode()
-            content = response.read().decode('utf-8')
-            response.close()
-            if code != 200:
-                raise Exception('Received unexpected status code from Solr: [{}]'.format(code))
-            return content
-        except urllib.error.HTTPError as e:
-            if e.code == 504:
-                logging.warning('HTTP Timeout, but should have been done anyways.')
-            else:
-                raise Exception('Failed sending request to Solr [{}]: {}'.format(url, e))
-        except Exception as e:
-            raise Exception('Failed sending request to Solr [{}]: {}'.format(url, e))
+            return self.__http_client.get_json(url, policy)
+        except solr_client.RequestTimeout as e:
+            if policy.retry_timeouts:
+                raise
+            # Solr keeps processing commands after the response timed out
+            logging.warning('{}, but should have been done anyways.'.format(e))
+            return None
+
+    def __get_s3_transfer(self):
+        with self.__s3_transfer_lock:
+            if self.__s3_transfer is None:
+                self.__s3_transfer = s3_transfer.S3Transfer(self.__s3_endpoint_url,
+                                                            max_concurrency=self.__s3_max_concurrency,
+                                                            chunk_size=self.__s3_chunk_size, journal=self.__journal)
+            return self.__s3_transfer
 
     @staticmethod
-    def __download_file_from_s3(bucket, prefix, file_name, destination):
-        command = ['aws', 's3', 'cp', 's3://' + bucket + '/' + prefix + '/' + file_name, destination]
-        logging.debug('Executing [{}]'.format(' '.join(command)))
-        return subprocess.call(command)
+    def __run_s3_transfer(function, *args, **kwargs):
+        try:
+            function(*args, **kwargs)
+            return 0
+        except s3_transfer.S3TransferError as e:
+            logging.warning(str(e))
+            return 1
 
-    @staticmethod
-    def __upload_file_to_s3(bucket, prefix, file_name):
-        command = ['aws', 's3', 'cp', file_name, 's3://' + bucket + '/' + prefix + '/']
-        logging.debug('Executing [{}]'.format(' '.join(command)))
-        return subprocess.call(command)
+    def __download_file_from_s3(self, bucket, prefix, file_name, destination):
+        return self.__run_s3_transfer(self.__get_s3_transfer().download_file, bucket, prefix + '/' + file_name,
+                                      os.path.join(destination, file_name))
+
+    def __upload_file_to_s3(self, bucket, prefix, file_name):
+        return self.__run_s3_transfer(self.__get_s3_transfer().upload_file, file_name, bucket,
+                                      prefix + '/' + os.path.basename(file_name))
+
+    def __upload_object_to_s3(self, bucket, key, file_name):
+        return self.__run_s3_transfer(self.__get_s3_transfer().upload_file, file_name, bucket, key)
+
+    def __download_object_from_s3(self, bucket, key, file_name):
+        return self.__run_s3_transfer(self.__get_s3_transfer().download_file, bucket, key, file_name)
+
+    def __list_stored_objects(self, bucket):
+        stored_objects = set(self.__get_s3_transfer().list_keys(bucket, content_store.OBJECTS_PREFIX + '/'))
+        logging.info('Found [{}] stored objects in S3 bucket [{}].'.format(len(stored_objects), bucket))
+        return stored_objects
+
+    def __stream_backup_file_to_s3(self, bucket, prefix, file_name, directory, source):
+        key = prefix + '/' + file_name
+        # The uncompressed size is an upper bound of the archive size, which the multipart upload needs to choose
+        # large enough parts for big streams.
+        expected_size = self.__get_directory_size(os.path.join(directory, source))
+
+        if self.__codec:
+            compression_result = [0]
+
+            def compress(writer):
+                try:
+                    with writer:
+                        compression.write_archive(writer, directory, source, self.__codec,
+                                                  workers=self.__compression_workers, throttle=self.__throttle)
+                except Exception as e:
+                    logging.warning('Compressing [{}] failed: {}'.format(source, e))
+                    compression_result[0] = 1
+
+            read_fd, write_fd = os.pipe()
+            compression_thread = Thread(target=compress, args=(os.fdopen(write_fd, 'wb'),))
+            compression_thread.start()
+            with os.fdopen(read_fd, 'rb') as reader:
+                checksum = backup_catalog.StreamChecksum(reader)
+                upload_result = self.__run_s3_transfer(self.__get_s3_transfer().upload_stream, checksum, bucket,
+                                                       key, expected_size)
+            compression_thread.join()
+            return compression_result[0] if compression_result[0] != 0 else upload_result, checksum
+
+        tar_command = ['tar', '-czf', '-', '-C', directory, source]
+        logging.debug('Executing [{}]'.format(' '.join(tar_command)))
+        tar_process = subprocess.Popen(tar_command, stdout=subprocess.PIPE)
+        archive = tar_process.stdout
+        if self.__throttle is not None:
+            archive = throttle.ThrottledReader(archive, self.__throttle)
+        checksum = backup_catalog.StreamChecksum(archive)
+        upload_result = self.__run_s3_transfer(self.__get_s3_transfer().upload_stream, checksum, bucket, key,
+                                               expected_size)
+        # Close our end of the pipe so that tar receives SIGPIPE if the upload died
+        tar_process.stdout.close()
+        tar_result = tar_process.wait()
+        return tar_result if tar_result != 0 else upload_result, checksum
+
+    def __stream_backup_file_from_s3(self, bucket, prefix, file_name, destination):
+        # The object is fetched with parallel ranged GETs and written in order into a pipe, which is extracted while
+        # it is downloaded.
+        key = prefix + '/' + file_name
+
+        if self.__codec:
+            download_result = [0]
+
+            def download(writer):
+                with writer:
+                    download_result[0] = self.__run_s3_transfer(self.__get_s3_transfer().download_stream, bucket,
+                                                                key, writer)
+
+            read_fd, write_fd = os.pipe()
+            download_thread = Thread(target=download, args=(os.fdopen(write_fd, 'wb'),))
+            download_thread.start()
+            extract_result = 0
+            with os.fdopen(read_fd, 'rb') as reader:
+                try:
+                    compression.extract_archive(reader, destination, self.__codec,
+                                                workers=self.__compression_workers)
+                except Exception as e:
+                    logging.warning('Extracting [{}] failed: {}'.format(file_name, e))
+                    extract_result = 1
+            download_thread.join()
+            return extract_result if extract_result != 0 else download_result[0]
+
+        tar_command = ['tar', '-xzf', '-', '-C', destination]
+        logging.debug('Executing [{}]'.format(' '.join(tar_command)))
+        tar_process = subprocess.Popen(tar_command, stdin=subprocess.PIPE)
+        download_result = self.__run_s3_transfer(self.__get_s3_transfer().download_stream, bucket, key,
+                                                 tar_process.stdin)
+        tar_process.stdin.close()
+        tar_result = tar_process.wait()
+        return tar_result if tar_result != 0 else download_result
+
+    def __get_archive_extension(self):
+        return self.__codec.extension if self.__codec else LEGACY_ARCHIVE_EXTENSION
 
     @staticmethod
-    def __zip_backup_file(file_name, directory, source):
+    def __get_directory_size(directory):
+        size = 0
+        for root, dirs, files in os.walk(directory):
+            for file_name in files:
+                size += os.path.getsize(os.path.join(root, file_name))
+        return size
+
+    def __zip_backup_file(self, file_name, directory, source):
+        if self.__codec:
+            try:
+                with open(file_name, 'wb') as archive_file:
+                    compression.write_archive(archive_file, directory, source, self.__codec,
+                                              workers=self.__compression_workers, throttle=self.__throttle)
+                return 0
+            except Exception as e:
+                logging.warning('Compressing [{}] failed: {}'.format(source, e))
+                return 1
+        if self.__throttle is not None:
+            # tar compresses on a single core, only the rate at which its archive is written can be throttled
+            tar_process = subprocess.Popen(['tar', '-czf', '-', '-C', directory, source], stdout=subprocess.PIPE)
+            with open(file_name, 'wb') as archive_file:
+                shutil.copyfileobj(throttle.ThrottledReader(tar_process.stdout, self.__throttle), archive_file)
+            tar_process.stdout.close()
+            return tar_process.wait()
         command = ['tar', '-czf', file_name, '-C', directory, source]
         return subprocess.call(command)
 
-    @staticmethod
-    def __unzip_backup_file(file_name, destination):
+    def __unzip_backup_file(self, file_name, destination):
+        if self.__codec:
+            try:
+                with open(file_name, 'rb') as archive_file:
+                    compression.extract_archive(archive_file, destination, self.__codec,
+                                                workers=self.__compression_workers)
+                return 0
+            except Exception as e:
+                logging.warning('Extracting [{}] failed: {}'.format(file_name, e))
+                return 1
         command = ['tar', '-xzf', file_name, '-C', destination]
         return subprocess.call(command)
 
 
 def build_args_parser():
     parser = ArgumentParser(description='SolrCloud Backup CLI')
-    parser.add_argument('command', help='Available commands: backup, restore')
+    parser.add_argument('command', help='Available commands: backup, restore, latest')
     parser.add_argument('-b', '--bucket', help='S3 bucket which contains the backup files')
-    parser.add_argument('-t', '--timestamp', help='Backup timestamp in the format of <yyyyMMddHHmm> for restoring data')
+    parser.add_argument('-t', '--timestamp',
+                        help='Backup timestamp in the format of <yyyyMMddHHmm> for restoring data or for resuming an '
+                             'interrupted one-off backup')
     parser.add_argument('-w', '--wait', default=str(DEFAULT_COMMIT_WAIT_IN_SECONDS),
-                        help='Wait time after commit in seconds')
+                        help='Maximum wait time for a timed out commit to finish in seconds')
     parser.add_argument('-c', '--cron', help='Run as a cron job: hourly, daily, weekly')
     parser.add_argument('--no-cleanup', default=False, help='Do not clean up backup directory afterwards')
+    parser.add_argument('--stagger-window-minutes', type=int, default=0,
+                        help='Delay scheduled backups by an offset within this window derived from the node name')
+    parser.add_argument('--max-query-rate', type=float,
+                        help='Defer and pause backups while the local query rate is above this many requests/s')
+    parser.add_argument('--max-p99-ms', type=float,
+                        help='Defer and pause backups while the local p99 request time is above this many ms')
+    parser.add_argument('--load-sample-seconds', type=float,
+                        default=backup_schedule.DEFAULT_SAMPLE_INTERVAL_IN_SECONDS,
+                        help='Interval in which the local query load is sampled')
+    parser.add_argument('--max-load-deferral-minutes', type=int,
+                        default=backup_schedule.DEFAULT_MAX_DEFERRAL_IN_SECONDS // 60,
+                        help='Maximum time a backup or shard is deferred because of query load')
+    parser.add_argument('--p99-budget-ms', type=float,
+                        help='Adapt archive read rate and compression workers to keep the local p99 below this many ms')
+    parser.add_argument('--max-read-mb-per-second', type=int, default=throttle.DEFAULT_MAX_READ_RATE // throttle.MB,
+                        help='Highest rate at which the throttle reads snapshots into archives')
+    parser.add_argument('--min-read-mb-per-second', type=int, default=throttle.DEFAULT_MIN_READ_RATE // throttle.MB,
+                        help='Lowest rate at which the throttle reads snapshots into archives')
+    parser.add_argument('--throttle-interval-seconds', type=float, default=throttle.DEFAULT_INTERVAL_IN_SECONDS,
+                        help='Interval in which the throttle samples the local p99 and adjusts its limits')
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help='Stream archives directly to and from S3 instead of staging them in the backup directory')
+    parser.add_argument('--s3-endpoint-url', help='Alternative S3 endpoint, e.g. a local S3 stand-in for testing')
+    parser.add_argument('--s3-max-concurrency', type=int, default=s3_transfer.DEFAULT_MAX_CONCURRENCY,
+                        help='Number of parts or ranges transferred in parallel per S3 object')
+    parser.add_argument('--s3-chunk-size-mb', type=int, default=s3_transfer.DEFAULT_CHUNK_SIZE // s3_transfer.MB,
+                        help='Size of the parts of multipart uploads and ranged downloads in MB')
+    parser.add_argument('--restore-from-leader', action='store_true', default=False,
+                        help='Only restore elected replicas from S3 and replicate the other replicas from them')
+    parser.add_argument('--replica-wait-minutes', type=int, default=DEFAULT_REPLICA_WAIT_IN_SECONDS // 60,
+                        help='Restore replicas from S3 whose elected replica is not restored within this time')
+    parser.add_argument('--coordinated', action='store_true', default=False,
+                        help='Back up the whole cluster under one backup ID planned through ZooKeeper')
+    parser.add_argument('--zk-hosts', default=os.environ.get('ZK_HOST'),
+                        help='ZooKeeper connect string for coordinated backups, defaults to $ZK_HOST')
+    parser.add_argument('--require-consistent', action='store_true', default=False,
+                        help='Fail coordinated backups with shards committed after the plan instead of recording them '
+                             'as inconsistent')
+    parser.add_argument('--hardlink-snapshots', action='store_true', default=False,
+                        help='Snapshot shards as hardlinks on the data volume instead of copies on the backup volume')
+    parser.add_argument('--journal-file', default=DEFAULT_JOURNAL_FILE,
+                        help='Journal of shard and transfer progress for resuming interrupted runs, empty to disable')
+    parser.add_argument('--disk-headroom-mb', type=int, default=workers.DEFAULT_DISK_HEADROOM // s3_transfer.MB,
+                        help='Only start snapshots, tarballs and extractions which leave this much space free on the '
+                             'backup volume, negative to disable')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='Store every snapshot file once by content hash and only upload manifests per backup')
+    parser.add_argument('--compression', choices=sorted(compression.CODECS),
+                        help='Compress archives in-process with the given codec instead of using tar -z')
+    parser.add_argument('--compression-level', type=int, help='Compression level of the chosen codec')
+    parser.add_argument('--compression-workers', type=int, default=compression.DEFAULT_WORKERS,
+                        help='Number of threads compressing and decompressing archive blocks')
+    parser.add_argument('--parallel-shards', type=int, default=workers.DEFAULT_POOL_SIZE,
+                        help='Maximum number of shards which are archived, uploaded or restored at the same time')
+    parser.add_argument('--parallel-snapshots', type=int, default=DEFAULT_SNAPSHOT_POOL_SIZE,
+                        help='Maximum number of cores which create a snapshot at the same time')
+    parser.add_argument('--cpu-limit', type=int, default=workers.DEFAULT_LIMITS[workers.RESOURCE_CPU],
+                        help='Maximum number of shards which are compressed at the same time')
+    parser.add_argument('--disk-limit', type=int, default=workers.DEFAULT_LIMITS[workers.RESOURCE_DISK],
+                        help='Maximum number of shards which are archived or extracted at the same time')
+    parser.add_argument('--network-limit', type=int, default=workers.DEFAULT_LIMITS[workers.RESOURCE_NETWORK],
+                        help='Maximum number of transfers from and to S3 at the same time')
     return parser
 
 
@@ -429,33 +1672,83 @@ def backup_cli(cli_args):
     args = parser.parse_args(cli_args)
 
     controller = BackupController(int(args.wait))
+    controller.set_stream_to_s3(args.stream)
+    if args.s3_endpoint_url:
+        controller.set_s3_endpoint_url(args.s3_endpoint_url)
+    controller.set_s3_transfer_options(args.s3_max_concurrency, args.s3_chunk_size_mb * s3_transfer.MB)
+    controller.set_incremental(args.incremental)
+    controller.set_hardlink_snapshots(args.hardlink_snapshots)
+    if args.journal_file and args.command in ('backup', 'restore'):
+        journal = transfer_journal.open_journal(args.journal_file)
+        if journal is not None:
+            controller.set_journal(journal)
+    if args.max_query_rate is not None or args.max_p99_ms is not None:
+        controller.set_load_thresholds(args.max_query_rate, args.max_p99_ms, args.load_sample_seconds,
+                                       args.max_load_deferral_minutes * 60)
+    if args.p99_budget_ms is not None:
+        controller.set_latency_budget(args.p99_budget_ms, args.max_read_mb_per_second * throttle.MB,
+                                      args.min_read_mb_per_second * throttle.MB, args.throttle_interval_seconds)
+    if args.disk_headroom_mb >= 0:
+        controller.set_disk_space_admission(args.disk_headroom_mb * s3_transfer.MB)
+    controller.set_restore_from_leader(args.restore_from_leader, args.replica_wait_minutes * 60)
+    controller.set_pool_size(args.parallel_shards)
+    controller.set_snapshot_pool_size(args.parallel_snapshots)
+    controller.set_resource_limits({
+        workers.RESOURCE_CPU: args.cpu_limit,
+        workers.RESOURCE_DISK: args.disk_limit,
+        workers.RESOURCE_NETWORK: args.network_limit,
+    })
+    if args.compression:
+        controller.set_compression(args.compression, args.compression_level, args.compression_workers)
 
     if args.command == 'backup':
         if not args.bucket:
             logging.error('No S3 bucket given')
             parser.print_usage()
             return 1
+        if args.coordinated:
+            if not args.zk_hosts:
+                logging.error('No ZooKeeper hosts given for coordinated backups')
+                parser.print_usage()
+                return 1
+            # Staggered and load-deferred jobs of a run still join the plan of its first job
+            start_delay = args.stagger_window_minutes * 60 if args.cron else 0
+            if args.max_query_rate is not None or args.max_p99_ms is not None:
+                start_delay += args.max_load_deferral_minutes * 60
+            plan_window = backup_coordination.get_plan_window(start_delay, CRON_INTERVALS_IN_SECONDS.get(args.cron))
+            zk = KazooClient(hosts=args.zk_hosts)
+            zk.start(timeout=backup_coordination.DEFAULT_LOCK_TIMEOUT_IN_SECONDS)
+            controller.set_coordinator(backup_coordination.BackupCoordinator(zk, socket.gethostname(), plan_window),
+                                       args.require_consistent)
         if args.cron:
             scheduler = BlockingScheduler(timezone=pytz.utc)
+            job = controller.create_backup
+            if args.stagger_window_minutes > 0:
+                if args.stagger_window_minutes * 60 >= CRON_INTERVALS_IN_SECONDS.get(args.cron, sys.maxsize):
+                    logging.error('Stagger window must be shorter than the [{}] interval'.format(args.cron))
+                    return 1
+                job = backup_schedule.StaggeredJob(controller.create_backup, socket.gethostname(),
+                                                   args.stagger_window_minutes * 60)
+                logging.info('Scheduled backups of this node start [{}] seconds late.'.format(job.offset))
             if args.cron == 'hourly':
-                scheduler.add_job(controller.create_backup, trigger='cron',
+                scheduler.add_job(job, trigger='cron',
                                   kwargs={'bucket': args.bucket, 'cleanup': not args.no_cleanup},
                                   minute=TIMESTAMP_MINUTE, name='hourly_backup')
                 logging.info('Scheduled hourly backup ({} * * * *).'.format(TIMESTAMP_MINUTE))
             elif args.cron == 'daily':
-                scheduler.add_job(controller.create_backup, trigger='cron',
+                scheduler.add_job(job, trigger='cron',
                                   kwargs={'bucket': args.bucket, 'cleanup': not args.no_cleanup},
                                   hour=TIMESTAMP_HOUR, minute=TIMESTAMP_MINUTE, name='daily_backup')
                 logging.info('Scheduled daily backup ({} {} * * *).'.format(TIMESTAMP_MINUTE, TIMESTAMP_HOUR))
             elif args.cron == 'weekly':
-                scheduler.add_job(controller.create_backup, trigger='cron',
+                scheduler.add_job(job, trigger='cron',
                                   kwargs={'bucket': args.bucket, 'cleanup': not args.no_cleanup},
                                   day_of_week=TIMESTAMP_DOW_SCHEDULER, hour=TIMESTAMP_HOUR, minute=TIMESTAMP_MINUTE,
                                   name='weekly_backup')
                 logging.info('Scheduled weekly backup ({} {} * * {}).'.format(TIMESTAMP_MINUTE, TIMESTAMP_HOUR,
                                                                               TIMESTAMP_DOW_CRON))
             elif args.cron == 'test':
-                scheduler.add_job(controller.create_backup, trigger='cron',
+                scheduler.add_job(job, trigger='cron',
                                   kwargs={'bucket': args.bucket, 'cleanup': not args.no_cleanup},
                                   second='0', name='test_backup')
                 logging.info('Scheduled test backup (* * * * *).')
@@ -468,7 +1761,12 @@ def backup_cli(cli_args):
             except (KeyboardInterrupt, SystemExit):
                 pass
         else:
-            controller.create_backup(bucket=args.bucket)
+            if args.timestamp and not re.match('^[0-9]{12}$', args.timestamp):
+                logging.error('Invalid backup timestamp, format should be <yyyyMMddHHmm>')
+                parser.print_usage()
+                return 1
+            if not controller.create_backup(bucket=args.bucket, backup_id=args.timestamp):
+                return 1
     elif args.command == 'restore':
         if not args.bucket:
             logging.error('No S3 bucket given')
@@ -479,7 +1777,19 @@ def backup_cli(cli_args):
             logging.error('No or invalid timestamp for restoring data, format should be <yyyyMMddHHmm>')
             parser.print_usage()
             return 1
-        controller.restore_backup(args.bucket, args.timestamp, cleanup=not args.no_cleanup)
+        if not controller.restore_backup(args.bucket, args.timestamp, cleanup=not args.no_cleanup):
+            return 1
+    elif args.command == 'latest':
+        if not args.bucket:
+            logging.error('No S3 bucket given')
+            parser.print_usage()
+            return 1
+        timestamp = controller.get_latest_backup(args.bucket)
+        if not timestamp:
+            logging.error('No complete backup found in S3 bucket [{}]'.format(args.bucket))
+            return 1
+        # The timestamp is the only output on stdout, so scripts can capture it
+        print(timestamp)
     else:
         logging.error('Unknown command: [{}]'.format(args.command))
         parser.print_usage()
@@ -487,7 +1797,7 @@ def backup_cli(cli_args):
 
 
 def main():
-    backup_cli(sys.argv[1:])
+    sys.exit(backup_cli(sys.argv[1:]))
 
 if __name__ == '__main__':
     main()
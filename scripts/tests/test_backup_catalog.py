@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import backup_catalog
+
+import hashlib
+import io
+
+TIMESTAMP = '201605010100'
+
+
+class TestBackupCatalog(TestCase):
+
+    def test_should_compute_checksum_of_streamed_data(self):
+        content = b'segment data' * 1000
+        checksum = backup_catalog.StreamChecksum(io.BytesIO(content))
+
+        while checksum.read(1000):
+            pass
+
+        self.assertEqual(checksum.size, len(content))
+        self.assertEqual(checksum.hexdigest(), hashlib.sha256(content).hexdigest())
+        self.assertFalse(checksum.seekable())
+
+    def test_should_create_complete_entry_and_latest_pointer(self):
+        shards = {
+            'collection_a_shard1': backup_catalog.create_shard(TIMESTAMP + '/backup_a1.tar.gz', 10, 'a' * 64),
+            'collection_a_shard2': backup_catalog.create_shard(TIMESTAMP + '/backup_a2.tar.gz', 20, 'b' * 64),
+            'collection_b': backup_catalog.create_shard(TIMESTAMP + '/backup_b.tar.gz', 30, 'c' * 64),
+        }
+        entry = backup_catalog.create_entry(TIMESTAMP, 'node1', 'archive', shards)
+        entry_key = backup_catalog.get_entry_key(TIMESTAMP, 'node1')
+
+        self.assertEqual(entry_key, 'catalog/' + TIMESTAMP + '/node1.json')
+        self.assertTrue(entry['complete'])
+        self.assertListEqual(entry['collections'], ['collection_a', 'collection_b'])
+        self.assertEqual(entry['size'], 60)
+
+        latest = backup_catalog.loads(backup_catalog.dumps(backup_catalog.create_latest(entry_key, entry)),
+                                      backup_catalog.LATEST_KEY)
+        self.assertEqual(latest['timestamp'], TIMESTAMP)
+        self.assertEqual(latest['entry'], entry_key)
+        self.assertTrue(backup_catalog.is_newer('201605020100', latest))
+        self.assertFalse(backup_catalog.is_newer('201604300100', latest))
+
+    def test_should_reject_unknown_catalog_version(self):
+        with self.assertRaises(Exception):
+            backup_catalog.loads(b'{"version": 99}', backup_catalog.LATEST_KEY)
+
+    def test_should_find_latest_timestamp_in_bucket_listing(self):
+        prefixes = ['201605010100/', '201605020100/', 'catalog/', 'objects/', '20160503/']
+
+        self.assertEqual(backup_catalog.find_latest_timestamp(prefixes), '201605020100')
+        self.assertIsNone(backup_catalog.find_latest_timestamp(['catalog/']))
+
+    def test_should_number_split_shards_consecutively(self):
+        self.assertEqual(backup_catalog.get_backup_name('collection', 'shard2'), 'collection_shard2')
+        self.assertEqual(backup_catalog.get_backup_name('collection', 'shard2_1'), 'collection_shard4')
+
+    def test_should_only_complete_backup_once_every_expected_shard_is_stored(self):
+        expected_shards = ['collection_shard1', 'collection_shard2']
+        shard = backup_catalog.create_shard('key', 10, 'a' * 64)
+        finished = backup_catalog.create_entry(TIMESTAMP, 'node1', 'archive', {'collection_shard1': shard}, None,
+                                               expected_shards)
+        unfinished = backup_catalog.create_entry(TIMESTAMP, 'node2', 'archive', {}, None, expected_shards)
+
+        self.assertEqual(backup_catalog.get_missing_shards([finished, unfinished]), ['collection_shard2'])
+        self.assertFalse(backup_catalog.is_complete([finished, unfinished]))
+        self.assertFalse(backup_catalog.is_complete([]))
+        unfinished['shards']['collection_shard2'] = shard
+        self.assertTrue(backup_catalog.is_complete([finished, unfinished]))
+
+        # An inconsistent coordinated backup is only incomplete if consistency is required
+        unfinished['coordination'] = backup_catalog.create_coordination('node1', {'core2': 5}, {'core2': 6})
+        self.assertFalse(backup_catalog.is_consistent([finished, unfinished]))
+        self.assertTrue(backup_catalog.is_complete([finished, unfinished]))
+        self.assertFalse(backup_catalog.is_complete([finished, unfinished], require_consistent=True))
+
+    def test_should_list_catalog_timestamps_newest_first(self):
+        prefixes = ['catalog/201605010100/', 'catalog/201605020100/', 'catalog/latest.json', '201605030100/']
+
+        self.assertEqual(backup_catalog.get_catalog_timestamps(prefixes), ['201605020100', '201605010100'])
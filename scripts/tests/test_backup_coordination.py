@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+from scripts import backup_coordination
+
+import os
+import shutil
+import tempfile
+import time
+
+
+class FakeZooKeeper:
+    """Keeps nodes in memory, the lock is always free."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.lock = MagicMock()
+
+    def Lock(self, path, identifier):
+        return self.lock
+
+    def ensure_path(self, path):
+        self.nodes.setdefault(path, b'')
+
+    def exists(self, path):
+        return path in self.nodes
+
+    def get(self, path):
+        return self.nodes[path], None
+
+    def set(self, path, value):
+        self.nodes[path] = value
+
+    def create(self, path, value):
+        self.nodes[path] = value
+
+
+def create_plan(backup_id: str):
+    return backup_coordination.create_plan(backup_id, 'node1', {
+        'test_shard1_replica1': backup_coordination.create_plan_shard('test', 'shard1', '10.0.0.1:8983_solr', 3)})
+
+
+class TestBackupCoordination(TestCase):
+
+    def test_should_format_generations_like_lucene(self):
+        self.assertEqual(backup_coordination.get_segments_file_name(1), 'segments_1')
+        self.assertEqual(backup_coordination.get_segments_file_name(35), 'segments_z')
+        self.assertEqual(backup_coordination.get_segments_file_name(36), 'segments_10')
+        self.assertEqual(backup_coordination.get_segments_file_name(1000000), 'segments_lfls')
+
+    def test_should_read_generation_of_snapshot(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(backup_coordination.get_snapshot_generation(snapshot_dir))
+            for file_name in ['_0.cfs', '_0.si', 'segments_1c']:
+                open(os.path.join(snapshot_dir, file_name), 'w').close()
+
+            self.assertEqual(backup_coordination.get_snapshot_generation(snapshot_dir), 48)
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_should_create_plan_once_per_run(self):
+        zk = FakeZooKeeper()
+        coordinator = backup_coordination.BackupCoordinator(zk, 'node1')
+        follower = backup_coordination.BackupCoordinator(zk, 'node2')
+
+        plan = coordinator.get_plan(lambda: create_plan('201605010100'))
+        joined_plan = follower.get_plan(lambda: self.fail('The plan of the run exists already'))
+
+        self.assertEqual(joined_plan['backup_id'], '201605010100')
+        self.assertDictEqual(joined_plan['shards'], plan['shards'])
+        self.assertEqual(zk.lock.acquire.call_count, 2)
+        self.assertEqual(zk.lock.release.call_count, 2)
+
+    def test_should_plan_new_run_after_executed_or_expired_plan(self):
+        zk = FakeZooKeeper()
+        coordinator = backup_coordination.BackupCoordinator(zk, 'node1')
+        follower = backup_coordination.BackupCoordinator(zk, 'node2', plan_window=60)
+        coordinator.get_plan(lambda: create_plan('201605010100'))
+
+        # The coordinator has executed the current plan, its next run starts a new one
+        self.assertEqual(coordinator.get_plan(lambda: create_plan('201605010200'))['backup_id'], '201605010200')
+
+        expired_plan = create_plan('201605010300')
+        expired_plan['created'] = time.time() - 120
+        zk.set(backup_coordination.PLAN_PATH, backup_coordination.dumps(expired_plan))
+        self.assertEqual(follower.get_plan(lambda: create_plan('201605010400'))['backup_id'], '201605010400')
+
+    def test_should_not_join_executed_plan_after_restart(self):
+        zk = FakeZooKeeper()
+        backup_coordination.BackupCoordinator(zk, 'node1').get_plan(lambda: create_plan('201605010100'))
+
+        restarted = backup_coordination.BackupCoordinator(zk, 'node1')
+        self.assertEqual(restarted.get_plan(lambda: create_plan('201605010200'))['backup_id'], '201605010200')
+        self.assertEqual(zk.nodes[backup_coordination.NODES_PATH + '/node1'], b'201605010200')
+
+    def test_should_extend_plan_window_by_start_delay_within_interval(self):
+        self.assertEqual(backup_coordination.get_plan_window(), backup_coordination.DEFAULT_PLAN_WINDOW_IN_SECONDS)
+        self.assertEqual(backup_coordination.get_plan_window(7200, 24 * 3600),
+                         backup_coordination.DEFAULT_PLAN_WINDOW_IN_SECONDS + 7200)
+        self.assertEqual(backup_coordination.get_plan_window(3000, 3600), 3600)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+from scripts import backup_schedule
+
+LOCAL_URL = 'http://localhost:8983/solr'
+CORE_NAME = 'test_shard1_replica1'
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def create_mbeans_response(requests: int, p99: float):
+    handler = {'class': 'org.apache.solr.handler.component.SearchHandler',
+               'stats': {'requests': requests, '99thPcRequestTime': p99}}
+    update_handler = {'class': 'org.apache.solr.handler.UpdateRequestHandler', 'stats': {'requests': 10 ** 6}}
+    return {'solr-mbeans': ['QUERYHANDLER', {'/select': handler, '/update': update_handler}]}
+
+
+class TestBackupSchedule(TestCase):
+
+    def test_should_stagger_nodes_deterministically_within_window(self):
+        node_names = ['ip-10-0-0-{}'.format(i) for i in range(1, 10)]
+        offsets = [backup_schedule.get_stagger_offset(node_name, 1800) for node_name in node_names]
+
+        self.assertListEqual(offsets, [backup_schedule.get_stagger_offset(node_name, 1800)
+                                       for node_name in node_names])
+        self.assertTrue(all(0 <= offset < 1800 for offset in offsets))
+        self.assertGreater(len(set(offsets)), 1)
+        self.assertEqual(backup_schedule.get_stagger_offset(node_names[0], 0), 0)
+
+    def test_should_run_staggered_job_with_scheduled_backup_id(self):
+        function = MagicMock(return_value=True)
+        sleep = MagicMock()
+        job = backup_schedule.StaggeredJob(function, 'ip-10-0-0-1', 1800, sleep=sleep)
+
+        self.assertTrue(job(bucket='bucket'))
+        sleep.assert_called_once_with(job.offset)
+        backup_id = function.call_args[1]['backup_id']
+        self.assertRegex(backup_id, '^[0-9]{12}$')
+        self.assertEqual(function.call_args[1]['bucket'], 'bucket')
+
+    def test_should_defer_while_query_rate_is_high(self):
+        clock = FakeClock()
+        # 100 requests per 10 seconds until the load drops to 1 request
+        responses = [create_mbeans_response(requests, 50) for requests in [0, 1000, 2000, 2010]]
+        http_client = MagicMock(get_json=MagicMock(side_effect=responses))
+        query_stats = backup_schedule.QueryStats(http_client, LOCAL_URL, lambda: [CORE_NAME], clock=clock.time)
+        gate = backup_schedule.LoadGate(query_stats, max_query_rate=10, sample_interval=10, sleep=clock.sleep,
+                                        clock=clock.time)
+
+        self.assertEqual(gate.wait('backup'), 30)
+        http_client.get_json.assert_called_with(LOCAL_URL + '/' + CORE_NAME + backup_schedule.MBEANS_PATH)
+
+    def test_should_continue_after_maximum_deferral(self):
+        clock = FakeClock()
+        http_client = MagicMock(get_json=MagicMock(return_value=create_mbeans_response(0, 900)))
+        query_stats = backup_schedule.QueryStats(http_client, LOCAL_URL, lambda: [CORE_NAME], clock=clock.time)
+        gate = backup_schedule.LoadGate(query_stats, max_p99=500, sample_interval=10, max_deferral=60,
+                                        sleep=clock.sleep, clock=clock.time)
+
+        self.assertEqual(gate.wait('backup'), 60)
+
+    def test_should_not_wait_for_second_sample_if_p99_is_low(self):
+        clock = FakeClock()
+        http_client = MagicMock(get_json=MagicMock(return_value=create_mbeans_response(0, 100)))
+        query_stats = backup_schedule.QueryStats(http_client, LOCAL_URL, lambda: [CORE_NAME], clock=clock.time)
+        gate = backup_schedule.LoadGate(query_stats, max_p99=500, sample_interval=10, sleep=clock.sleep,
+                                        clock=clock.time)
+
+        self.assertEqual(gate.wait('backup'), 0)
+        self.assertEqual(clock.now, 0)
+        http_client.get_json.assert_called_once()
+
+    def test_should_not_sample_without_thresholds(self):
+        http_client = MagicMock()
+        gate = backup_schedule.LoadGate(backup_schedule.QueryStats(http_client, LOCAL_URL, lambda: [CORE_NAME]))
+
+        self.assertEqual(gate.wait('backup'), 0)
+        http_client.get_json.assert_not_called()
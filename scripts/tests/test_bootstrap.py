@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from threading import Event, current_thread
+from unittest.mock import MagicMock, patch
+from scripts import bootstrap
+from scripts import solr_client
+
+import sys
+
+
+class TestBootstrap(TestCase):
+
+    def test_should_record_phase_timings_and_failures(self):
+        timer = bootstrap.PhaseTimer()
+
+        self.assertEqual(timer.run('zk_discovery', lambda: 'zk1:2181'), 'zk1:2181')
+        self.assertFalse(timer.run('config_reload', lambda: False))
+        with self.assertRaises(ValueError):
+            timer.run('solr_ready', lambda: int('x'))
+
+        report = timer.get_report()
+        self.assertListEqual([(phase['phase'], phase['status']) for phase in report['phases']], [
+            ('zk_discovery', bootstrap.STATUS_OK), ('config_reload', bootstrap.STATUS_FAILED),
+            ('solr_ready', bootstrap.STATUS_FAILED)])
+        self.assertIn('zk_discovery', timer.format_report())
+
+    def test_should_wait_until_solr_answers_core_status(self):
+        responses = [solr_client.SolrError('Connection refused'), solr_client.SolrError('503'),
+                     {'responseHeader': {'status': 0}, 'initFailures': {},
+                      'status': {'b_shard1_replica1': {}, 'a_shard1_replica1': {}}}]
+        http_client = MagicMock(get_json=MagicMock(side_effect=responses))
+        solr = MagicMock(poll=MagicMock(return_value=None))
+
+        with patch.object(bootstrap, 'POLL_INTERVAL_IN_SECONDS', 0):
+            cores = bootstrap.wait_for_cores(http_client, solr)
+
+        self.assertListEqual(cores, ['a_shard1_replica1', 'b_shard1_replica1'])
+        self.assertEqual(http_client.get_json.call_count, 3)
+
+    def test_should_stop_waiting_if_solr_exited(self):
+        http_client = MagicMock(get_json=MagicMock(side_effect=solr_client.SolrError('Connection refused')))
+        solr = MagicMock(poll=MagicMock(return_value=1), returncode=1)
+
+        with self.assertRaises(RuntimeError):
+            bootstrap.wait_for_cores(http_client, solr)
+
+    def test_should_pass_backup_options_to_backup_commands(self):
+        with patch.dict('os.environ', {'SOLR_BACKUP_OPTIONS': '--stream --compression zstd',
+                                       'SOLR_BACKUP_BUCKET': 'bucket'}):
+            command = bootstrap.get_backup_command('restore', '-t', '201605010100')
+
+        self.assertListEqual(command, [sys.executable, '-m', 'scripts.solrcloud_backup', '--stream', '--compression',
+                                       'zstd', '-b', 'bucket', '-t', '201605010100', 'restore'])
+
+    def test_should_run_background_tasks_in_daemon_threads(self):
+        started = Event()
+        release = Event()
+
+        def lookup():
+            started.set()
+            self.assertTrue(current_thread().daemon)
+            release.wait(5)
+            return '201605010100'
+
+        future = bootstrap.run_in_background(lookup)
+        self.assertTrue(started.wait(5))
+        self.assertFalse(future.done())
+        release.set()
+        self.assertEqual(future.result(5), '201605010100')
+
+        failed = bootstrap.run_in_background(int, 'x')
+        with self.assertRaises(ValueError):
+            failed.result(5)
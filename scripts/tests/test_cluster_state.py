@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import cluster_state
+
+LIVE_NODE_1 = '10.0.0.1:8983_solr'
+LIVE_NODE_2 = '10.0.0.2:8983_solr'
+DEAD_NODE = '10.0.0.3:8983_solr'
+
+
+def replica(core_name: str, node_name: str, state='active', leader=False):
+    result = {'core': core_name, 'node_name': node_name, 'state': state}
+    if leader:
+        result['leader'] = 'true'
+    return result
+
+
+class TestClusterState(TestCase):
+
+    def setUp(self):
+        self.__state = cluster_state.ClusterState.from_response({'cluster': {
+            'live_nodes': [LIVE_NODE_1, LIVE_NODE_2],
+            'collections': {'test': {'shards': {
+                'shard1': {'state': 'active', 'replicas': {
+                    'core_node1': replica('test_shard1_replica1', LIVE_NODE_1),
+                    'core_node2': replica('test_shard1_replica2', LIVE_NODE_2, leader=True)}},
+                'shard2': {'state': 'active', 'replicas': {
+                    'core_node3': replica('test_shard2_replica1', DEAD_NODE, leader=True),
+                    'core_node4': replica('test_shard2_replica3', LIVE_NODE_1),
+                    'core_node5': replica('test_shard2_replica2', LIVE_NODE_2, state='recovering')}},
+                'shard3': {'state': 'inactive', 'replicas': {
+                    'core_node6': replica('test_shard3_replica1', LIVE_NODE_1, leader=True)}},
+            }}}}})
+
+    def test_should_elect_active_leader(self):
+        self.assertTrue(self.__state.is_elected('test_shard1_replica2'))
+        self.assertFalse(self.__state.is_elected('test_shard1_replica1'))
+
+    def test_should_elect_active_replica_on_live_node_if_leader_is_gone(self):
+        self.assertEqual(self.__state.get_elected_replica('test', 'shard2')['core'], 'test_shard2_replica3')
+        self.assertFalse(self.__state.is_elected('test_shard2_replica1'))
+        self.assertFalse(self.__state.is_elected('test_shard2_replica2'))
+
+    def test_should_not_elect_replicas_of_inactive_shards_or_unknown_cores(self):
+        self.assertFalse(self.__state.is_elected('test_shard3_replica1'))
+        self.assertFalse(self.__state.is_elected('other_shard1_replica1'))
+        self.assertEqual(self.__state.get_shard_count(), 2)
+        self.assertListEqual(self.__state.get_active_shards(), [('test', 'shard1'), ('test', 'shard2')])
+
+    def test_should_list_live_replica_nodes(self):
+        self.assertTrue(self.__state.has_collection('test'))
+        self.assertFalse(self.__state.has_collection('other'))
+        self.assertListEqual(self.__state.get_replica_nodes('test'), [LIVE_NODE_1, LIVE_NODE_2])
+        self.assertListEqual(self.__state.get_replica_nodes('other'), [])
+
+    def test_should_list_cores_of_node(self):
+        self.assertEqual(self.__state.get_node_name('test_shard2_replica3'), LIVE_NODE_1)
+        self.assertIsNone(self.__state.get_node_name('other_shard1_replica1'))
+        self.assertListEqual(self.__state.get_node_cores(LIVE_NODE_1, [('test', 'shard1'), ('test', 'shard2')]),
+                             ['test_shard1_replica1', 'test_shard2_replica3'])
+        self.assertListEqual(self.__state.get_node_cores(LIVE_NODE_2, [('test', 'shard1'), ('other', 'shard1')]),
+                             ['test_shard1_replica2'])
+
+    def test_should_not_create_state_without_cluster(self):
+        self.assertIsNone(cluster_state.ClusterState.from_response({'responseHeader': {'status': 0}}))
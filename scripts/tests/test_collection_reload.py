@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from unittest import TestCase
+from unittest.mock import MagicMock
+from scripts import collection_reload
+from scripts import solr_client
+from scripts import workers
+
+import time
+import urllib.parse
+
+SOLR_BASE_URL = 'http://localhost:8983/solr'
+LIVE_NODES = ['10.0.0.1:8983_solr', '10.0.0.2:8983_solr']
+
+
+def cluster_status(collection_name: str):
+    replicas = {'core_node{}'.format(i): {'core': '{}_shard1_replica{}'.format(collection_name, i),
+                                          'node_name': node_name, 'state': 'active'}
+                for i, node_name in enumerate(LIVE_NODES, 1)}
+    return {'responseHeader': {'status': 0}, 'cluster': {
+        'live_nodes': LIVE_NODES,
+        'collections': {collection_name: {'shards': {'shard1': {'state': 'active', 'replicas': replicas}}}}}}
+
+
+class FakeSolr:
+    """Answers RELOAD and CLUSTERSTATUS requests, `silent_nodes` leave out their answer to a RELOAD."""
+
+    def __init__(self, reload_time: float = 0, failing_collections=(), silent_nodes=()):
+        self.reload_time = reload_time
+        self.failing_collections = failing_collections
+        self.silent_nodes = silent_nodes
+        self.reloaded = []
+        self.policies = []
+        self.running = 0
+        self.max_running = 0
+        self.__lock = Lock()
+
+    def get_json(self, url: str, policy=None):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        if params['action'] == 'CLUSTERSTATUS':
+            return cluster_status(params['collection'])
+        collection_name = params['name']
+        with self.__lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.policies.append(policy)
+        time.sleep(self.reload_time)
+        with self.__lock:
+            self.running -= 1
+        if collection_name in self.failing_collections:
+            raise solr_client.SolrError('Could not reload [{}]'.format(collection_name))
+        with self.__lock:
+            self.reloaded.append(collection_name)
+        return {'responseHeader': {'status': 0}, 'success': {
+            node_name: {'responseHeader': {'status': 0, 'QTime': 10}}
+            for node_name in LIVE_NODES if node_name not in self.silent_nodes}}
+
+
+class TestCollectionReload(TestCase):
+
+    def test_should_reload_collections_concurrently_up_to_limit(self):
+        solr = FakeSolr(reload_time=0.05)
+        coordinator = collection_reload.ReloadCoordinator(MagicMock(get_json=solr.get_json), SOLR_BASE_URL,
+                                                          max_parallel=2)
+
+        latencies = coordinator.reload(['a', 'b', 'c', 'd'])
+
+        self.assertListEqual(sorted(latencies), ['a', 'b', 'c', 'd'])
+        self.assertEqual(solr.max_running, 2)
+
+    def test_should_wait_up_to_reload_timeout_for_reload(self):
+        solr = FakeSolr()
+        coordinator = collection_reload.ReloadCoordinator(MagicMock(get_json=solr.get_json), SOLR_BASE_URL,
+                                                          reload_timeout=600)
+
+        coordinator.reload(['a'])
+
+        self.assertEqual(solr.policies[0].read_timeout, 600)
+        self.assertFalse(solr.policies[0].retry_timeouts)
+
+    def test_should_report_collections_which_did_not_reload_on_every_node(self):
+        solr = FakeSolr(silent_nodes=[LIVE_NODES[1]])
+        coordinator = collection_reload.ReloadCoordinator(MagicMock(get_json=solr.get_json), SOLR_BASE_URL)
+
+        with self.assertRaises(workers.TaskFailure) as context:
+            coordinator.reload(['a'])
+        self.assertIn(LIVE_NODES[1], str(context.exception))
+
+    def test_should_reload_other_collections_if_one_fails(self):
+        solr = FakeSolr(failing_collections=['b'])
+        coordinator = collection_reload.ReloadCoordinator(MagicMock(get_json=solr.get_json), SOLR_BASE_URL,
+                                                          max_parallel=1)
+
+        with self.assertRaises(workers.TaskFailure) as context:
+            coordinator.reload(['a', 'b', 'c'])
+        self.assertListEqual([description for description, e in context.exception.failures], ['b'])
+        self.assertListEqual(solr.reloaded, ['a', 'c'])
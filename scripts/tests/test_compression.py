@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, skipIf
+from scripts import compression
+from scripts import throttle
+
+import gzip
+import io
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+BLOCK_SIZE = 1024
+WORKERS = 4
+
+TEST_SNAPSHOT = 'snapshot.test_collection_shard1'
+TEST_FILES = {
+    '_0.fdt': b'stored field ' * 1000,
+    '_0.doc': bytes(range(256)) * 20,
+    'segments_2': b'segments',
+}
+
+
+class TestCompression(TestCase):
+
+    __tmp_dir = None
+
+    def setUp(self):
+        self.__tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.__tmp_dir, 'source', TEST_SNAPSHOT))
+        for file_name, content in TEST_FILES.items():
+            with open(os.path.join(self.__tmp_dir, 'source', TEST_SNAPSHOT, file_name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_dir)
+
+    def test_should_write_gzip_compatible_blocks(self):
+        data = os.urandom(BLOCK_SIZE) * 10 + b'tail'
+        compressed = self.__compress(compression.get_codec(compression.CODEC_GZIP), data)
+
+        self.assertEqual(gzip.decompress(compressed), data)
+
+    def test_should_decompress_gzip_blocks_in_parallel(self):
+        data = b'0123456789' * BLOCK_SIZE
+        compressed = self.__compress(compression.get_codec(compression.CODEC_GZIP, 1), data)
+
+        self.assertEqual(self.__decompress(compression.get_codec(compression.CODEC_GZIP), compressed), data)
+
+    def test_should_decompress_foreign_gzip_stream(self):
+        data = b'0123456789' * BLOCK_SIZE
+        compressed = gzip.compress(data) + gzip.compress(data)
+
+        self.assertEqual(self.__decompress(compression.get_codec(compression.CODEC_GZIP), compressed), data + data)
+
+    @skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_should_compress_and_decompress_zstd_blocks(self):
+        data = b'0123456789' * BLOCK_SIZE
+        compressed = self.__compress(compression.get_codec(compression.CODEC_ZSTD, 1), data)
+
+        self.assertEqual(self.__decompress(compression.get_codec(compression.CODEC_ZSTD), compressed), data)
+
+    @skipIf(compression.zstandard is None or shutil.which('zstd') is None, 'zstd is not installed')
+    def test_should_write_zstd_blocks_readable_by_zstd_tool(self):
+        data = b'0123456789' * BLOCK_SIZE
+        compressed = self.__compress(compression.get_codec(compression.CODEC_ZSTD, 1), data)
+
+        self.assertEqual(subprocess.check_output(['zstd', '-dc'], input=compressed), data)
+
+    @skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_should_decompress_foreign_zstd_frames(self):
+        data = os.urandom(BLOCK_SIZE) * 300 + b'\0' * 200000
+        compressor = compression.zstandard.ZstdCompressor(level=1, write_checksum=True)
+        # A frame without content size, as written by streaming compressors, a skippable frame and a plain frame
+        streamed = compressor.compressobj()
+        compressed = streamed.compress(data) + streamed.flush()
+        compressed += struct.pack('<II', 0x184D2A50, 3) + b'abc'
+        compressed += compression.zstandard.ZstdCompressor(level=1).compress(data)
+
+        self.assertEqual(self.__decompress(compression.get_codec(compression.CODEC_ZSTD), compressed), data + data)
+        with self.assertRaises(Exception):
+            self.__decompress(compression.get_codec(compression.CODEC_ZSTD), compressed[:-10])
+
+    def test_should_compress_at_throttled_rate_and_parallelism(self):
+        data = os.urandom(BLOCK_SIZE) * 8
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        adaptive_throttle = throttle.AdaptiveThrottle(lambda: None, 100, 1, max_read_rate=4 * BLOCK_SIZE,
+                                                      min_read_rate=BLOCK_SIZE, clock=lambda: now[0], sleep=sleep)
+        output = io.BytesIO()
+        writer = compression.ParallelCompressWriter(output, compression.get_codec(compression.CODEC_GZIP),
+                                                    workers=WORKERS, block_size=BLOCK_SIZE, throttle=adaptive_throttle)
+        writer.write(data)
+        writer.close()
+
+        self.assertEqual(gzip.decompress(output.getvalue()), data)
+        # 8 blocks at 2 blocks per second
+        self.assertAlmostEqual(now[0], 4.0)
+
+    def test_should_reject_unknown_codec(self):
+        with self.assertRaises(Exception):
+            compression.get_codec('rar')
+
+    def test_should_create_archive_readable_by_tar(self):
+        codec = compression.get_codec(compression.CODEC_GZIP)
+        archive_file_name = os.path.join(self.__tmp_dir, 'backup.tar.gz')
+        with open(archive_file_name, 'wb') as archive_file:
+            compression.write_archive(archive_file, os.path.join(self.__tmp_dir, 'source'), TEST_SNAPSHOT, codec,
+                                      workers=WORKERS, block_size=BLOCK_SIZE)
+
+        destination = os.path.join(self.__tmp_dir, 'tar')
+        os.makedirs(destination)
+        subprocess.check_call(['tar', '-xzf', archive_file_name, '-C', destination])
+        self.__verify_snapshot(destination)
+
+    def test_should_extract_archive_created_by_tar(self):
+        archive_file_name = os.path.join(self.__tmp_dir, 'backup.tar.gz')
+        subprocess.check_call(['tar', '-czf', archive_file_name, '-C', os.path.join(self.__tmp_dir, 'source'),
+                               TEST_SNAPSHOT])
+
+        destination = os.path.join(self.__tmp_dir, 'extracted')
+        with open(archive_file_name, 'rb') as archive_file:
+            compression.extract_archive(archive_file, destination, compression.get_codec(compression.CODEC_GZIP),
+                                        workers=WORKERS)
+        self.__verify_snapshot(destination)
+
+    @staticmethod
+    def __compress(codec, data: bytes):
+        output = io.BytesIO()
+        writer = compression.ParallelCompressWriter(output, codec, workers=WORKERS, block_size=BLOCK_SIZE)
+        writer.write(data)
+        writer.close()
+        return output.getvalue()
+
+    @staticmethod
+    def __decompress(codec, data: bytes):
+        reader = compression.ParallelDecompressReader(io.BytesIO(data), codec, workers=WORKERS)
+        result = reader.read()
+        reader.close()
+        return result
+
+    def __verify_snapshot(self, destination: str):
+        for file_name, content in TEST_FILES.items():
+            with open(os.path.join(destination, TEST_SNAPSHOT, file_name), 'rb') as f:
+                self.assertEqual(f.read(), content)
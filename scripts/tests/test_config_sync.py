@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from kazoo.exceptions import NoNodeError
+from unittest import TestCase
+from scripts import config_sync
+
+import os
+import shutil
+import tempfile
+
+
+class FakeResult:
+
+    def __init__(self, value=None, exception=None):
+        self.__value = value
+        self.__exception = exception
+
+    def get(self, timeout=None):
+        if self.__exception:
+            raise self.__exception
+        return self.__value
+
+
+class FakeZooKeeper:
+    """Keeps ZooKeeper nodes in memory and records the writes."""
+
+    def __init__(self, nodes: dict = None):
+        self.nodes = {'/': b'', '/configs': b''}
+        self.nodes.update(nodes or {})
+        self.writes = []
+
+    def get_children_async(self, path):
+        if path not in self.nodes:
+            return FakeResult(exception=NoNodeError())
+        return FakeResult([node[len(path) + 1:] for node in self.nodes
+                           if node.startswith(path + '/') and '/' not in node[len(path) + 1:]])
+
+    def get_async(self, path):
+        if path not in self.nodes:
+            return FakeResult(exception=NoNodeError())
+        return FakeResult((self.nodes[path], None))
+
+    def ensure_path(self, path):
+        parts = path.split('/')
+        for i in range(2, len(parts) + 1):
+            self.nodes.setdefault('/'.join(parts[:i]), b'')
+
+    def set_async(self, path, value):
+        self.writes.append(('set', path))
+        self.nodes[path] = value
+        return FakeResult(None)
+
+    def create_async(self, path, value):
+        self.writes.append(('create', path))
+        self.nodes[path] = value
+        return FakeResult(path)
+
+
+class TestConfigSync(TestCase):
+
+    def setUp(self):
+        self.__config_dir = tempfile.mkdtemp()
+        for file_name, content in [('solrconfig.xml', b'<config/>'), ('schema.xml', b'<schema/>'),
+                                   ('lang/stopwords.txt', b'a\nthe\n')]:
+            os.makedirs(os.path.join(self.__config_dir, os.path.dirname(file_name)), exist_ok=True)
+            with open(os.path.join(self.__config_dir, file_name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.__config_dir)
+
+    def test_should_create_missing_config_set(self):
+        zk = FakeZooKeeper()
+
+        updated = config_sync.sync_configs(zk, {'example': self.__config_dir})
+
+        self.assertDictEqual(updated, {'example': ['lang/stopwords.txt', 'schema.xml', 'solrconfig.xml']})
+        self.assertEqual(zk.nodes['/configs/example/lang/stopwords.txt'], b'a\nthe\n')
+        self.assertTrue(all(operation == 'create' for operation, path in zk.writes))
+
+    def test_should_only_write_changed_files(self):
+        zk = FakeZooKeeper({
+            '/configs/example': b'',
+            '/configs/example/solrconfig.xml': b'<config/>',
+            '/configs/example/schema.xml': b'<schema version="old"/>',
+            '/configs/example/lang': b'',
+            '/configs/example/lang/stopwords.txt': b'a\nthe\n',
+            '/configs/example/managed-schema': b'<schema/>',
+        })
+
+        updated = config_sync.sync_configs(zk, {'example': self.__config_dir})
+
+        self.assertDictEqual(updated, {'example': ['schema.xml']})
+        self.assertListEqual(zk.writes, [('set', '/configs/example/schema.xml')])
+        # Files which only exist remotely are kept
+        self.assertIn('/configs/example/managed-schema', zk.nodes)
+
+    def test_should_not_write_up_to_date_configs(self):
+        zk = FakeZooKeeper()
+        config_sync.sync_configs(zk, {'example': self.__config_dir, 'example-test': self.__config_dir})
+        zk.writes = []
+
+        self.assertDictEqual(config_sync.sync_configs(zk, {'example': self.__config_dir,
+                                                           'example-test': self.__config_dir}), {})
+        self.assertListEqual(zk.writes, [])
+
+    def test_should_read_all_remote_config_trees(self):
+        zk = FakeZooKeeper({
+            '/configs/a': b'', '/configs/a/solrconfig.xml': b'a', '/configs/a/lang': b'',
+            '/configs/a/lang/stopwords.txt': b'stop', '/configs/b': b'', '/configs/b/schema.xml': b'b',
+        })
+
+        self.assertDictEqual(config_sync.read_remote_configs(zk, ['a', 'b', 'c']), {
+            'a': {'solrconfig.xml': b'a', 'lang/stopwords.txt': b'stop'},
+            'b': {'schema.xml': b'b'},
+            'c': {},
+        })
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import content_store
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+TEST_SNAPSHOT = 'snapshot.test_collection_shard1'
+TEST_FILES = {
+    '_0.fdt': b'stored fields',
+    '_0.si': b'segment info',
+}
+
+class TestContentStore(TestCase):
+
+    __tmp_dir = None
+
+    def setUp(self):
+        self.__tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.__tmp_dir, TEST_SNAPSHOT))
+        for file_name, content in TEST_FILES.items():
+            with open(os.path.join(self.__tmp_dir, TEST_SNAPSHOT, file_name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_dir)
+
+    def test_should_create_manifest_of_snapshot_directory(self):
+        manifest = content_store.create_manifest(os.path.join(self.__tmp_dir, TEST_SNAPSHOT))
+
+        self.assertEqual(manifest['snapshot'], TEST_SNAPSHOT)
+        self.assertListEqual(manifest['files'], [
+            {'name': name, 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+            for name, content in sorted(TEST_FILES.items())
+        ])
+
+    def test_should_write_and_read_manifest(self):
+        manifest = content_store.create_manifest(os.path.join(self.__tmp_dir, TEST_SNAPSHOT))
+        manifest_file_name = os.path.join(self.__tmp_dir, 'manifest.json')
+        content_store.write_manifest(manifest, manifest_file_name)
+
+        self.assertDictEqual(content_store.read_manifest(manifest_file_name), manifest)
+
+    def test_should_reject_manifest_with_paths_outside_of_snapshot(self):
+        manifest_file_name = os.path.join(self.__tmp_dir, 'manifest.json')
+        for snapshot, name in [(TEST_SNAPSHOT, '../../etc/cron.d/backup'), (TEST_SNAPSHOT, '/etc/passwd'),
+                               ('..', '_0.si'), (TEST_SNAPSHOT, 'index/../../_0.si')]:
+            manifest = content_store.create_manifest(os.path.join(self.__tmp_dir, TEST_SNAPSHOT))
+            manifest['snapshot'] = snapshot
+            manifest['files'][0]['name'] = name
+            content_store.write_manifest(manifest, manifest_file_name)
+
+            with self.assertRaisesRegex(Exception, 'outside of its snapshot'):
+                content_store.read_manifest(manifest_file_name)
+
+        self.assertTrue(content_store.is_relative_name('index/_0.si'))
+
+    def test_should_verify_file_against_manifest_entry(self):
+        manifest = content_store.create_manifest(os.path.join(self.__tmp_dir, TEST_SNAPSHOT))
+        entry = manifest['files'][0]
+        file_name = os.path.join(self.__tmp_dir, TEST_SNAPSHOT, entry['name'])
+
+        self.assertTrue(content_store.verify_file(file_name, entry))
+        with open(file_name, 'ab') as f:
+            f.write(b'corrupt')
+        self.assertFalse(content_store.verify_file(file_name, entry))
+
+    def test_should_shard_object_keys_by_hash_prefix(self):
+        self.assertEqual(content_store.get_object_key('ab' * 32), 'objects/ab/' + 'ab' * 32)
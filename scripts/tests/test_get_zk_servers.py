@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+from scripts import get_zk_servers
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+CLUSTER_LIST = {'servers': ['10.0.0.1', '10.0.0.2', '10.0.0.3'], 'port': 2181}
+
+
+class FakeExhibitorHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = json.dumps(self.server.cluster_list).encode('utf-8')
+        self.send_response(200 if self.path == '/exhibitor/v1/cluster/list' else 404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeExhibitor(HTTPServer):
+
+    def __init__(self, cluster_list: dict, delay: float = 0):
+        super().__init__(('127.0.0.1', 0), FakeExhibitorHandler)
+        self.cluster_list = cluster_list
+        self.delay = delay
+        self.api = 'http://127.0.0.1:{}/exhibitor/v1'.format(self.server_port)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestGetZkServers(TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__cache_file = os.path.join(self.__directory, 'zk_servers.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def test_should_get_cluster_list_and_cache_it(self):
+        exhibitor = FakeExhibitor(CLUSTER_LIST)
+        try:
+            cluster_list = get_zk_servers.discover(exhibitor.api, self.__cache_file)
+        finally:
+            exhibitor.close()
+
+        self.assertDictEqual(cluster_list, CLUSTER_LIST)
+        self.assertDictEqual(get_zk_servers.read_cache(self.__cache_file), CLUSTER_LIST)
+
+    def test_should_fall_back_to_cache_if_exhibitor_is_slow(self):
+        get_zk_servers.write_cache(self.__cache_file, CLUSTER_LIST)
+        exhibitor = FakeExhibitor({'servers': ['10.0.0.9'], 'port': 2181}, delay=0.5)
+        try:
+            with patch.object(get_zk_servers, 'EXHIBITOR_TIMEOUT_WITH_CACHE_IN_SECONDS', 0.1):
+                cluster_list = get_zk_servers.discover(exhibitor.api, self.__cache_file)
+        finally:
+            exhibitor.close()
+
+        self.assertDictEqual(cluster_list, CLUSTER_LIST)
+
+    def test_should_fail_without_exhibitor_and_cache(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        with self.assertRaises(Exception):
+            get_zk_servers.discover('http://127.0.0.1:{}/exhibitor/v1'.format(port), self.__cache_file)
+
+    def test_should_ignore_invalid_cache(self):
+        with open(self.__cache_file, 'w') as f:
+            f.write('{"servers": []')
+
+        self.assertIsNone(get_zk_servers.read_cache(self.__cache_file))
+
+    def test_should_order_servers_by_latency(self):
+        latencies = {'10.0.0.1': 0.02, '10.0.0.2': None, '10.0.0.3': 0.001, '10.0.0.4': None}
+
+        servers = get_zk_servers.order_servers(sorted(latencies), 2181, lambda server, port: latencies[server])
+
+        self.assertListEqual(servers, ['10.0.0.3', '10.0.0.1', '10.0.0.2', '10.0.0.4'])
+        self.assertEqual(get_zk_servers.get_connect_string(servers[:2], 2181), '10.0.0.3:2181,10.0.0.1:2181')
+
+    def test_should_probe_client_port(self):
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            port = server.getsockname()[1]
+
+            self.assertIsNotNone(get_zk_servers.probe_server('127.0.0.1', port))
+        self.assertIsNone(get_zk_servers.probe_server('127.0.0.1', port, timeout=0.5))
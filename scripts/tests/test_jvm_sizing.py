@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import jvm_sizing
+
+import os
+import shutil
+import tempfile
+
+GB = jvm_sizing.GB
+
+
+class TestJvmSizing(TestCase):
+
+    def test_should_size_heap_from_need_and_leave_the_rest_to_page_cache(self):
+        sizing = jvm_sizing.compute_sizing(61 * GB, 2, 1 * GB)
+
+        # Twice the 512 MB base, 2 * 64 MB for the cores and 5% of the index
+        self.assertEqual(sizing.heap_size, 2 * (640 * jvm_sizing.MB + GB // 20) // jvm_sizing.MB * jvm_sizing.MB)
+        self.assertEqual(sizing.page_cache_size, 61 * GB - 61 * GB // 10 - sizing.heap_size)
+        self.assertIsNone(sizing.gc_tune)
+
+    def test_should_limit_headroom_to_keep_whole_index_resident(self):
+        sizing = jvm_sizing.compute_sizing(32 * GB, 4, 26 * GB)
+
+        self.assertGreaterEqual(sizing.page_cache_size, 26 * GB)
+        self.assertEqual(sizing.heap_size, (32 * GB - 32 * GB // 10 - 26 * GB) // jvm_sizing.MB * jvm_sizing.MB)
+        self.assertTrue(any('headroom' in reason for reason in sizing.reasons))
+
+    def test_should_cap_heap_with_headroom(self):
+        sizing = jvm_sizing.compute_sizing(512 * GB, 4, 320 * GB)
+
+        self.assertEqual(sizing.heap_size, 31 * GB)
+        self.assertEqual(sizing.get_heap_option(), '31744m')
+        self.assertEqual(sizing.gc_tune, jvm_sizing.G1_GC_TUNE)
+
+    def test_should_keep_minimum_heap_if_index_does_not_fit(self):
+        sizing = jvm_sizing.compute_sizing(8 * GB, 8, 100 * GB)
+
+        # Heap needed by 8 cores with a 100 GB index, capped at half of the memory
+        self.assertEqual(sizing.heap_size, 4 * GB)
+        self.assertEqual(sizing.gc_tune, jvm_sizing.G1_GC_TUNE)
+        self.assertTrue(any('does not fit' in reason for reason in sizing.reasons))
+
+    def test_should_use_default_share_without_index(self):
+        sizing = jvm_sizing.compute_sizing(16 * GB, 0, 0, default_heap_percent=20)
+
+        self.assertEqual(sizing.heap_size, 16 * GB * 20 // 100 // jvm_sizing.MB * jvm_sizing.MB)
+        self.assertIsNone(sizing.gc_tune)
+
+    def test_should_measure_local_index(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            for core_name, size in [('a_shard1_replica1', 1000), ('b_shard1_replica1', 500)]:
+                index_dir = os.path.join(data_dir, core_name, 'data', 'index')
+                os.makedirs(index_dir)
+                with open(os.path.join(data_dir, core_name, jvm_sizing.CORE_PROPERTIES), 'w') as f:
+                    f.write('name=' + core_name)
+                with open(os.path.join(index_dir, '_0.cfs'), 'wb') as f:
+                    f.write(b'\0' * size)
+            os.makedirs(os.path.join(data_dir, 'logs'))
+
+            self.assertEqual(jvm_sizing.get_local_index(data_dir), (2, 1500))
+        finally:
+            shutil.rmtree(data_dir)
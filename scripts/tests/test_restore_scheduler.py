@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from unittest import TestCase
+from scripts import restore_scheduler
+from scripts import workers
+
+import time
+
+POOL_SIZE = 4
+TIMEOUT = 10
+POLL_INTERVAL = 0.01
+SETTLE_TIME = 0.05
+
+CORE_1 = 'test_collection_shard1_replica1'
+CORE_2 = 'test_collection_shard2_replica1'
+
+
+class TestRestoreScheduler(TestCase):
+
+    def setUp(self):
+        self.__restored = []
+        self.__lock = Lock()
+
+    def test_should_restore_cores_once_as_soon_as_they_appear(self):
+        polls = [[], [CORE_1], [CORE_1, CORE_2]]
+        scheduler = self.__create_scheduler(lambda: polls.pop(0) if len(polls) > 1 else polls[0], self.__restore)
+
+        started = time.time()
+        scheduler.run()
+
+        self.assertListEqual(sorted(self.__restored), [CORE_1, CORE_2])
+        self.assertDictEqual(scheduler.get_states(), {CORE_1: restore_scheduler.STATE_DONE,
+                                                      CORE_2: restore_scheduler.STATE_DONE})
+        # The run ends after the settle time instead of the timeout
+        self.assertLess(time.time() - started, TIMEOUT / 2)
+
+    def test_should_report_failed_cores(self):
+        def restore(core_name, report_state):
+            report_state(restore_scheduler.STATE_DOWNLOADING)
+            if core_name == CORE_2:
+                raise Exception('Download failed')
+            self.__restore(core_name, report_state)
+
+        scheduler = self.__create_scheduler(lambda: [CORE_1, CORE_2], restore)
+
+        with self.assertRaises(workers.TaskFailure):
+            scheduler.run()
+        self.assertListEqual(self.__restored, [CORE_1])
+        self.assertEqual(scheduler.get_states()[CORE_2], restore_scheduler.STATE_FAILED)
+
+    def test_should_hand_new_cores_to_pool_in_given_order(self):
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [CORE_1, CORE_2], self.__restore, 1, timeout=TIMEOUT,
+                                                       settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL,
+                                                       order_cores=lambda core_names: sorted(core_names,
+                                                                                             reverse=True))
+        scheduler.run()
+
+        self.assertListEqual(self.__restored, [CORE_2, CORE_1])
+
+    def test_should_submit_deferred_cores_again_without_blocking_the_pool(self):
+        attempts = []
+
+        def restore(core_name, report_state):
+            attempts.append(core_name)
+            if core_name == CORE_1 and attempts.count(CORE_1) < 3:
+                raise restore_scheduler.RestoreDeferred('Waiting for the elected replica')
+            self.__restore(core_name, report_state)
+
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [CORE_1, CORE_2], restore, 1, timeout=TIMEOUT,
+                                                       settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL)
+        scheduler.run()
+
+        # The single slot of the pool restores the second core while the first one waits
+        self.assertListEqual(self.__restored, [CORE_2, CORE_1])
+        self.assertEqual(attempts.count(CORE_1), 3)
+        self.assertDictEqual(scheduler.get_states(), {CORE_1: restore_scheduler.STATE_DONE,
+                                                      CORE_2: restore_scheduler.STATE_DONE})
+
+    def test_should_finish_once_expected_cores_are_restored(self):
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [CORE_1, CORE_2], self.__restore, POOL_SIZE,
+                                                       timeout=TIMEOUT, settle_time=TIMEOUT,
+                                                       poll_interval=POLL_INTERVAL,
+                                                       get_expected_cores=lambda core_names: [CORE_1, CORE_2])
+
+        started = time.time()
+        scheduler.run()
+
+        self.assertListEqual(sorted(self.__restored), [CORE_1, CORE_2])
+        # The settle time only applies while the expected cores are unknown
+        self.assertLess(time.time() - started, TIMEOUT / 2)
+
+    def test_should_finish_without_cores_if_none_are_expected(self):
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [], self.__restore, POOL_SIZE, timeout=TIMEOUT,
+                                                       settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL,
+                                                       get_expected_cores=lambda core_names: [])
+
+        started = time.time()
+        scheduler.run()
+
+        self.assertDictEqual(scheduler.get_states(), {})
+        self.assertLess(time.time() - started, TIMEOUT / 2)
+
+    def test_should_wait_for_expected_cores_which_did_not_appear_yet(self):
+        polls = [[CORE_1], [CORE_1], [CORE_1], [CORE_1, CORE_2]]
+        scheduler = restore_scheduler.RestoreScheduler(lambda: polls.pop(0) if len(polls) > 1 else polls[0],
+                                                       self.__restore, POOL_SIZE, timeout=TIMEOUT, settle_time=0,
+                                                       poll_interval=POLL_INTERVAL,
+                                                       get_expected_cores=lambda core_names: [CORE_1, CORE_2])
+        scheduler.run()
+
+        self.assertListEqual(sorted(self.__restored), [CORE_1, CORE_2])
+
+    def test_should_stop_at_timeout_without_cores(self):
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [], self.__restore, POOL_SIZE, timeout=0.1,
+                                                       settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL)
+        scheduler.run()
+
+        self.assertDictEqual(scheduler.get_states(), {})
+
+    def test_should_fail_deferred_and_missing_expected_cores_at_timeout(self):
+        def restore(core_name, report_state):
+            raise restore_scheduler.RestoreDeferred('The elected replica is not restored yet')
+
+        scheduler = restore_scheduler.RestoreScheduler(lambda: [CORE_1], restore, POOL_SIZE, timeout=0.1,
+                                                       settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL,
+                                                       get_expected_cores=lambda core_names: [CORE_1, CORE_2])
+        with self.assertRaises(workers.TaskFailure) as context:
+            scheduler.run()
+
+        self.assertListEqual([description for description, e in context.exception.failures], [CORE_1, CORE_2])
+        self.assertDictEqual(scheduler.get_states(), {CORE_1: restore_scheduler.STATE_FAILED,
+                                                      CORE_2: restore_scheduler.STATE_FAILED})
+
+    def __create_scheduler(self, get_local_cores, restore):
+        return restore_scheduler.RestoreScheduler(get_local_cores, restore, POOL_SIZE, timeout=TIMEOUT,
+                                                  settle_time=SETTLE_TIME, poll_interval=POLL_INTERVAL)
+
+    def __restore(self, core_name, report_state):
+        report_state(restore_scheduler.STATE_RESTORING)
+        with self.__lock:
+            self.__restored.append(core_name)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from mock import patch
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from unittest import TestCase
+from xml.sax.saxutils import escape
+from scripts import s3_transfer
+from scripts import transfer_journal
+
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+import uuid
+
+S3_BUCKET = 'test-bucket'
+CHUNK_SIZE = 5 * 1024 * 1024
+TEST_CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test', 'AWS_DEFAULT_REGION': 'eu-west-1'}
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Implements the subset of the S3 REST API used by boto3 transfers on path-style URLs."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_HEAD(self):
+        key, query = self.__parse()
+        content = self.server.objects.get(key)
+        if content is None:
+            return self.__respond(404, b'', head=True)
+        self.__respond(200, content, head=True)
+
+    def do_GET(self):
+        key, query = self.__parse()
+        if 'list-type' in query:
+            return self.__list(query)
+        if 'uploadId' in query:
+            return self.__list_parts(key, query['uploadId'])
+        content = self.server.objects.get(key)
+        if content is None:
+            return self.__respond(404, b'<Error><Code>NoSuchKey</Code></Error>')
+        range_match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if range_match:
+            with self.server.lock:
+                self.server.ranged_gets += 1
+                if int(range_match.group(1)) in self.server.failing_ranges:
+                    self.server.failing_ranges.remove(int(range_match.group(1)))
+                    return self.__respond(400, b'<Error><Code>InvalidRequest</Code></Error>')
+            start, end = int(range_match.group(1)), min(int(range_match.group(2) or len(content)), len(content) - 1)
+            return self.__respond(206, content[start:end + 1],
+                                  {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(content))})
+        self.__respond(200, content)
+
+    def do_PUT(self):
+        key, query = self.__parse()
+        body = self.__read_body()
+        if 'uploadId' in query:
+            with self.server.lock:
+                self.server.uploaded_parts += 1
+                if int(query['partNumber']) in self.server.failing_parts:
+                    self.server.failing_parts.remove(int(query['partNumber']))
+                    return self.__respond(400, b'<Error><Code>InvalidRequest</Code></Error>')
+                self.server.uploads[query['uploadId']][int(query['partNumber'])] = body
+        else:
+            self.server.objects[key] = body
+        self.__respond(200, b'', {'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())})
+
+    def do_POST(self):
+        key, query = self.__parse()
+        self.__read_body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            return self.__respond(200, '<InitiateMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}'
+                                       '</UploadId></InitiateMultipartUploadResult>'
+                                  .format(S3_BUCKET, escape(key), upload_id).encode('utf-8'))
+        with self.server.lock:
+            parts = self.server.uploads.pop(query['uploadId'])
+            self.server.objects[key] = b''.join(parts[number] for number in sorted(parts))
+            self.server.multipart_uploads += 1
+        self.__respond(200, '<CompleteMultipartUploadResult><Key>{}</Key><ETag>"multipart"</ETag>'
+                            '</CompleteMultipartUploadResult>'.format(escape(key)).encode('utf-8'))
+
+    def do_DELETE(self):
+        key, query = self.__parse()
+        with self.server.lock:
+            self.server.uploads.pop(query.get('uploadId'), None)
+        self.__respond(204, b'')
+
+    def log_message(self, format, *args):
+        pass
+
+    def __parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(url.path).lstrip('/')
+        key = path[len(S3_BUCKET) + 1:]
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        return key, query
+
+    def __read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            body = self.__decode_aws_chunked(body)
+        return body
+
+    @staticmethod
+    def __decode_aws_chunked(body: bytes):
+        decoded = b''
+        while True:
+            header, body = body.split(b'\r\n', 1)
+            size = int(header.split(b';')[0], 16)
+            if size == 0:
+                return decoded
+            decoded += body[:size]
+            body = body[size + 2:]
+
+    def __list(self, query: dict):
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        keys, common_prefixes = [], set()
+        for key in sorted(self.server.objects):
+            if not key.startswith(prefix):
+                continue
+            if delimiter and delimiter in key[len(prefix):]:
+                common_prefixes.add(prefix + key[len(prefix):].split(delimiter)[0] + delimiter)
+            else:
+                keys.append(key)
+        contents = ''.join('<Contents><Key>{}</Key><Size>{}</Size></Contents>'
+                           .format(escape(key), len(self.server.objects[key])) for key in keys)
+        prefixes = ''.join('<CommonPrefixes><Prefix>{}</Prefix></CommonPrefixes>'.format(escape(common_prefix))
+                           for common_prefix in sorted(common_prefixes))
+        self.__respond(200, '<ListBucketResult><Name>{}</Name><Prefix>{}</Prefix><KeyCount>{}</KeyCount>'
+                            '<IsTruncated>false</IsTruncated>{}{}</ListBucketResult>'
+                       .format(S3_BUCKET, escape(prefix), len(keys), contents, prefixes).encode('utf-8'))
+
+    def __list_parts(self, key: str, upload_id: str):
+        parts = self.server.uploads.get(upload_id)
+        if parts is None:
+            return self.__respond(404, b'<Error><Code>NoSuchUpload</Code></Error>')
+        contents = ''.join('<Part><PartNumber>{}</PartNumber><ETag>"{}"</ETag><Size>{}</Size></Part>'
+                           .format(number, hashlib.md5(parts[number]).hexdigest(), len(parts[number]))
+                           for number in sorted(parts))
+        self.__respond(200, '<ListPartsResult><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId>'
+                            '<IsTruncated>false</IsTruncated>{}</ListPartsResult>'
+                       .format(S3_BUCKET, escape(key), upload_id, contents).encode('utf-8'))
+
+    def __respond(self, status: int, body: bytes, headers: dict = None, head=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', 'Sun, 01 May 2016 01:00:00 GMT')
+        if 'ETag' not in (headers or {}):
+            self.send_header('ETag', '"{}"'.format(hashlib.md5(body).hexdigest()))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+
+class FakeS3Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeS3Handler)
+        self.lock = Lock()
+        self.objects = {}
+        self.uploads = {}
+        self.connections = 0
+        self.ranged_gets = 0
+        self.multipart_uploads = 0
+        self.uploaded_parts = 0
+        # Part numbers and range starts which fail once
+        self.failing_parts = set()
+        self.failing_ranges = set()
+
+    def get_endpoint_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class TestS3Transfer(TestCase):
+
+    def setUp(self):
+        self.__environment = patch.dict(os.environ, TEST_CREDENTIALS)
+        self.__environment.start()
+        self.__server = FakeS3Server()
+        Thread(target=self.__server.serve_forever, args=(0.01,), daemon=True).start()
+        self.__progress = []
+        self.__transfer = s3_transfer.S3Transfer(self.__server.get_endpoint_url(), max_concurrency=4,
+                                                 chunk_size=CHUNK_SIZE, multipart_threshold=CHUNK_SIZE,
+                                                 progress_listener=lambda key, size: self.__progress.append(size))
+        self.__directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__environment.stop()
+
+    def test_should_upload_and_download_small_files_over_kept_alive_connections(self):
+        for i in range(5):
+            file_name = self.__write_file('small_{}'.format(i), 1024)
+            self.__transfer.upload_file(file_name, S3_BUCKET, '201605010100/small_{}'.format(i))
+        for i in range(5):
+            file_name = os.path.join(self.__directory, 'downloaded_{}'.format(i))
+            self.__transfer.download_file(S3_BUCKET, '201605010100/small_{}'.format(i), file_name)
+            self.assertEqual(os.path.getsize(file_name), 1024)
+
+        # Sequential transfers reuse the connection of the previous one
+        self.assertEqual(self.__server.connections, 1)
+        self.assertDictEqual(self.__transfer.get_stats(), {'uploaded_bytes': 5 * 1024, 'uploaded_files': 5,
+                                                           'downloaded_bytes': 5 * 1024, 'downloaded_files': 5})
+
+    def test_should_transfer_large_files_in_parallel_parts_and_ranges(self):
+        size = 3 * CHUNK_SIZE + 100
+        file_name = self.__write_file('large', size)
+
+        self.__transfer.upload_file(file_name, S3_BUCKET, '201605010100/large')
+        downloaded_file_name = os.path.join(self.__directory, 'downloaded')
+        self.__transfer.download_file(S3_BUCKET, '201605010100/large', downloaded_file_name)
+
+        self.assertEqual(self.__server.multipart_uploads, 1)
+        self.assertGreaterEqual(self.__server.ranged_gets, 4)
+        with open(file_name, 'rb') as original, open(downloaded_file_name, 'rb') as downloaded:
+            self.assertEqual(original.read(), downloaded.read())
+        self.assertEqual(sum(self.__progress), 2 * size)
+
+    def test_should_stream_to_and_from_s3(self):
+        content = os.urandom(2 * CHUNK_SIZE + 10)
+
+        self.__transfer.upload_stream(io.BytesIO(content), S3_BUCKET, '201605010100/stream', len(content))
+        stream = io.BytesIO()
+        self.__transfer.download_stream(S3_BUCKET, '201605010100/stream', stream)
+
+        self.assertEqual(stream.getvalue(), content)
+
+    def test_should_list_keys_and_prefixes(self):
+        for key in ['201605010100/backup_a', '201605020100/backup_a', 'objects/aa/aaaa']:
+            self.__server.objects[key] = b'content'
+
+        self.assertListEqual(self.__transfer.list_keys(S3_BUCKET, 'objects/'), ['objects/aa/aaaa'])
+        self.assertListEqual(self.__transfer.list_prefixes(S3_BUCKET),
+                             ['201605010100/', '201605020100/', 'objects/'])
+
+    def test_should_store_and_read_small_objects(self):
+        self.__transfer.put_bytes(b'{"timestamp": "201605010100"}', S3_BUCKET, 'catalog/latest.json')
+
+        self.assertEqual(self.__transfer.get_bytes(S3_BUCKET, 'catalog/latest.json'), b'{"timestamp": "201605010100"}')
+        self.assertIsNone(self.__transfer.get_bytes(S3_BUCKET, 'catalog/missing.json'))
+
+    def test_should_resume_interrupted_upload_after_completed_parts(self):
+        transfer = self.__create_journaled_transfer()
+        file_name = self.__write_file('large', 3 * CHUNK_SIZE + 100)
+        self.__server.failing_parts.add(3)
+
+        with self.assertRaises(s3_transfer.S3TransferError):
+            transfer.upload_file(file_name, S3_BUCKET, '201605010100/large')
+        self.assertNotIn('201605010100/large', self.__server.objects)
+        self.__server.uploaded_parts = 0
+        transfer.upload_file(file_name, S3_BUCKET, '201605010100/large')
+
+        # Only the failed part is uploaded again
+        self.assertEqual(self.__server.uploaded_parts, 1)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(self.__server.objects['201605010100/large'], f.read())
+
+    def test_should_abort_upload_of_discarded_transfer(self):
+        transfer = self.__create_journaled_transfer()
+        file_name = self.__write_file('large', 3 * CHUNK_SIZE + 100)
+        self.__server.failing_parts.add(3)
+        with self.assertRaises(s3_transfer.S3TransferError):
+            transfer.upload_file(file_name, S3_BUCKET, '201605010100/large')
+        self.assertEqual(len(self.__server.uploads), 1)
+
+        transfer.discard_transfers(transfer_journal.UPLOAD)
+
+        self.assertDictEqual(self.__server.uploads, {})
+        self.assertListEqual(self.__journal.get_transfers(transfer_journal.UPLOAD), [])
+
+    def test_should_resume_interrupted_download_after_verified_ranges(self):
+        transfer = self.__create_journaled_transfer()
+        content = os.urandom(3 * CHUNK_SIZE + 100)
+        self.__server.objects['201605010100/large'] = content
+        file_name = os.path.join(self.__directory, 'downloaded')
+        self.__server.failing_ranges.add(2 * CHUNK_SIZE)
+
+        with self.assertRaises(s3_transfer.S3TransferError):
+            transfer.download_file(S3_BUCKET, '201605010100/large', file_name)
+        # A completed range which was damaged on disk fails its checksum and is downloaded again
+        with open(file_name, 'r+b') as f:
+            f.write(b'\0' * 10)
+        self.__server.ranged_gets = 0
+        transfer.download_file(S3_BUCKET, '201605010100/large', file_name)
+
+        self.assertEqual(self.__server.ranged_gets, 2)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_should_download_small_file_of_journaled_transfer_without_ranges(self):
+        transfer = self.__create_journaled_transfer()
+        content = os.urandom(1024)
+        self.__server.objects['201605010100/small'] = content
+        file_name = os.path.join(self.__directory, 'downloaded')
+
+        transfer.download_file(S3_BUCKET, '201605010100/small', file_name)
+
+        self.assertEqual(self.__server.ranged_gets, 0)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertDictEqual(transfer.get_stats(), {'uploaded_bytes': 0, 'uploaded_files': 0,
+                                                    'downloaded_bytes': 1024, 'downloaded_files': 1})
+
+    def test_should_raise_error_for_missing_object(self):
+        with self.assertRaises(s3_transfer.S3TransferError):
+            self.__transfer.download_file(S3_BUCKET, 'missing', os.path.join(self.__directory, 'missing'))
+
+    def __create_journaled_transfer(self):
+        self.__journal = transfer_journal.TransferJournal(os.path.join(self.__directory, 'journal.db'))
+        self.addCleanup(self.__journal.close)
+        return s3_transfer.S3Transfer(self.__server.get_endpoint_url(), max_concurrency=4, chunk_size=CHUNK_SIZE,
+                                      multipart_threshold=CHUNK_SIZE, journal=self.__journal)
+
+    def __write_file(self, name: str, size: int):
+        file_name = os.path.join(self.__directory, name)
+        with open(file_name, 'wb') as f:
+            f.write(os.urandom(size))
+        return file_name
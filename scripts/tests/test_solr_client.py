@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from unittest import TestCase
+from scripts import solr_client
+
+import json
+import time
+
+RETRY_POLICY = solr_client.RetryPolicy(attempts=3, read_timeout=5, retry_wait=0)
+NO_TIMEOUT_RETRY_POLICY = solr_client.RetryPolicy(attempts=3, read_timeout=5, retry_wait=0, retry_timeouts=False)
+
+
+class FakeSolrHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            if self.server.dropped_requests > 0:
+                # The connection is closed after the request was received, without a response
+                self.server.dropped_requests -= 1
+                self.close_connection = True
+                return
+            status, content = self.server.responses.pop(0) if self.server.responses else (200, {})
+        body = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Closes the kept-alive connection like an idle timeout of the server
+        self.close_connection = self.server.close_after_response
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSolrServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSolrHandler)
+        self.lock = Lock()
+        self.connections = 0
+        self.requests = []
+        self.responses = []
+        self.dropped_requests = 0
+        self.close_after_response = False
+
+
+class TestSolrHttpClient(TestCase):
+
+    def setUp(self):
+        self.__server = FakeSolrServer()
+        Thread(target=self.__server.serve_forever, args=(0.01,), daemon=True).start()
+        self.__base_url = 'http://127.0.0.1:{}/solr'.format(self.__server.server_address[1])
+        self.__client = solr_client.SolrHttpClient()
+
+    def tearDown(self):
+        self.__client.close()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def test_should_reuse_connection_for_sequential_requests(self):
+        self.__server.responses = [(200, {'responseHeader': {'status': 0}, 'index': i}) for i in range(5)]
+
+        results = [self.__client.get_json(self.__base_url + '/admin/cores?wt=json', RETRY_POLICY) for _ in range(5)]
+
+        self.assertListEqual([result['index'] for result in results], list(range(5)))
+        self.assertEqual(self.__server.connections, 1)
+        self.assertEqual(len(self.__server.requests), 5)
+
+    def test_should_retry_unavailable_solr(self):
+        self.__server.responses = [(503, {}), (503, {}), (200, {'status': {}})]
+
+        self.assertDictEqual(self.__client.get_json(self.__base_url + '/admin/cores', RETRY_POLICY), {'status': {}})
+        self.assertEqual(len(self.__server.requests), 3)
+
+    def test_should_raise_timeout_without_retrying_commands(self):
+        self.__server.responses = [(504, {})]
+
+        with self.assertRaises(solr_client.RequestTimeout):
+            self.__client.get_json(self.__base_url + '/test/update?commit=true', NO_TIMEOUT_RETRY_POLICY)
+        self.assertEqual(len(self.__server.requests), 1)
+
+    def test_should_not_reuse_pooled_connection_closed_by_server(self):
+        self.__server.close_after_response = True
+        self.__client.get_json(self.__base_url + '/admin/cores', NO_TIMEOUT_RETRY_POLICY)
+        time.sleep(0.1)
+
+        self.assertDictEqual(self.__client.get_json(self.__base_url + '/test/replication?command=backup',
+                                                    NO_TIMEOUT_RETRY_POLICY), {})
+        self.assertEqual(len(self.__server.requests), 2)
+        self.assertEqual(self.__server.connections, 2)
+
+    def test_should_not_send_command_again_if_connection_is_lost_after_sending(self):
+        self.__server.dropped_requests = 1
+
+        with self.assertRaises(solr_client.SolrError):
+            self.__client.get_json(self.__base_url + '/test/replication?command=backup', NO_TIMEOUT_RETRY_POLICY)
+        self.assertEqual(len(self.__server.requests), 1)
+
+    def test_should_send_status_request_again_if_connection_is_lost(self):
+        self.__server.dropped_requests = 1
+
+        self.assertDictEqual(self.__client.get_json(self.__base_url + '/admin/cores', RETRY_POLICY), {})
+        self.assertEqual(len(self.__server.requests), 2)
+
+    def test_should_raise_error_for_invalid_json(self):
+        self.__server.responses = [(200, b'<html>not json</html>')]
+
+        with self.assertRaises(solr_client.SolrError):
+            self.__client.get_json(self.__base_url + '/admin/cores', RETRY_POLICY)
+
+    def test_should_raise_error_for_solr_error_status(self):
+        self.__server.responses = [(200, {'responseHeader': {'status': 500}, 'error': {'msg': 'failed'}})]
+
+        with self.assertRaises(solr_client.SolrError):
+            self.__client.get_json(self.__base_url + '/admin/collections?action=RELOAD', RETRY_POLICY)
+
+    def test_should_raise_error_for_unexpected_status_code(self):
+        self.__server.responses = [(404, {'error': {'msg': 'Not Found'}})]
+
+        with self.assertRaises(solr_client.SolrError) as context:
+            self.__client.get_json(self.__base_url + '/missing', RETRY_POLICY)
+        self.assertIn('Not Found', str(context.exception))
@@ -4,21 +4,33 @@
 from datetime import datetime
 from mock import MagicMock
 from unittest import TestCase
+from scripts import backup_catalog
+from scripts import content_store
+from scripts import s3_transfer
+from scripts import solr_client
+from scripts import transfer_journal
 from scripts.solrcloud_backup import BackupController
 
+import errno
 import json
 import os
 import re
 import shutil
 import subprocess
-import urllib.request
+import tempfile
+import time
+import urllib.parse
 
 COMMIT_WAIT_IN_SECONDS = 0
 S3_BUCKET = 'test_bucket'
 BACKUP_ROOT_DIR = '/backup/'
+DATA_DIR = '/data/'
+SNAPSHOT_ROOT_DIR = DATA_DIR + '.snapshots/'
 LOCAL_URL = 'http://localhost:8983/solr'
-
-HTTP_CODE_OK = 200
+CLUSTER_STATUS_URL = LOCAL_URL + '/admin/collections?action=CLUSTERSTATUS&wt=json'
+LOCAL_NODE = '10.0.0.1:8983_solr'
+REMOTE_NODE = '10.0.0.2:8983_solr'
+REMOTE_URL = 'http://10.0.0.2:8983/solr'
 
 TEST_COLLECTION = 'test_collection'
 TEST_SHARD = 'shard1'
@@ -29,6 +41,16 @@ TEST_SPLIT_SHARD_NORMALIZED = 'shard4'
 TEST_REPLICA_1 = 'replica1'
 TEST_REPLICA_2 = 'replica2'
 
+# Module attributes replaced by mocks in the tests, restored after each test
+PATCHED_ATTRIBUTES = [
+    (os, 'link'), (os, 'listdir'), (os, 'makedirs'), (os, 'remove'), (os, 'rename'), (os.path, 'isdir'),
+    (os.path, 'isfile'), (os.path, 'getsize'), (shutil, 'rmtree'), (subprocess, 'call'), (subprocess, 'Popen'),
+    (content_store, 'create_manifest'), (content_store, 'write_manifest'), (content_store, 'hash_file')
+]
+
+STORED_SHA256 = 'a' * 64
+NEW_SHA256 = 'b' * 64
+
 
 class TestBackupController(TestCase):
 
@@ -36,14 +58,28 @@ class TestBackupController(TestCase):
     __subprocess_mock = MagicMock(return_value=0)
 
     def setUp(self):
+        self.__originals = [(module, name, getattr(module, name)) for module, name in PATCHED_ATTRIBUTES]
         subprocess.call = self.__subprocess_mock
         self.__backup_controller = BackupController(COMMIT_WAIT_IN_SECONDS)
+        self.__s3_mock = MagicMock()
+        self.__s3_mock.get_bytes.return_value = None
+        self.__backup_controller.set_s3_transfer(self.__s3_mock)
         self.__backup_controller.set_retry_count(1)
         self.__backup_controller.set_retry_wait(0)
         self.__backup_controller.set_restore_retry_count(1)
         self.__backup_controller.set_restore_retry_wait(0)
 
+    def tearDown(self):
+        for module, name, original in self.__originals:
+            setattr(module, name, original)
+
     def test_should_restore_backup_for_local_shard(self):
+        self.__test_and_verify_backup_restore()
+
+    def test_should_stream_restore_of_local_shard_from_s3(self):
+        self.__test_and_verify_backup_restore(stream=True)
+
+    def __test_and_verify_backup_restore(self, stream=False):
         timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
         backup_dir = BACKUP_ROOT_DIR + timestamp
         test_backup_file_name = 'backup_' + timestamp + '_' + TEST_COLLECTION + '_' + TEST_SHARD + '.tar.gz'
@@ -55,13 +91,13 @@ class TestBackupController(TestCase):
         check_restore_status_url = LOCAL_URL + '/' + test_core_name + '/replication?command=restorestatus&wt=json'
 
         http_responses = [
-            self.__side_effect_local_cores(urllib.request.Request(local_cores_url)),
-            self.__side_effect_all_ok(urllib.request.Request(trigger_restore_url)),
-            self.__side_effect_restore_in_progress(urllib.request.Request(check_restore_status_url)),
-            self.__side_effect_restore_done(urllib.request.Request(check_restore_status_url)),
+            self.__side_effect_local_cores(local_cores_url),
+            self.__side_effect_all_ok(trigger_restore_url),
+            self.__side_effect_restore_in_progress(check_restore_status_url),
+            self.__side_effect_restore_done(check_restore_status_url),
         ]
         http_mock = MagicMock(side_effect=http_responses)
-        urllib.request.urlopen = http_mock
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
 
         makedirs_mock = MagicMock(return_value=0)
         os.makedirs = makedirs_mock
@@ -84,28 +120,43 @@ class TestBackupController(TestCase):
         shutil_rmtree_mock = MagicMock(return_value=0)
         shutil.rmtree = shutil_rmtree_mock
 
-        self.__backup_controller.restore_backup(bucket=S3_BUCKET, timestamp=timestamp)
+        popen_mock = MagicMock()
+        popen_mock.return_value.wait.return_value = 0
+        subprocess.Popen = popen_mock
+        self.__subprocess_mock.reset_mock()
+
+        self.__backup_controller.set_stream_to_s3(stream)
+        self.assertTrue(self.__backup_controller.restore_backup(bucket=S3_BUCKET, timestamp=timestamp))
 
         # Verify that backup directory is created
         makedirs_mock.assert_called_once_with(BACKUP_ROOT_DIR + timestamp)
 
-        # Verify that existence of tarball is checked before start of restoring
-        os_path_isfile_mock.assert_called_once_with(BACKUP_ROOT_DIR + test_backup_file_name)
-
-        # Verify that backup tarball is downloaded
-        s3_file_url = 's3://' + S3_BUCKET + '/' + timestamp + '/' + test_backup_file_name
-        self.__subprocess_mock.assert_any_call(['aws', 's3', 'cp', s3_file_url, BACKUP_ROOT_DIR])
+        s3_key = timestamp + '/' + test_backup_file_name
+        if stream:
+            # Verify that the archive is extracted while it is downloaded, without staging it on disk
+            popen_mock.assert_called_once_with(['tar', '-xzf', '-', '-C', BACKUP_ROOT_DIR + timestamp],
+                                               stdin=subprocess.PIPE)
+            self.__s3_mock.download_stream.assert_called_once_with(S3_BUCKET, s3_key,
+                                                                   popen_mock.return_value.stdin)
+            self.__s3_mock.download_file.assert_not_called()
+            self.__subprocess_mock.assert_not_called()
+            os_path_isfile_mock.assert_not_called()
+            os_remove_mock.assert_not_called()
+        else:
+            # Verify that backup tarball is downloaded
+            self.__s3_mock.download_file.assert_called_once_with(S3_BUCKET, s3_key,
+                                                                 BACKUP_ROOT_DIR + test_backup_file_name)
 
-        # Verify that backup tarball is unzipped
-        self.__subprocess_mock.assert_any_call(
-            ['tar', '-xzf', BACKUP_ROOT_DIR + test_backup_file_name, '-C', BACKUP_ROOT_DIR + timestamp]
-        )
+            # Verify that backup tarball is unzipped
+            self.__subprocess_mock.assert_any_call(
+                ['tar', '-xzf', BACKUP_ROOT_DIR + test_backup_file_name, '-C', BACKUP_ROOT_DIR + timestamp]
+            )
 
-        # Verify that downloaded file is deleted after unzipping
-        os_remove_mock.assert_called_once_with(BACKUP_ROOT_DIR + test_backup_file_name)
+            # Verify that downloaded file is deleted after unzipping
+            os_remove_mock.assert_called_once_with(BACKUP_ROOT_DIR + test_backup_file_name)
 
         # Verify HTTP requests
-        called_urls = list(map(lambda call_args: call_args[0][0].get_full_url(), http_mock.call_args_list))
+        called_urls = list(map(lambda call_args: call_args[0][0], http_mock.call_args_list))
         expected_urls = [
             local_cores_url,
             trigger_restore_url,
@@ -117,6 +168,120 @@ class TestBackupController(TestCase):
         # Verify that backup directory is cleaned up afterwards
         shutil_rmtree_mock.assert_called_once_with(backup_dir)
 
+    def test_should_release_incompletely_extracted_snapshot(self):
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+        backup_name = TEST_COLLECTION + '_' + TEST_SHARD
+        shard_backup_dest = BACKUP_ROOT_DIR + timestamp + '/snapshot.' + backup_name
+        entry_key = backup_catalog.get_entry_key(timestamp, 'node1')
+        self.__s3_mock.list_keys.return_value = [entry_key]
+        self.__s3_mock.get_bytes.return_value = backup_catalog.dumps(backup_catalog.create_entry(
+            timestamp, 'node1', 'archive', {backup_name: backup_catalog.create_shard(
+                timestamp + '/backup_' + timestamp + '_' + backup_name + '.tar.gz', 1000, 'a' * 64, 4000)}))
+
+        local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+        http_mock = MagicMock(side_effect=[self.__side_effect_local_cores(local_cores_url)])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+        os.makedirs = MagicMock()
+        os.remove = MagicMock()
+        os.listdir = MagicMock(return_value=[timestamp])
+        # tar stopped early, the snapshot directory exists but lacks the 4000 bytes of the catalog
+        os.path.isdir = MagicMock(side_effect=lambda path: os.path.isdir.call_count > 1)
+        shutil_rmtree_mock = MagicMock()
+        shutil.rmtree = shutil_rmtree_mock
+
+        self.assertFalse(self.__backup_controller.restore_backup(bucket=S3_BUCKET, timestamp=timestamp))
+
+        self.__s3_mock.list_keys.assert_called_once_with(S3_BUCKET, backup_catalog.get_entry_prefix(timestamp))
+        shutil_rmtree_mock.assert_any_call(shard_backup_dest)
+        # The core is not restored from the incomplete snapshot, the timeout only looks up the expected cores
+        self.assertListEqual([call_args[0][0] for call_args in http_mock.call_args_list],
+                             [local_cores_url, CLUSTER_STATUS_URL])
+
+    def test_should_replicate_restore_from_elected_replica(self):
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+        core_name = TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_2
+        leader_url = REMOTE_URL + '/' + TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1
+        cluster_status = self.__side_effect_cluster_status(CLUSTER_STATUS_URL, [])
+        cluster_status['cluster']['collections'][TEST_COLLECTION]['shards'][TEST_SHARD] = {
+            'state': 'active', 'replicas': {
+                'core_node1': {'core': TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1,
+                               'base_url': REMOTE_URL, 'node_name': REMOTE_NODE, 'state': 'active', 'leader': 'true'},
+                'core_node2': {'core': core_name, 'base_url': LOCAL_URL, 'node_name': LOCAL_NODE,
+                               'state': 'active'}}}
+        cluster_status['cluster']['live_nodes'].append(REMOTE_NODE)
+        fetch_index_url = LOCAL_URL + '/' + core_name + '/replication?command=fetchindex&wt=json&masterUrl=' + \
+            urllib.parse.quote(leader_url + '/replication', safe='')
+
+        local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+        restore_status_url = leader_url + '/replication?command=restorestatus&wt=json'
+        local_index_version_url = LOCAL_URL + '/' + core_name + '/replication?command=indexversion&wt=json'
+        # The scheduler polls the local cores and the cluster state in between, so responses are looked up by URL
+        responses = {
+            local_cores_url: [self.__side_effect_json(LOCAL_URL, {'status': {core_name: {}}})],
+            CLUSTER_STATUS_URL: [cluster_status],
+            restore_status_url: [self.__side_effect_restore_in_progress(leader_url),
+                                 self.__side_effect_restore_done(leader_url)],
+            leader_url + '/replication?command=indexversion&wt=json': [self.__side_effect_index_version(leader_url, 5)],
+            fetch_index_url: [self.__side_effect_all_ok(fetch_index_url)],
+            local_index_version_url: [self.__side_effect_index_version(LOCAL_URL, 1),
+                                      self.__side_effect_index_version(LOCAL_URL, 5)],
+        }
+        http_mock = MagicMock(side_effect=lambda url, policy=None: responses[url].pop(0) if len(responses[url]) > 1
+                              else responses[url][0])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+        os.makedirs = MagicMock()
+        os.listdir = MagicMock(return_value=[timestamp])
+        os.path.isdir = MagicMock(return_value=True)
+        shutil.rmtree = MagicMock(return_value=0)
+
+        self.__backup_controller.set_restore_from_leader(True, replica_wait=10)
+        self.__backup_controller.set_restore_retry_count(100)
+        self.__backup_controller.set_restore_retry_wait(0.01)
+        self.assertTrue(self.__backup_controller.restore_backup(bucket=S3_BUCKET, timestamp=timestamp))
+
+        called_urls = [call_args[0][0] for call_args in http_mock.call_args_list
+                       if call_args[0][0] not in (local_cores_url, CLUSTER_STATUS_URL)]
+        # The replica is handed back to the scheduler while the elected replica is being restored
+        self.assertListEqual(called_urls, [
+            restore_status_url,
+            restore_status_url,
+            leader_url + '/replication?command=indexversion&wt=json',
+            fetch_index_url,
+            local_index_version_url,
+            local_index_version_url,
+        ])
+        # Nothing is downloaded from S3 for a replica which is not elected
+        self.__s3_mock.download_file.assert_not_called()
+        self.__s3_mock.download_stream.assert_not_called()
+
+    def test_should_finish_restore_of_node_without_expected_cores_immediately(self):
+        timestamp = '201605010100'
+        remote_core_name = TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1
+        cluster_status = self.__side_effect_cluster_status(CLUSTER_STATUS_URL, [remote_core_name])
+        cluster_status['cluster']['collections'][TEST_COLLECTION]['shards'][TEST_SHARD]['replicas']['core_node0'][
+            'node_name'] = REMOTE_NODE
+        responses = {
+            LOCAL_URL + '/admin/cores?action=STATUS&wt=json': {'status': {}},
+            CLUSTER_STATUS_URL: cluster_status,
+            LOCAL_URL + '/admin/info/system?wt=json': {'node': LOCAL_NODE},
+        }
+        self.__backup_controller.set_http_client(MagicMock(get_json=lambda url, policy=None: responses[url]))
+        # Every shard of the backup is hosted by another node
+        self.__set_catalog(timestamp, {REMOTE_NODE: [TEST_SHARD]})
+        os.makedirs = MagicMock()
+        os.listdir = MagicMock(return_value=[timestamp])
+        os.path.isdir = MagicMock(return_value=True)
+        shutil.rmtree = MagicMock(return_value=0)
+        self.__backup_controller.set_restore_retry_count(60)
+        self.__backup_controller.set_restore_retry_wait(60)
+
+        started = time.time()
+        self.assertTrue(self.__backup_controller.restore_backup(bucket=S3_BUCKET, timestamp=timestamp))
+
+        # Neither the settle time nor the timeout of the restore is waited for
+        self.assertLess(time.time() - started, 30)
+        self.__s3_mock.download_file.assert_not_called()
+
     def test_should_create_backup_of_local_shards(self):
         self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SHARD, self.__side_effect_local_cores)
 
@@ -126,9 +291,384 @@ class TestBackupController(TestCase):
     def test_should_create_backup_of_single_core_setup(self):
         self.__test_and_verify_backup_creation(TEST_COLLECTION, '', self.__side_effect_local_single_cores)
 
-    def __test_and_verify_backup_creation(self, collection: str, shard: str, cores_func):
+    def test_should_stream_backup_of_local_shards_to_s3(self):
+        self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SHARD, self.__side_effect_local_cores,
+                                               stream=True)
+
+    def test_should_stream_backup_of_local_split_shards_to_s3(self):
+        self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SPLIT_SHARD, self.__side_effect_local_split_cores,
+                                               stream=True)
+
+    def test_should_create_incremental_backup_of_local_shards(self):
+        self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SHARD, self.__side_effect_local_cores,
+                                               incremental=True)
+
+    def test_should_stream_hardlink_snapshot_of_local_shards_to_s3(self):
+        self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SHARD, self.__side_effect_local_cores,
+                                               hardlink=True)
+
+    def test_should_stream_hardlink_snapshot_of_local_split_shards_to_s3(self):
+        self.__test_and_verify_backup_creation(TEST_COLLECTION, TEST_SPLIT_SHARD, self.__side_effect_local_split_cores,
+                                               hardlink=True)
+
+    def test_should_link_newer_commit_point_if_files_are_deleted_while_linking(self):
+        core_name = self.__get_core_name(TEST_SHARD)
+        index_path = DATA_DIR + core_name + '/data/index'
+        snapshot_dir_suffix = '/snapshot.' + TEST_COLLECTION + '_' + TEST_SHARD
+        details_url = LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
+        file_list_url = LOCAL_URL + '/' + core_name + '/replication?command=filelist&generation={}&wt=json'
+        http_mock = MagicMock(side_effect=[
+            self.__side_effect_local_cores(LOCAL_URL),
+            solr_client.SolrError('Solr is not running in cloud mode'),
+            self.__side_effect_index_version(LOCAL_URL, generation=1),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_json(details_url, {'details': {'indexPath': index_path}}),
+            self.__side_effect_index_version(LOCAL_URL, generation=1),
+            self.__side_effect_json(file_list_url.format(1), {'filelist': [{'name': '_0.cfs', 'size': 1234},
+                                                                           {'name': 'segments_1', 'size': 1234}]}),
+            self.__side_effect_index_version(LOCAL_URL, generation=2),
+            self.__side_effect_json(file_list_url.format(2), {'filelist': [{'name': '_1.cfs', 'size': 1234},
+                                                                           {'name': 'segments_2', 'size': 1234}]}),
+        ])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+        self.__backup_controller.set_retry_count(2)
+        self.__backup_controller.set_hardlink_snapshots(True)
+        # A merge deletes the segment of the first commit point before its segments file is linked
+        os.link = MagicMock(side_effect=[None, FileNotFoundError(errno.ENOENT, 'No such file'), None, None])
+        os.makedirs = MagicMock()
+        os.listdir = MagicMock(return_value=[])
+        os.path.isdir = MagicMock(return_value=True)
+        os.path.getsize = MagicMock(return_value=1234)
+        shutil.rmtree = MagicMock(return_value=0)
+        subprocess.Popen = MagicMock()
+        subprocess.Popen.return_value.wait.return_value = 0
+
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+
+        self.assertEqual(http_mock.call_args_list[-1][0][0], file_list_url.format(2))
+        linked_files = [os.path.basename(call_args[0][0]) for call_args in os.link.call_args_list]
+        self.assertListEqual(linked_files, ['_0.cfs', 'segments_1', '_1.cfs', 'segments_2'])
+        released_dirs = [call_args[0][0] for call_args in shutil.rmtree.call_args_list]
+        # The links of the deleted commit point are released before the newer one is linked
+        self.assertTrue(released_dirs[0].startswith(SNAPSHOT_ROOT_DIR))
+        self.assertTrue(released_dirs[0].endswith(snapshot_dir_suffix))
+        self.__s3_mock.upload_stream.assert_called_once()
+
+    def test_should_commit_collection_once_and_wait_for_timed_out_commit(self):
+        core_names = [TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1,
+                      TEST_COLLECTION + '_' + TEST_SPLIT_SHARD + '_' + TEST_REPLICA_2]
+        local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+        trigger_commit_url = LOCAL_URL + '/' + TEST_COLLECTION + '/update?commit=true&wt=json'
+        index_version_urls = [LOCAL_URL + '/' + core_name + '/replication?command=indexversion&wt=json'
+                              for core_name in core_names]
+        check_backup_status_urls = [LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
+                                    for core_name in core_names]
+
+        http_mock = MagicMock(side_effect=[
+            self.__side_effect_json(local_cores_url,
+                                    {'status': {core_name: {} for core_name in core_names}}),
+            self.__side_effect_cluster_status(CLUSTER_STATUS_URL, core_names),
+            self.__side_effect_index_version(index_version_urls[0], 1),
+            self.__side_effect_index_version(index_version_urls[1], 1),
+            solr_client.RequestTimeout('Gateway timeout while waiting for Solr [{}]'.format(trigger_commit_url)),
+            self.__side_effect_index_version(index_version_urls[0], 2),
+            self.__side_effect_index_version(index_version_urls[1], 1),
+            self.__side_effect_index_version(index_version_urls[1], 2),
+            self.__side_effect_previous_backup(check_backup_status_urls[0]),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_backup_done(check_backup_status_urls[0]),
+            self.__side_effect_previous_backup(check_backup_status_urls[1]),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_backup_done(check_backup_status_urls[1]),
+        ])
+        os.listdir = MagicMock(return_value=[])
+        os.rename = MagicMock()
+        os.path.getsize = MagicMock(return_value=1234)
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+
+        controller = BackupController(60)
+        controller.set_http_client(MagicMock(get_json=http_mock))
+        controller.set_s3_transfer(self.__s3_mock)
+        controller.set_retry_wait(0)
+        # Snapshots one after the other keep the order of the requests deterministic
+        controller.set_snapshot_pool_size(1)
+        self.assertTrue(controller.create_backup(bucket=S3_BUCKET))
+
+        called_urls = list(map(lambda call_args: call_args[0][0], http_mock.call_args_list))
+        self.assertListEqual(called_urls[:8], [
+            local_cores_url,
+            CLUSTER_STATUS_URL,
+            index_version_urls[0],
+            index_version_urls[1],
+            trigger_commit_url,
+            index_version_urls[0],
+            index_version_urls[1],
+            index_version_urls[1]
+        ])
+        self.assertEqual(len(called_urls), 14)
+
+    def test_should_back_up_only_elected_replicas(self):
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+        leader_core_name = TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1
+        follower_core_name = TEST_COLLECTION + '_shard2_' + TEST_REPLICA_2
+        local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+        check_backup_status_url = LOCAL_URL + '/' + leader_core_name + '/replication?command=details&wt=json'
+        cluster_status = self.__side_effect_cluster_status(CLUSTER_STATUS_URL, [leader_core_name])
+        # The leader of shard2 is a replica on another live node
+        cluster_status['cluster']['collections'][TEST_COLLECTION]['shards']['shard2'] = {
+            'state': 'active', 'replicas': {
+                'core_node2': {'core': TEST_COLLECTION + '_shard2_' + TEST_REPLICA_1, 'node_name': REMOTE_NODE,
+                               'state': 'active', 'leader': 'true'},
+                'core_node3': {'core': follower_core_name, 'node_name': LOCAL_NODE, 'state': 'active'}}}
+        cluster_status['cluster']['live_nodes'].append(REMOTE_NODE)
+
+        http_mock = MagicMock(side_effect=[
+            self.__side_effect_json(local_cores_url, {'status': {leader_core_name: {}, follower_core_name: {}}}),
+            cluster_status,
+            self.__side_effect_index_version(LOCAL_URL),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_previous_backup(check_backup_status_url),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_backup_done(check_backup_status_url),
+        ])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+        os.listdir = MagicMock(side_effect=[[], [timestamp]])
+        os.path.isdir = MagicMock(return_value=True)
+        os.path.getsize = MagicMock(return_value=1234)
+        shutil.rmtree = MagicMock(return_value=0)
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+
+        called_urls = list(map(lambda call_args: call_args[0][0], http_mock.call_args_list))
+        self.assertNotIn(follower_core_name, ' '.join(called_urls))
+        self.__s3_mock.upload_file.assert_called_once_with(
+            BACKUP_ROOT_DIR + timestamp + '/backup_' + timestamp + '_' + TEST_COLLECTION + '_' + TEST_SHARD +
+            '.tar.gz', S3_BUCKET, timestamp + '/backup_' + timestamp + '_' + TEST_COLLECTION + '_' + TEST_SHARD +
+            '.tar.gz')
+
+    def test_should_back_up_planned_generation_of_coordinated_backup(self):
+        entry = self.__test_coordinated_backup(['segments_2', '_0.cfs'])
+
+        self.assertDictEqual(entry['coordination'], {'coordinator': entry['node'], 'consistent': True,
+                                                     'generations': {self.__get_core_name(TEST_SHARD): 2}})
+
+    def test_should_mark_coordinated_backup_with_newer_commit_as_inconsistent(self):
+        entry = self.__test_coordinated_backup(['segments_a', '_0.cfs', '_1.cfs'])
+
+        self.assertFalse(entry['coordination']['consistent'])
+        self.assertDictEqual(entry['coordination']['generations'], {self.__get_core_name(TEST_SHARD): 10})
+
+    def test_should_fail_coordinated_backup_with_newer_commit_if_consistency_is_required(self):
+        self.assertIsNone(self.__test_coordinated_backup(['segments_a', '_0.cfs', '_1.cfs'], require_consistent=True))
+
+    def test_should_link_planned_generation_of_coordinated_hardlink_backup(self):
+        entry = self.__test_coordinated_backup(['segments_2', '_0.cfs'], hardlink=True)
+
+        self.assertTrue(entry['coordination']['consistent'])
+
+    def __test_coordinated_backup(self, snapshot_files: list, hardlink=False, require_consistent=False):
+        local_core_name = self.__get_core_name(TEST_SHARD)
+        remote_core_name = TEST_COLLECTION + '_shard2_' + TEST_REPLICA_1
+        local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
+        check_backup_status_url = LOCAL_URL + '/' + local_core_name + '/replication?command=details&wt=json'
+        cluster_status = {'cluster': {'live_nodes': [LOCAL_NODE, REMOTE_NODE], 'collections': {TEST_COLLECTION: {
+            'shards': {
+                TEST_SHARD: {'state': 'active', 'replicas': {'core_node1': {
+                    'core': local_core_name, 'base_url': LOCAL_URL, 'node_name': LOCAL_NODE, 'state': 'active',
+                    'leader': 'true'}}},
+                'shard2': {'state': 'active', 'replicas': {'core_node2': {
+                    'core': remote_core_name, 'base_url': REMOTE_URL, 'node_name': REMOTE_NODE, 'state': 'active',
+                    'leader': 'true'}}}}}}}}
+
+        file_list_url = LOCAL_URL + '/' + local_core_name + '/replication?command=filelist&generation=2&wt=json'
+        http_responses = [
+            self.__side_effect_json(CLUSTER_STATUS_URL, cluster_status),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_index_version(LOCAL_URL, generation=2),
+            self.__side_effect_index_version(REMOTE_URL, generation=5),
+            self.__side_effect_json(local_cores_url, {'status': {local_core_name: {}}}),
+        ]
+        if hardlink:
+            # The planned commit point is linked, whatever the current generation of the core is
+            http_responses += [
+                self.__side_effect_json(check_backup_status_url, {'details': {'indexPath': '/index'}}),
+                self.__side_effect_json(file_list_url, {'filelist': [{'name': file_name, 'size': 1234}
+                                                                     for file_name in snapshot_files]}),
+            ]
+            os.link = MagicMock()
+            os.makedirs = MagicMock()
+            subprocess.Popen = MagicMock()
+            subprocess.Popen.return_value.wait.return_value = 0
+            self.__backup_controller.set_hardlink_snapshots(True)
+        else:
+            http_responses += [
+                self.__side_effect_previous_backup(check_backup_status_url),
+                self.__side_effect_all_ok(LOCAL_URL),
+                self.__side_effect_backup_done(check_backup_status_url),
+            ]
+        http_mock = MagicMock(side_effect=http_responses)
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+        # The coordinator lock is free and no plan exists, so this node creates the plan
+        self.__backup_controller.set_coordinator(MagicMock(get_plan=lambda create_plan: create_plan()),
+                                                 require_consistent)
+        os.listdir = MagicMock(side_effect=lambda path: [] if path == BACKUP_ROOT_DIR else snapshot_files)
+        os.path.isdir = MagicMock(return_value=True)
+        os.path.getsize = MagicMock(return_value=1234)
+        shutil.rmtree = MagicMock(return_value=0)
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+
+        if require_consistent:
+            self.assertFalse(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+            self.__s3_mock.upload_file.assert_not_called()
+            self.__s3_mock.put_bytes.assert_not_called()
+            return None
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+
+        called_urls = list(map(lambda call_args: call_args[0][0], http_mock.call_args_list))
+        self.assertListEqual(called_urls[:4], [
+            CLUSTER_STATUS_URL,
+            LOCAL_URL + '/' + TEST_COLLECTION + '/update?commit=true&wt=json',
+            LOCAL_URL + '/' + local_core_name + '/replication?command=indexversion&wt=json',
+            REMOTE_URL + '/' + remote_core_name + '/replication?command=indexversion&wt=json'])
+        self.assertNotIn(REMOTE_URL + '/' + remote_core_name + '/replication?command=backup', ' '.join(called_urls))
+        if hardlink:
+            self.assertEqual(called_urls[-1], file_list_url)
+            self.__s3_mock.upload_stream.assert_called_once()
+        else:
+            self.__s3_mock.upload_file.assert_called_once()
+        data, bucket, key = self.__s3_mock.put_bytes.call_args_list[0][0]
+        entry = backup_catalog.loads(data, key)
+        self.assertEqual(key, backup_catalog.get_entry_key(entry['timestamp'], entry['node']))
+        return entry
+
+    def test_should_fail_backup_whose_snapshot_never_starts(self):
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+        os.listdir = MagicMock(side_effect=[[], [timestamp]])
+        os.path.isdir = MagicMock(return_value=True)
+        shutil.rmtree = MagicMock(return_value=0)
+
+        check_backup_status_url = LOCAL_URL + '/' + TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1 +\
+            '/replication?command=details&wt=json'
+        http_mock = MagicMock(side_effect=[
+            self.__side_effect_local_cores(LOCAL_URL),
+            solr_client.SolrError('Solr is not running in cloud mode'),
+            self.__side_effect_index_version(LOCAL_URL),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_previous_backup(check_backup_status_url),
+            # The backup command timed out
+            None,
+            self.__side_effect_previous_backup(check_backup_status_url),
+        ])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+
+        self.assertFalse(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+        self.assertEqual(http_mock.call_count, 7)
+        self.__s3_mock.upload_file.assert_not_called()
+
+    def test_should_report_failure_of_shard_upload(self):
+        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
+        os.listdir = MagicMock(side_effect=[[], [timestamp]])
+        os.path.isdir = MagicMock(return_value=True)
+        shutil.rmtree = MagicMock(return_value=0)
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+        self.__s3_mock.upload_file.side_effect = s3_transfer.S3TransferError('Uploading failed')
+
+        check_backup_status_url = LOCAL_URL + '/' + TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1 +\
+            '/replication?command=details&wt=json'
+        http_mock = MagicMock(side_effect=[
+            self.__side_effect_local_cores(LOCAL_URL),
+            solr_client.SolrError('Solr is not running in cloud mode'),
+            self.__side_effect_index_version(LOCAL_URL),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_previous_backup(check_backup_status_url),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_backup_done(check_backup_status_url),
+        ])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+
+        self.assertFalse(self.__backup_controller.create_backup(bucket=S3_BUCKET))
+        self.__s3_mock.upload_file.assert_called_once()
+        # No catalog entry is written for an incomplete backup
+        self.__s3_mock.put_bytes.assert_not_called()
+
+    def test_should_resume_interrupted_backup_with_uploads_only(self):
+        timestamp = '201605010100'
+        journal, first_run_responses = self.__interrupt_backup(timestamp)
+
+        # The next run of the same backup ID keeps the snapshot and the tarball of the interrupted run
+        os.listdir = MagicMock(side_effect=[[timestamp], [timestamp]])
+        http_mock = MagicMock(side_effect=first_run_responses[:4])
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET, backup_id=timestamp))
+        self.assertEqual(http_mock.call_count, 4)
+        self.__subprocess_mock.assert_not_called()
+        backup_file_name = 'backup_' + timestamp + '_' + TEST_COLLECTION + '_' + TEST_SHARD + '.tar.gz'
+        self.__s3_mock.upload_file.assert_called_once_with(BACKUP_ROOT_DIR + timestamp + '/' + backup_file_name,
+                                                           S3_BUCKET, timestamp + '/' + backup_file_name)
+        entry = json.loads(self.__s3_mock.put_bytes.call_args_list[0][0][0].decode('utf-8'))
+        self.assertEqual(entry['timestamp'], timestamp)
+        self.assertEqual(entry['shards'][TEST_COLLECTION + '_' + TEST_SHARD]['sha256'], NEW_SHA256)
+        self.assertEqual(journal.get_unfinished_run(transfer_journal.RUN_BACKUP), (None, None))
+
+    def test_should_discard_interrupted_backup_of_another_backup_id(self):
+        journal, first_run_responses = self.__interrupt_backup('201605010100')
+
+        # The next scheduled run must not store its shards under the backup ID of the interrupted run
+        os.listdir = MagicMock(side_effect=[['201605010100'], ['201605010200']])
+        self.__backup_controller.set_http_client(MagicMock(get_json=MagicMock(side_effect=first_run_responses)))
+
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET, backup_id='201605010200'))
+        shutil.rmtree.assert_any_call(BACKUP_ROOT_DIR + '201605010100')
+        self.__subprocess_mock.assert_called()
+        entry = json.loads(self.__s3_mock.put_bytes.call_args_list[0][0][0].decode('utf-8'))
+        self.assertEqual(entry['timestamp'], '201605010200')
+        self.assertEqual(journal.get_unfinished_run(transfer_journal.RUN_BACKUP), (None, None))
+        self.__s3_mock.discard_transfers.assert_called_once_with(transfer_journal.UPLOAD)
+
+    def __interrupt_backup(self, timestamp: str):
+        """Runs a backup whose upload fails and returns the journal and the Solr responses of the run."""
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        journal = transfer_journal.TransferJournal(os.path.join(journal_dir, 'journal.db'))
+        self.addCleanup(journal.close)
+        self.__backup_controller.set_journal(journal)
+        os.path.isdir = MagicMock(return_value=True)
+        os.path.isfile = MagicMock(return_value=True)
+        os.path.getsize = MagicMock(return_value=1234)
+        shutil.rmtree = MagicMock(return_value=0)
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+        self.__subprocess_mock.reset_mock()
+
+        core_name = self.__get_core_name(TEST_SHARD)
+        check_backup_status_url = LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
+        first_run_responses = [
+            self.__side_effect_local_cores(LOCAL_URL),
+            solr_client.SolrError('Solr is not running in cloud mode'),
+            self.__side_effect_index_version(LOCAL_URL),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_previous_backup(check_backup_status_url),
+            self.__side_effect_all_ok(LOCAL_URL),
+            self.__side_effect_backup_done(check_backup_status_url),
+        ]
+        os.listdir = MagicMock(side_effect=[[]])
+        self.__s3_mock.upload_file.side_effect = s3_transfer.S3TransferError('Uploading failed')
+        self.__backup_controller.set_http_client(MagicMock(get_json=MagicMock(side_effect=first_run_responses)))
+
+        self.assertFalse(self.__backup_controller.create_backup(bucket=S3_BUCKET, backup_id=timestamp))
+        self.assertEqual(journal.get_unfinished_run(transfer_journal.RUN_BACKUP)[0], timestamp)
+        self.__s3_mock.put_bytes.assert_not_called()
+        self.__s3_mock.upload_file.side_effect = None
+        self.__s3_mock.upload_file.reset_mock()
+        self.__subprocess_mock.reset_mock()
+        return journal, first_run_responses
+
+    def __test_and_verify_backup_creation(self, collection: str, shard: str, cores_func, stream=False,
+                                          incremental=False, hardlink=False):
         timestamp = datetime.utcnow().strftime('%Y%m%d%H%M')
         backup_dir = BACKUP_ROOT_DIR + timestamp
+        snapshot_root = (SNAPSHOT_ROOT_DIR if hardlink else BACKUP_ROOT_DIR) + timestamp
         normalized_shard = self.__normalize_split_shard(shard)
 
         if shard != '':
@@ -142,11 +682,9 @@ class TestBackupController(TestCase):
 
         backup_file_name = 'backup_' + timestamp + '_' + normalized_backup_name + '.tar.gz'
         normalized_snapshot_dir = 'snapshot.' + normalized_backup_name
-        snapshot_dir = 'snapshot.' + backup_name
 
         dir_lists = [
             [],              # backup dir before start of backup
-            [snapshot_dir],  # snapshot dirs for zipping and uploading to S3
             [timestamp]      # backup dir for clean up
         ]
         os.listdir = MagicMock(side_effect=dir_lists)
@@ -160,51 +698,194 @@ class TestBackupController(TestCase):
 
         local_cores_url = LOCAL_URL + '/admin/cores?action=STATUS&wt=json'
         trigger_commit_url = LOCAL_URL + '/' + collection + '/update?commit=true&wt=json'
+        index_version_url = LOCAL_URL + '/' + core_name + '/replication?command=indexversion&wt=json'
         trigger_backup_url = LOCAL_URL + '/' + core_name + '/replication?command=backup&wt=json&location='\
             + backup_dir + '&name=' + backup_name
         check_backup_status_url = LOCAL_URL + '/' + core_name + '/replication?command=details&wt=json'
+        file_list_url = LOCAL_URL + '/' + core_name + '/replication?command=filelist&generation=1&wt=json'
+        index_path = DATA_DIR + core_name + '/data/index'
+        index_files = ['_0.cfs', '_0.si', 'segments_1']
+
+        if shard != '':
+            cluster_status = self.__side_effect_cluster_status(CLUSTER_STATUS_URL, [core_name])
+        else:
+            # A single core setup does not run in cloud mode
+            cluster_status = solr_client.SolrError('Solr is not running in cloud mode')
 
         http_responses = [
-            cores_func(urllib.request.Request(local_cores_url)),
-            self.__side_effect_all_ok(urllib.request.Request(trigger_commit_url)),
-            cores_func(urllib.request.Request(local_cores_url)),
-            self.__side_effect_all_ok(urllib.request.Request(trigger_backup_url)),
-            self.__side_effect_backup_in_progress(urllib.request.Request(check_backup_status_url)),
-            self.__side_effect_backup_done(urllib.request.Request(check_backup_status_url)),
+            cores_func(local_cores_url),
+            cluster_status,
+            self.__side_effect_index_version(index_version_url),
+            self.__side_effect_all_ok(trigger_commit_url),
         ]
+        if hardlink:
+            http_responses += [
+                self.__side_effect_json(check_backup_status_url, {'details': {'indexPath': index_path}}),
+                self.__side_effect_index_version(index_version_url),
+                self.__side_effect_json(file_list_url, {'filelist': [{'name': file_name, 'size': 1234}
+                                                                     for file_name in index_files]}),
+            ]
+        else:
+            http_responses += [
+                self.__side_effect_previous_backup(check_backup_status_url),
+                self.__side_effect_all_ok(trigger_backup_url),
+                self.__side_effect_backup_in_progress(check_backup_status_url),
+                self.__side_effect_backup_done(check_backup_status_url),
+            ]
         http_mock = MagicMock(side_effect=http_responses)
-        urllib.request.urlopen = http_mock
-
-        self.__backup_controller.create_backup(bucket=S3_BUCKET)
+        self.__backup_controller.set_http_client(MagicMock(get_json=http_mock))
+
+        popen_mock = MagicMock()
+        popen_mock.return_value.wait.return_value = 0
+        subprocess.Popen = popen_mock
+        self.__subprocess_mock.reset_mock()
+
+        manifest = {'version': 1, 'snapshot': normalized_snapshot_dir, 'files': [
+            {'name': '_0.fdt', 'size': 10, 'sha256': STORED_SHA256},
+            {'name': '_1.fdt', 'size': 20, 'sha256': NEW_SHA256},
+        ]}
+        content_store.create_manifest = MagicMock(return_value=manifest)
+        content_store.write_manifest = MagicMock()
+        self.__s3_mock.list_keys.return_value = [content_store.get_object_key(STORED_SHA256)]
+        content_store.hash_file = MagicMock(return_value=NEW_SHA256)
+        os.path.getsize = MagicMock(return_value=1234)
+        os_link_mock = MagicMock()
+        os.link = os_link_mock
+        os_makedirs_mock = MagicMock()
+        os.makedirs = os_makedirs_mock
+
+        if stream:
+            self.__backup_controller.set_stream_to_s3(True)
+        self.__backup_controller.set_hardlink_snapshots(hardlink)
+        self.__backup_controller.set_incremental(incremental)
+        self.assertTrue(self.__backup_controller.create_backup(bucket=S3_BUCKET))
 
         # Verify HTTP requests
-        called_urls = list(map(lambda call_args: call_args[0][0].get_full_url(), http_mock.call_args_list))
+        called_urls = list(map(lambda call_args: call_args[0][0], http_mock.call_args_list))
         expected_urls = [
             local_cores_url,
+            CLUSTER_STATUS_URL,
+            index_version_url,
             trigger_commit_url,
-            local_cores_url,
-            trigger_backup_url,
-            check_backup_status_url,
-            check_backup_status_url
         ]
+        if hardlink:
+            expected_urls += [check_backup_status_url, index_version_url, file_list_url]
+        else:
+            expected_urls += [check_backup_status_url, trigger_backup_url, check_backup_status_url,
+                              check_backup_status_url]
         self.assertListEqual(called_urls, expected_urls)
 
+        if hardlink:
+            # Verify that the files of the reserved commit point are linked into the snapshot on the data volume
+            linked_snapshot_dir = snapshot_root + '/snapshot.' + backup_name
+            os_makedirs_mock.assert_called_once_with(linked_snapshot_dir)
+            self.assertListEqual([call_args[0] for call_args in os_link_mock.call_args_list],
+                                 [(index_path + '/' + file_name, linked_snapshot_dir + '/' + file_name)
+                                  for file_name in index_files])
+        else:
+            os_link_mock.assert_not_called()
+
         # Verify that snapshot directory was renamed
         if shard != normalized_shard:
-            split_snapshot_dir_name = backup_dir + '/snapshot.' + backup_name
-            normalized_snapshot_dir_name = backup_dir + '/snapshot.' + normalized_backup_name
+            split_snapshot_dir_name = snapshot_root + '/snapshot.' + backup_name
+            normalized_snapshot_dir_name = snapshot_root + '/snapshot.' + normalized_backup_name
             os_rename_mock.assert_called_once_with(split_snapshot_dir_name, normalized_snapshot_dir_name)
 
-        # Verify that backup tarball is zipped
-        self.__subprocess_mock.assert_any_call(['tar', '-czf', backup_dir + '/' + backup_file_name, '-C',
-                                                backup_dir, normalized_snapshot_dir])
-
-        # Verify that backup tarball is uploaded
-        s3_url = 's3://' + S3_BUCKET + '/' + timestamp + '/'
-        self.__subprocess_mock.assert_any_call(['aws', 's3', 'cp', backup_dir + '/' + backup_file_name, s3_url])
+        if incremental:
+            # Verify that only files which are not stored yet are uploaded, followed by the manifest
+            manifest_file_name = backup_dir + '/manifest_' + timestamp + '_' + normalized_backup_name + '.json'
+            self.__s3_mock.list_keys.assert_any_call(S3_BUCKET, content_store.OBJECTS_PREFIX + '/')
+            uploads = list(map(lambda call_args: call_args[0], self.__s3_mock.upload_file.call_args_list))
+            self.assertListEqual(uploads, [
+                (backup_dir + '/' + normalized_snapshot_dir + '/_1.fdt', S3_BUCKET,
+                 content_store.get_object_key(NEW_SHA256)),
+                (manifest_file_name, S3_BUCKET, timestamp + '/manifest_' + timestamp + '_' + normalized_backup_name +
+                 '.json')
+            ])
+            content_store.write_manifest.assert_called_once_with(manifest, manifest_file_name)
+        elif stream or hardlink:
+            # Verify that the snapshot is tarred into a pipe which is uploaded while it is produced
+            popen_mock.assert_called_once_with(['tar', '-czf', '-', '-C', snapshot_root, normalized_snapshot_dir],
+                                               stdout=subprocess.PIPE)
+            self.assertListEqual(list(self.__s3_mock.upload_stream.call_args[0][1:]),
+                                 [S3_BUCKET, timestamp + '/' + backup_file_name, 0])
+            self.assertIsInstance(self.__s3_mock.upload_stream.call_args[0][0], backup_catalog.StreamChecksum)
+
+            # Verify that no tarball is staged in the backup directory
+            self.__subprocess_mock.assert_not_called()
+        else:
+            # Verify that backup tarball is zipped
+            self.__subprocess_mock.assert_any_call(['tar', '-czf', backup_dir + '/' + backup_file_name, '-C',
+                                                    backup_dir, normalized_snapshot_dir])
+
+            # Verify that backup tarball is uploaded
+            self.__s3_mock.upload_file.assert_called_once_with(backup_dir + '/' + backup_file_name, S3_BUCKET,
+                                                               timestamp + '/' + backup_file_name)
+
+        # Verify that the catalog entry is written before the pointer to the latest backup
+        catalog_writes = list(map(lambda call_args: call_args[0], self.__s3_mock.put_bytes.call_args_list))
+        self.assertEqual(len(catalog_writes), 2)
+        entry_data, entry_bucket, entry_key = catalog_writes[0]
+        self.assertEqual(entry_bucket, S3_BUCKET)
+        self.assertTrue(entry_key.startswith('catalog/' + timestamp + '/'))
+        entry = json.loads(entry_data.decode('utf-8'))
+        self.assertTrue(entry['complete'])
+        self.assertListEqual(entry['collections'], [collection])
+        self.assertListEqual(list(entry['shards']), [normalized_backup_name])
+        self.assertEqual(catalog_writes[1][2], backup_catalog.LATEST_KEY)
+        latest = json.loads(catalog_writes[1][0].decode('utf-8'))
+        self.assertEqual((latest['timestamp'], latest['entry']), (timestamp, entry_key))
 
         # Verify that backup directory is cleaned up afterwards
-        shutil_rmtree_mock.assert_called_once_with(backup_dir)
+        if hardlink:
+            # The links of the snapshot are released as soon as it is uploaded
+            self.assertListEqual([call_args[0][0] for call_args in shutil_rmtree_mock.call_args_list],
+                                 [snapshot_root + '/' + normalized_snapshot_dir, backup_dir, SNAPSHOT_ROOT_DIR])
+        else:
+            shutil_rmtree_mock.assert_called_once_with(backup_dir)
+
+    def test_should_resolve_latest_backup_from_catalog(self):
+        self.__set_catalog('201605020100', {'node1': ['shard1'], 'node2': ['shard2']})
+
+        self.assertEqual(self.__backup_controller.get_latest_backup(S3_BUCKET), '201605020100')
+        self.__s3_mock.get_bytes.assert_any_call(S3_BUCKET, backup_catalog.LATEST_KEY)
+        self.__s3_mock.list_prefixes.assert_not_called()
+
+    def test_should_skip_latest_backup_of_unfinished_node(self):
+        # node2 has not stored its shard of the newest backup yet
+        self.__set_catalog('201605020100', {'node1': ['shard1'], 'node2': []},
+                           {'201605010100': {'node1': ['shard1'], 'node2': ['shard2']}})
+
+        self.assertEqual(self.__backup_controller.get_latest_backup(S3_BUCKET), '201605010100')
+        self.__s3_mock.list_prefixes.assert_called_once_with(S3_BUCKET, backup_catalog.CATALOG_PREFIX + '/')
+
+    def __set_catalog(self, latest_timestamp: str, latest_nodes: dict, older_backups: dict = None):
+        """Stores catalog entries of nodes with the shard names they stored, each expects the shards of all nodes."""
+        backups = dict(older_backups or {}, **{latest_timestamp: latest_nodes})
+        objects = {backup_catalog.LATEST_KEY: backup_catalog.dumps({
+            'version': backup_catalog.CATALOG_VERSION, 'timestamp': latest_timestamp,
+            'entry': backup_catalog.get_entry_key(latest_timestamp, 'node1'), 'finished': '2016-05-02T01:10:00Z'})}
+        for timestamp, nodes in backups.items():
+            expected_shards = [TEST_COLLECTION + '_shard' + str(i + 1) for i in range(len(nodes))]
+            for node_name, shard_names in nodes.items():
+                shards = {TEST_COLLECTION + '_' + shard_name: backup_catalog.create_shard(
+                    timestamp + '/backup_' + shard_name + '.tar.gz', 10, 'a' * 64) for shard_name in shard_names}
+                objects[backup_catalog.get_entry_key(timestamp, node_name)] = backup_catalog.dumps(
+                    backup_catalog.create_entry(timestamp, node_name, 'archive', shards, None, expected_shards))
+        self.__s3_mock.get_bytes.side_effect = lambda bucket, key: objects.get(key)
+        self.__s3_mock.list_keys.side_effect = lambda bucket, prefix: sorted(key for key in objects
+                                                                             if key.startswith(prefix))
+        self.__s3_mock.list_prefixes.return_value = [backup_catalog.get_entry_prefix(timestamp)
+                                                     for timestamp in backups]
+
+    def test_should_resolve_latest_backup_of_bucket_without_catalog(self):
+        self.__s3_mock.list_prefixes.return_value = ['201605010100/', '201605020100/', 'catalog/', 'objects/']
+
+        self.assertEqual(self.__backup_controller.get_latest_backup(S3_BUCKET), '201605020100')
+
+    @staticmethod
+    def __get_core_name(shard: str):
+        return TEST_COLLECTION + '_' + shard + '_' + TEST_REPLICA_1
 
     def __normalize_split_shard(self, shard: str):
             if len(shard.split('_')) > 1:
@@ -213,65 +894,47 @@ class TestBackupController(TestCase):
                 return shard
 
     def __side_effect_all_ok(self, value):
+        return self.__side_effect_json(value, {'responseHeader': {'status': 0}})
+
+    def __side_effect_json(self, value, content: dict):
         self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        return response_mock
+        return content
+
+    def __side_effect_cluster_status(self, value, leader_core_names: list):
+        shards = {}
+        for i, core_name in enumerate(leader_core_names):
+            shard_name = core_name[len(TEST_COLLECTION) + 1:core_name.rindex('_')]
+            shards[shard_name] = {'state': 'active', 'replicas': {'core_node{}'.format(i): {
+                'core': core_name, 'node_name': LOCAL_NODE, 'state': 'active', 'leader': 'true'}}}
+        return self.__side_effect_json(value, {'cluster': {'collections': {TEST_COLLECTION: {'shards': shards}},
+                                                           'live_nodes': [LOCAL_NODE]}})
+
+    def __side_effect_index_version(self, value, generation=1):
+        return self.__side_effect_json(value, {'indexversion': 1462064400000, 'generation': generation})
+
+    def __side_effect_previous_backup(self, value):
+        return self.__side_effect_json(value, {"details": {"backup": ["", "", "", "", "", "success", "",
+                                                                      "Sun May 01 01:00:00"]}})
 
     def __side_effect_backup_in_progress(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"details": {"backup": ["", "", "", "", "", "In Progress"]}}), 'utf-8')
-        return response_mock
+        return self.__side_effect_json(value, {"details": {"backup": ["", "", "", "", "", "In Progress"]}})
 
     def __side_effect_backup_done(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"details": {"backup": ["", "", "", "", "", "success"]}}), 'utf-8')
-        return response_mock
+        return self.__side_effect_json(value, {"details": {"backup": ["", "", "", "", "", "success"]}})
 
     def __side_effect_restore_in_progress(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"restorestatus": {"status": "In Progress"}}), 'utf-8')
-        return response_mock
+        return self.__side_effect_json(value, {"restorestatus": {"status": "In Progress"}})
 
     def __side_effect_restore_done(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"restorestatus": {"status": "success"}}), 'utf-8')
-        return response_mock
+        return self.__side_effect_json(value, {"restorestatus": {"status": "success"}})
 
     def __side_effect_local_cores(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"status": {TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1: {}}}), 'utf-8')
-        return response_mock
+        return self.__side_effect_json(value,
+                                       {"status": {TEST_COLLECTION + '_' + TEST_SHARD + '_' + TEST_REPLICA_1: {}}})
 
     def __side_effect_local_split_cores(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"status": {TEST_COLLECTION + '_' + TEST_SPLIT_SHARD + '_' + TEST_REPLICA_1: {}}}),
-                  'utf-8')
-        return response_mock
+        split_core_name = TEST_COLLECTION + '_' + TEST_SPLIT_SHARD + '_' + TEST_REPLICA_1
+        return self.__side_effect_json(value, {"status": {split_core_name: {}}})
 
     def __side_effect_local_single_cores(self, value):
-        self.assertIsNotNone(value)
-        response_mock = MagicMock()
-        response_mock.getcode.return_value = HTTP_CODE_OK
-        response_mock.read.return_value = \
-            bytes(json.dumps({"status": {TEST_COLLECTION: {}}}),
-                  'utf-8')
-        return response_mock
+        return self.__side_effect_json(value, {"status": {TEST_COLLECTION: {}}})
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import throttle
+
+import io
+
+MB = throttle.MB
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestThrottle(TestCase):
+
+    def setUp(self):
+        self.__clock = FakeClock()
+        self.__p99 = [None]
+
+    def __create_throttle(self, max_parallelism=8):
+        return throttle.AdaptiveThrottle(lambda: self.__p99[0], 100, max_parallelism, max_read_rate=100 * MB,
+                                         min_read_rate=10 * MB, clock=self.__clock.time, sleep=self.__clock.sleep)
+
+    def test_should_decrease_multiplicatively_and_increase_additively(self):
+        adaptive_throttle = self.__create_throttle()
+        self.assertEqual(adaptive_throttle.get_read_rate(), 50 * MB)
+        self.assertEqual(adaptive_throttle.get_parallelism(), 4)
+
+        self.__p99[0] = 250
+        self.assertEqual(adaptive_throttle.adjust().action, throttle.ACTION_DECREASE)
+        self.assertEqual((adaptive_throttle.get_read_rate(), adaptive_throttle.get_parallelism()), (25 * MB, 2))
+        adaptive_throttle.adjust()
+        adaptive_throttle.adjust()
+        # Neither limit drops below its minimum
+        self.assertEqual((adaptive_throttle.get_read_rate(), adaptive_throttle.get_parallelism()), (10 * MB, 1))
+
+        self.__p99[0] = 90
+        self.assertEqual(adaptive_throttle.adjust().action, throttle.ACTION_HOLD)
+        self.__p99[0] = None
+        self.assertEqual(adaptive_throttle.adjust().action, throttle.ACTION_HOLD)
+
+        self.__p99[0] = 20
+        decision = adaptive_throttle.adjust()
+        self.assertEqual(decision.action, throttle.ACTION_INCREASE)
+        self.assertEqual((decision.read_rate, decision.parallelism), (20 * MB, 2))
+        for _ in range(20):
+            adaptive_throttle.adjust()
+        self.assertEqual((adaptive_throttle.get_read_rate(), adaptive_throttle.get_parallelism()), (100 * MB, 8))
+
+        decisions = adaptive_throttle.get_decisions()
+        self.assertEqual(len(decisions), 26)
+        self.assertTrue(all(decision.timestamp.endswith('Z') for decision in decisions))
+
+    def test_should_hold_if_p99_cannot_be_sampled(self):
+        def fail():
+            raise Exception('Solr is not reachable')
+
+        adaptive_throttle = throttle.AdaptiveThrottle(fail, 100, 4)
+        self.assertEqual(adaptive_throttle.adjust().action, throttle.ACTION_HOLD)
+
+    def test_should_limit_read_rate(self):
+        adaptive_throttle = self.__create_throttle()
+        reader = throttle.ThrottledReader(io.BytesIO(b'x' * 100 * MB), adaptive_throttle)
+        while reader.read(MB):
+            pass
+
+        # 100 MB at 50 MB/s
+        self.assertAlmostEqual(self.__clock.now, 2.0, places=3)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from scripts import transfer_journal
+
+import os
+import shutil
+import tempfile
+
+
+class TestTransferJournal(TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__journal = transfer_journal.TransferJournal(os.path.join(self.__directory, 'journal.db'))
+
+    def tearDown(self):
+        self.__journal.close()
+        shutil.rmtree(self.__directory)
+
+    def test_should_keep_progress_of_unfinished_run(self):
+        self.__journal.start_run(transfer_journal.RUN_BACKUP, '201605010100')
+        self.__journal.set_shard(transfer_journal.RUN_BACKUP, '201605010100', 'test_shard1',
+                                 transfer_journal.SHARD_STORED, {'size': 10})
+        self.__journal.close()
+
+        # The journal of the next run reads the progress from disk
+        self.__journal = transfer_journal.TransferJournal(os.path.join(self.__directory, 'journal.db'))
+        self.assertEqual(self.__journal.get_unfinished_run(transfer_journal.RUN_BACKUP)[0], '201605010100')
+        self.assertEqual(self.__journal.get_unfinished_run(transfer_journal.RUN_RESTORE), (None, None))
+        self.assertEqual(self.__journal.get_shard(transfer_journal.RUN_BACKUP, '201605010100', 'test_shard1'),
+                         (transfer_journal.SHARD_STORED, {'size': 10}))
+
+    def test_should_discard_progress_of_finished_or_replaced_run(self):
+        self.__journal.start_run(transfer_journal.RUN_BACKUP, '201605010100')
+        self.__journal.set_shard(transfer_journal.RUN_BACKUP, '201605010100', 'test_shard1',
+                                 transfer_journal.SHARD_SNAPSHOT)
+
+        self.__journal.start_run(transfer_journal.RUN_BACKUP, '201605010200')
+        self.assertEqual(self.__journal.get_shard(transfer_journal.RUN_BACKUP, '201605010100', 'test_shard1'),
+                         (None, None))
+
+        self.__journal.finish_run(transfer_journal.RUN_BACKUP, '201605010200')
+        self.assertEqual(self.__journal.get_unfinished_run(transfer_journal.RUN_BACKUP), (None, None))
+
+    def test_should_allow_one_run_of_each_kind_at_a_time(self):
+        other = transfer_journal.TransferJournal(os.path.join(self.__directory, 'journal.db'))
+        self.addCleanup(other.close)
+        self.__journal.acquire(transfer_journal.RUN_BACKUP)
+        with self.assertRaises(transfer_journal.JournalLocked):
+            other.acquire(transfer_journal.RUN_BACKUP)
+        # A restore does not wait for the backup job
+        other.acquire(transfer_journal.RUN_RESTORE)
+        other.release(transfer_journal.RUN_RESTORE)
+
+        self.__journal.release(transfer_journal.RUN_BACKUP)
+        other.acquire(transfer_journal.RUN_BACKUP)
+        other.release(transfer_journal.RUN_BACKUP)
+
+    def test_should_create_directory_of_journal_or_run_without_it(self):
+        journal = transfer_journal.open_journal(os.path.join(self.__directory, 'data', 'journal.db'))
+        self.assertIsNotNone(journal)
+        journal.close()
+
+        blocking_file = os.path.join(self.__directory, 'file')
+        open(blocking_file, 'w').close()
+        self.assertIsNone(transfer_journal.open_journal(os.path.join(blocking_file, 'journal.db')))
+
+    def test_should_restart_parts_of_changed_transfer(self):
+        transfer = transfer_journal.Transfer('/backup/a.tar.gz', 100, '1462064400', 10, 'upload1')
+        self.__journal.start_transfer(transfer_journal.UPLOAD, 'bucket', 'key', transfer)
+        self.__journal.add_part(transfer_journal.UPLOAD, 'bucket', 'key', 1, 'a' * 32)
+
+        journaled = self.__journal.get_transfer(transfer_journal.UPLOAD, 'bucket', 'key')
+        self.assertTrue(transfer.matches(journaled))
+        self.assertEqual(journaled.upload_id, 'upload1')
+        self.assertDictEqual(self.__journal.get_parts(transfer_journal.UPLOAD, 'bucket', 'key'), {1: 'a' * 32})
+
+        changed = transfer_journal.Transfer('/backup/a.tar.gz', 100, '1462064500', 10, 'upload2')
+        self.assertFalse(changed.matches(journaled))
+        self.__journal.start_transfer(transfer_journal.UPLOAD, 'bucket', 'key', changed)
+        self.assertDictEqual(self.__journal.get_parts(transfer_journal.UPLOAD, 'bucket', 'key'), {})
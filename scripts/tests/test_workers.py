@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from threading import Event, Lock, Timer
+from unittest import TestCase
+from scripts import workers
+
+import time
+
+POOL_SIZE = 2
+
+
+class TestWorkers(TestCase):
+
+    def test_should_report_failed_tasks(self):
+        pool = workers.TaskPool('test', POOL_SIZE)
+        pool.submit('ok', lambda: None)
+        pool.submit('broken', self.__fail, 'disk full')
+
+        with self.assertRaises(workers.TaskFailure) as context:
+            pool.wait()
+        self.assertEqual(len(context.exception.failures), 1)
+        self.assertEqual(context.exception.failures[0][0], 'broken')
+
+    def test_should_block_submit_while_pool_is_full(self):
+        pool = workers.TaskPool('test', 1)
+        release = Event()
+        pool.submit('blocking', release.wait)
+
+        started = time.time()
+        time_to_release = 0.2
+        Timer(time_to_release, release.set).start()
+        pool.submit('next', lambda: None)
+        pool.wait()
+
+        self.assertGreaterEqual(time.time() - started, time_to_release)
+
+    def test_should_limit_concurrent_resource_usage(self):
+        limits = workers.ResourceLimits({workers.RESOURCE_NETWORK: 2})
+        pool = workers.TaskPool('test', 6)
+        lock = Lock()
+        usage = {'current': 0, 'max': 0}
+
+        def transfer():
+            with limits.acquire(workers.RESOURCE_CPU, workers.RESOURCE_NETWORK):
+                with lock:
+                    usage['current'] += 1
+                    usage['max'] = max(usage['max'], usage['current'])
+                time.sleep(0.05)
+                with lock:
+                    usage['current'] -= 1
+
+        for i in range(6):
+            pool.submit('transfer {}'.format(i), transfer)
+        pool.wait()
+
+        self.assertEqual(usage['max'], min(2, limits.get_limit(workers.RESOURCE_CPU)))
+
+    def test_should_admit_tasks_while_free_space_covers_them(self):
+        admission = workers.DiskSpaceAdmission('/backup', headroom=10, poll_interval=0.01,
+                                               get_free_space=lambda: 100)
+        admitted = Event()
+
+        def second_task():
+            with admission.acquire('second', 50):
+                admitted.set()
+
+        with admission.acquire('first', 60):
+            self.assertEqual(admission.get_reserved(), 60)
+            waiting_task = Timer(0, second_task)
+            waiting_task.start()
+            # 60 reserved bytes and 10 bytes of headroom leave no room for 50 more
+            self.assertFalse(admitted.wait(0.1))
+        waiting_task.join()
+
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(admission.get_reserved(), 0)
+
+    def test_should_reject_task_larger_than_free_space(self):
+        admission = workers.DiskSpaceAdmission('/backup', headroom=10, get_free_space=lambda: 100)
+
+        with self.assertRaises(workers.InsufficientDiskSpace):
+            with admission.acquire('huge', 91):
+                self.fail('The task must not be admitted')
+        with admission.acquire('fitting', 90):
+            pass
+
+    def test_should_back_off_exponentially_up_to_maximum(self):
+        delays = workers.exponential_backoff(0.25, 2)
+
+        self.assertListEqual([next(delays) for _ in range(6)], [0.25, 0.5, 1, 2, 2, 2])
+
+    @staticmethod
+    def __fail(message: str):
+        raise Exception(message)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Feedback-controlled throttling of archive I/O and compression.
+
+`AdaptiveThrottle` limits the rate at which snapshot data is read into archives with a token bucket and the number of
+blocks which are compressed at the same time. A control thread samples the 99th percentile request time of the local
+Solr every interval and adjusts both limits with additive increase and multiplicative decrease: the limits are halved
+while the p99 exceeds the budget and raised step by step while it stays clearly below. Every decision is logged with
+its timestamp and kept for the summary of the run.
+"""
+
+import logging
+import time
+
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+MB = 1024 * 1024
+
+DEFAULT_MAX_READ_RATE = 200 * MB
+DEFAULT_MIN_READ_RATE = 4 * MB
+DEFAULT_INTERVAL_IN_SECONDS = 5
+# The limits are only raised while the p99 is below this share of the budget
+INCREASE_THRESHOLD = 0.8
+INCREASE_STEPS = 10
+DECREASE_FACTOR = 0.5
+
+ACTION_INCREASE = 'increase'
+ACTION_DECREASE = 'decrease'
+ACTION_HOLD = 'hold'
+
+
+class Decision:
+
+    def __init__(self, timestamp: str, p99: float, action: str, read_rate: int, parallelism: int):
+        self.timestamp = timestamp
+        self.p99 = p99
+        self.action = action
+        self.read_rate = read_rate
+        self.parallelism = parallelism
+
+
+class AdaptiveThrottle:
+
+    def __init__(self, get_p99, p99_budget: float, max_parallelism: int, max_read_rate: int = DEFAULT_MAX_READ_RATE,
+                 min_read_rate: int = DEFAULT_MIN_READ_RATE, interval: float = DEFAULT_INTERVAL_IN_SECONDS,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        `get_p99` returns the current 99th percentile request time in milliseconds or None if it is unknown,
+        `p99_budget` is the request time the backup must not push the p99 above. Rates are given in bytes per second.
+        """
+        self.__get_p99 = get_p99
+        self.__p99_budget = p99_budget
+        self.__max_parallelism = max(1, max_parallelism)
+        self.__max_read_rate = max_read_rate
+        self.__min_read_rate = min(min_read_rate, max_read_rate)
+        self.__interval = interval
+        self.__clock = clock
+        self.__sleep = sleep
+        # Start in the middle and let the feedback find the limits
+        self.__read_rate = max(self.__min_read_rate, max_read_rate // 2)
+        self.__parallelism = max(1, self.__max_parallelism // 2)
+        self.__tokens = 0.0
+        self.__last_refill = clock()
+        self.__lock = Lock()
+        self.__decisions = []
+        self.__stopped = Event()
+        self.__thread = None
+
+    def get_read_rate(self):
+        with self.__lock:
+            return self.__read_rate
+
+    def get_parallelism(self):
+        with self.__lock:
+            return self.__parallelism
+
+    def get_decisions(self):
+        with self.__lock:
+            return list(self.__decisions)
+
+    def consume(self, size: int):
+        """Blocks until `size` bytes may be read at the current read rate."""
+        with self.__lock:
+            now = self.__clock()
+            # At most one second of unused rate is saved up, so bursts stay short
+            self.__tokens = min(self.__read_rate, self.__tokens + (now - self.__last_refill) * self.__read_rate)
+            self.__last_refill = now
+            self.__tokens -= size
+            delay = -self.__tokens / self.__read_rate if self.__tokens < 0 else 0
+        if delay > 0:
+            self.__sleep(delay)
+
+    def adjust(self):
+        """Samples the p99 once and raises, lowers or holds the limits."""
+        try:
+            p99 = self.__get_p99()
+        except Exception as e:
+            logging.debug('Could not sample the request time: {}'.format(e))
+            p99 = None
+        with self.__lock:
+            if p99 is None:
+                action = ACTION_HOLD
+            elif p99 > self.__p99_budget:
+                action = ACTION_DECREASE
+                self.__read_rate = max(self.__min_read_rate, int(self.__read_rate * DECREASE_FACTOR))
+                self.__parallelism = max(1, int(self.__parallelism * DECREASE_FACTOR))
+            elif p99 < self.__p99_budget * INCREASE_THRESHOLD:
+                action = ACTION_INCREASE
+                self.__read_rate = min(self.__max_read_rate,
+                                       self.__read_rate + self.__max_read_rate // INCREASE_STEPS)
+                self.__parallelism = min(self.__max_parallelism, self.__parallelism + 1)
+            else:
+                action = ACTION_HOLD
+            decision = Decision(datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'), p99, action, self.__read_rate,
+                                self.__parallelism)
+            self.__decisions.append(decision)
+        logging.info('Throttle [{}]: p99 [{}] ms, budget [{:.0f}] ms, {} to read rate [{:.1f}] MB/s and [{}] '
+                     'compression workers'.format(decision.timestamp, 'unknown' if p99 is None else round(p99),
+                                                  self.__p99_budget, action, decision.read_rate / MB,
+                                                  decision.parallelism))
+        return decision
+
+    def start(self):
+        self.__stopped.clear()
+        self.__thread = Thread(target=self.__run, name='throttle', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stopped.wait(self.__interval):
+            self.adjust()
+
+
+class ThrottledReader:
+    """File-like wrapper which reads from `fileobj` at the read rate of the throttle."""
+
+    def __init__(self, fileobj, throttle: AdaptiveThrottle):
+        self.__fileobj = fileobj
+        self.__throttle = throttle
+
+    def read(self, size: int = -1):
+        data = self.__fileobj.read(size)
+        if data:
+            self.__throttle.consume(len(data))
+        return data
+
+    def close(self):
+        self.__fileobj.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Journal of backup and restore progress on local disk.
+
+Backup and restore runs record the progress of every shard and S3 transfers record every completed part of a
+multipart upload or ranged download in a small SQLite database. A run which was interrupted, e.g. because the job was
+killed, keeps its backup directory and is resumed by the next run: completed shards are skipped and transfers continue
+after their last completed part, whose checksum is verified first. Backups and restores lock the journal separately,
+so a restore can run while the scheduled backup job is waiting for its next run.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from threading import Lock
+
+RUN_BACKUP = 'backup'
+RUN_RESTORE = 'restore'
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+# Progress of a shard within a backup run
+SHARD_SNAPSHOT = 'snapshot'
+SHARD_ARCHIVED = 'archived'
+SHARD_STORED = 'stored'
+# Progress of a shard or core within a restore run
+SHARD_PREPARED = 'prepared'
+CORE_RESTORED = 'restored'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS runs (kind TEXT PRIMARY KEY, run_id TEXT NOT NULL, started REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS shards (kind TEXT NOT NULL, run_id TEXT NOT NULL, name TEXT NOT NULL, '
+    'state TEXT NOT NULL, data TEXT, PRIMARY KEY (kind, run_id, name))',
+    'CREATE TABLE IF NOT EXISTS transfers (direction TEXT NOT NULL, bucket TEXT NOT NULL, key TEXT NOT NULL, '
+    'file_name TEXT NOT NULL, size INTEGER NOT NULL, version TEXT NOT NULL, part_size INTEGER NOT NULL, '
+    'upload_id TEXT, PRIMARY KEY (direction, bucket, key))',
+    'CREATE TABLE IF NOT EXISTS parts (direction TEXT NOT NULL, bucket TEXT NOT NULL, key TEXT NOT NULL, '
+    'part_number INTEGER NOT NULL, md5 TEXT NOT NULL, PRIMARY KEY (direction, bucket, key, part_number))',
+]
+
+
+class JournalLocked(Exception):
+    pass
+
+
+class Transfer:
+
+    def __init__(self, file_name: str, size: int, version: str, part_size: int, upload_id: str = None):
+        """`version` identifies the content of the source, the modification time of a file or the ETag of an object."""
+        self.file_name = file_name
+        self.size = size
+        self.version = version
+        self.part_size = part_size
+        self.upload_id = upload_id
+
+    def matches(self, other):
+        """Returns whether the parts of `other` can be reused for this transfer."""
+        return other is not None and (self.file_name, self.size, self.version, self.part_size) == \
+            (other.file_name, other.size, other.version, other.part_size)
+
+
+class TransferJournal:
+
+    def __init__(self, path: str):
+        self.__path = path
+        self.__lock_files = {}
+        # One connection is shared by all transfer threads, every statement is committed on its own
+        self.__connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__lock = Lock()
+        with self.__lock:
+            for statement in SCHEMA:
+                self.__connection.execute(statement)
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def acquire(self, kind: str):
+        """Keeps other processes from resuming the same run of the given kind while it is in progress."""
+        lock_file = open('{}.{}.lock'.format(self.__path, kind), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise JournalLocked('Journal [{}] is used by another {}'.format(self.__path, kind))
+        self.__lock_files[kind] = lock_file
+
+    def release(self, kind: str):
+        lock_file = self.__lock_files.pop(kind, None)
+        if lock_file is not None:
+            # Closing the file releases the lock
+            lock_file.close()
+
+    def get_unfinished_run(self, kind: str):
+        """Returns the ID and start time of the interrupted run of the given kind or `(None, None)`."""
+        row = self.__query_one('SELECT run_id, started FROM runs WHERE kind = ?', kind)
+        return (row[0], row[1]) if row else (None, None)
+
+    def start_run(self, kind: str, run_id: str):
+        """Starts a run, the progress of an interrupted run with another ID is discarded."""
+        previous_run_id, started = self.get_unfinished_run(kind)
+        if previous_run_id == run_id:
+            return
+        if previous_run_id is not None:
+            self.__execute('DELETE FROM shards WHERE kind = ? AND run_id = ?', kind, previous_run_id)
+        self.__execute('INSERT OR REPLACE INTO runs (kind, run_id, started) VALUES (?, ?, ?)', kind, run_id,
+                       time.time())
+
+    def finish_run(self, kind: str, run_id: str):
+        self.__execute('DELETE FROM shards WHERE kind = ? AND run_id = ?', kind, run_id)
+        self.__execute('DELETE FROM runs WHERE kind = ? AND run_id = ?', kind, run_id)
+
+    def get_shard(self, kind: str, run_id: str, name: str):
+        """Returns the state and data of a shard of the run or `(None, None)` if it has not made any progress."""
+        row = self.__query_one('SELECT state, data FROM shards WHERE kind = ? AND run_id = ? AND name = ?', kind,
+                               run_id, name)
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def set_shard(self, kind: str, run_id: str, name: str, state: str, data: dict = None):
+        self.__execute('INSERT OR REPLACE INTO shards (kind, run_id, name, state, data) VALUES (?, ?, ?, ?, ?)', kind,
+                       run_id, name, state, json.dumps(data, sort_keys=True) if data is not None else None)
+
+    def get_transfer(self, direction: str, bucket: str, key: str):
+        row = self.__query_one('SELECT file_name, size, version, part_size, upload_id FROM transfers '
+                               'WHERE direction = ? AND bucket = ? AND key = ?', direction, bucket, key)
+        return Transfer(*row) if row else None
+
+    def get_transfers(self, direction: str):
+        """Returns the bucket, key and `Transfer` of every unfinished transfer in the given direction."""
+        with self.__lock:
+            rows = self.__connection.execute('SELECT bucket, key, file_name, size, version, part_size, upload_id '
+                                             'FROM transfers WHERE direction = ?', (direction,)).fetchall()
+        return [(row[0], row[1], Transfer(*row[2:])) for row in rows]
+
+    def start_transfer(self, direction: str, bucket: str, key: str, transfer: Transfer):
+        """Records a new transfer of the object, the parts of an earlier transfer are discarded."""
+        self.__execute('DELETE FROM parts WHERE direction = ? AND bucket = ? AND key = ?', direction, bucket, key)
+        self.__execute('INSERT OR REPLACE INTO transfers (direction, bucket, key, file_name, size, version, '
+                       'part_size, upload_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', direction, bucket, key,
+                       transfer.file_name, transfer.size, transfer.version, transfer.part_size, transfer.upload_id)
+
+    def get_parts(self, direction: str, bucket: str, key: str):
+        """Returns the MD5 hex digests of the completed parts by part number."""
+        with self.__lock:
+            rows = self.__connection.execute('SELECT part_number, md5 FROM parts WHERE direction = ? AND bucket = ? '
+                                             'AND key = ?', (direction, bucket, key)).fetchall()
+        return dict(rows)
+
+    def add_part(self, direction: str, bucket: str, key: str, part_number: int, md5: str):
+        self.__execute('INSERT OR REPLACE INTO parts (direction, bucket, key, part_number, md5) VALUES (?, ?, ?, ?, ?)',
+                       direction, bucket, key, part_number, md5)
+
+    def finish_transfer(self, direction: str, bucket: str, key: str):
+        self.__execute('DELETE FROM parts WHERE direction = ? AND bucket = ? AND key = ?', direction, bucket, key)
+        self.__execute('DELETE FROM transfers WHERE direction = ? AND bucket = ? AND key = ?', direction, bucket, key)
+
+    def __execute(self, statement: str, *parameters):
+        with self.__lock:
+            self.__connection.execute(statement, parameters)
+
+    def __query_one(self, statement: str, *parameters):
+        with self.__lock:
+            return self.__connection.execute(statement, parameters).fetchone()
+
+
+def open_journal(path: str):
+    """Opens the journal at `path` and creates its directory. Returns None if it can not be opened."""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return TransferJournal(path)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning('Could not open journal [{}], interrupted runs will not be resumed: {}'.format(path, e))
+        return None
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bounded execution of backup and restore tasks.
+
+`TaskPool` runs shard tasks on a fixed number of threads, blocks producers while all slots are taken and collects the
+exceptions raised by its tasks. `ResourceLimits` caps how many tasks use the CPU (compression), the disk (archive
+I/O) and the network (S3 transfers) at the same time, independent of the number of shard tasks. `DiskSpaceAdmission`
+admits a task only once the free space of a volume covers the bytes it is expected to write.
+"""
+
+import logging
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Condition, Lock
+
+RESOURCE_CPU = 'cpu'
+RESOURCE_DISK = 'disk'
+RESOURCE_NETWORK = 'network'
+
+# Resources are always acquired in this order to avoid deadlocks between tasks holding several of them
+RESOURCE_ORDER = [RESOURCE_DISK, RESOURCE_CPU, RESOURCE_NETWORK]
+
+DEFAULT_LIMITS = {
+    RESOURCE_CPU: os.cpu_count() or 1,
+    RESOURCE_DISK: 2,
+    RESOURCE_NETWORK: 4,
+}
+DEFAULT_POOL_SIZE = 4
+DEFAULT_DISK_HEADROOM = 1024 * 1024 * 1024
+DEFAULT_DISK_POLL_INTERVAL_IN_SECONDS = 5
+
+
+class TaskFailure(Exception):
+
+    def __init__(self, name: str, failures: list):
+        self.failures = failures
+        super().__init__('[{}] of the [{}] tasks failed: {}'.format(
+            len(failures), name, '; '.join('{}: {}'.format(description, e) for description, e in failures)))
+
+
+class ResourceLimits:
+
+    def __init__(self, limits: dict = None):
+        self.__limits = dict(DEFAULT_LIMITS)
+        self.__limits.update(limits or {})
+        self.__semaphores = {resource: BoundedSemaphore(limit) for resource, limit in self.__limits.items()}
+
+    def get_limit(self, resource: str):
+        return self.__limits[resource]
+
+    @contextmanager
+    def acquire(self, *resources):
+        """Holds one slot of every given resource for the duration of the block."""
+        acquired = []
+        try:
+            for resource in sorted(resources, key=RESOURCE_ORDER.index):
+                self.__semaphores[resource].acquire()
+                acquired.append(resource)
+            yield
+        finally:
+            for resource in reversed(acquired):
+                self.__semaphores[resource].release()
+
+
+class InsufficientDiskSpace(Exception):
+    pass
+
+
+class DiskSpaceAdmission:
+    """
+    Reserves the expected size of every task on a volume. A task is admitted once the free space minus the
+    reservations of the running tasks and the headroom covers its size. The free space already includes what running
+    tasks have written, so their reservations are counted twice until they finish, which errs on the safe side.
+    """
+
+    def __init__(self, path: str, headroom: int = DEFAULT_DISK_HEADROOM,
+                 poll_interval: float = DEFAULT_DISK_POLL_INTERVAL_IN_SECONDS, get_free_space=None):
+        self.__path = path
+        self.__headroom = headroom
+        self.__poll_interval = poll_interval
+        self.__get_free_space = get_free_space or (lambda: shutil.disk_usage(self.__path).free)
+        self.__reserved = {}
+        self.__condition = Condition()
+
+    def get_reserved(self):
+        with self.__condition:
+            return sum(self.__reserved.values())
+
+    @contextmanager
+    def acquire(self, description: str, size: int):
+        """
+        Holds a reservation of `size` bytes for the duration of the block. Raises `InsufficientDiskSpace` if the
+        task does not fit even though no other task holds a reservation.
+        """
+        with self.__condition:
+            while True:
+                available = self.__get_free_space() - self.__headroom - sum(self.__reserved.values())
+                if size <= available:
+                    break
+                if not self.__reserved:
+                    raise InsufficientDiskSpace('[{}] needs [{}] bytes, but only [{}] bytes are free on [{}]'
+                                                .format(description, size, max(available, 0), self.__path))
+                logging.info('Waiting for disk space for [{}], it needs [{}] of [{}] available bytes.'
+                             .format(description, size, max(available, 0)))
+                # Space is also freed by removed archives, so the free space is polled as well
+                self.__condition.wait(self.__poll_interval)
+            self.__reserved[description] = self.__reserved.get(description, 0) + size
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__reserved[description] -= size
+                if self.__reserved[description] <= 0:
+                    del self.__reserved[description]
+                self.__condition.notify_all()
+
+
+class TaskPool:
+    """
+    Runs tasks on at most `size` threads. `submit` blocks while `size` tasks are running and `max_queued` more are
+    waiting, which keeps producers from running ahead of the consumers.
+    """
+
+    def __init__(self, name: str, size: int = DEFAULT_POOL_SIZE, max_queued: int = 0):
+        self.__name = name
+        self.__executor = ThreadPoolExecutor(max_workers=size)
+        self.__slots = BoundedSemaphore(size + max_queued)
+        self.__futures = []
+        self.__failures = []
+        self.__lock = Lock()
+
+    def submit(self, description: str, function, *args, **kwargs):
+        self.__slots.acquire()
+        try:
+            future = self.__executor.submit(self.__run, description, function, *args, **kwargs)
+        except Exception:
+            self.__slots.release()
+            raise
+        self.__futures.append(future)
+        return future
+
+    def get_failures(self):
+        with self.__lock:
+            return list(self.__failures)
+
+    def wait(self):
+        """Waits for all submitted tasks and raises a `TaskFailure` if any of them failed."""
+        for future in self.__futures:
+            future.result()
+        self.__executor.shutdown(wait=True)
+        failures = self.get_failures()
+        if failures:
+            raise TaskFailure(self.__name, failures)
+
+    def __run(self, description: str, function, *args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            logging.error('Task [{}] of [{}] failed: {}'.format(description, self.__name, e))
+            with self.__lock:
+                self.__failures.append((description, e))
+        finally:
+            self.__slots.release()
+
+
+def exponential_backoff(initial: float, maximum: float, factor: float = 2):
+    """Yields delays starting at `initial` which grow by `factor` up to `maximum`."""
+    delay = min(initial, maximum)
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
@@ -25,9 +25,8 @@ for col in ${COLLECTIONS[*]}; do
    core_properties ${col} > ${CORE_DIRS}/${col}/core.properties 
 done
 
-MEM_JAVA_PERCENT=20
-MEM_TOTAL_KB=$(cat /proc/meminfo | grep MemTotal | awk '{print $2}')
-MEM_JAVA_KB=$(($MEM_TOTAL_KB * $MEM_JAVA_PERCENT / 100))
+# Heap size for the local index, 20% of the memory while the index is empty
+MEM_JAVA=$(python3 -m scripts.jvm_sizing --data-dir /data --default-heap-percent 20)
 
 JAVA_OPTS="$JAVA_OPTS -javaagent:/opt/jolokia-jvm-1.3.2-agent.jar=port=8778,host=0.0.0.0"
 JAVA_OPTS="$JAVA_OPTS -Xloggc:/data/logs/solr_gc.log"
@@ -44,7 +43,7 @@ if [ -n "$BACKUP_INTERVAL" ] && [[ "${BACKUP_INTERVAL}" =~ ^(weekly|daily|hourly
 then
     [[ -z "${SOLR_BACKUP_BUCKET}" ]] && { echo "Parameter SOLR_BACKUP_BUCKET is empty" ; exit 1; }
     echo "Start backup job as background process"
-    nohup ./scripts/solrcloud_backup.py -b "${SOLR_BACKUP_BUCKET}" -c "${BACKUP_INTERVAL}" backup &
+    nohup python3 -m scripts.solrcloud_backup ${SOLR_BACKUP_OPTIONS} -b "${SOLR_BACKUP_BUCKET}" -c "${BACKUP_INTERVAL}" backup &
 else
     echo "Backup job is not configured to be started"
 fi
@@ -53,9 +52,15 @@ fi
 if [ -n "$RESTORE_LATEST_BACKUP" ] && [[ "${RESTORE_LATEST_BACKUP}" =~ ^[tT][rR][uU][eE]$ ]]
 then
     [[ -z "${SOLR_BACKUP_BUCKET}" ]] && { echo "Parameter SOLR_BACKUP_BUCKET is empty" ; exit 1; }
-    export LATEST=$(aws s3 ls s3://"${SOLR_BACKUP_BUCKET}"/ | grep -E "[0-9]+/$" | sort -z | sed 's/.*PRE \([0-9]\+\)\//\1/' | tail -2)
-    echo "Start to restore latest backup [${LATEST}]"
-    nohup ./scripts/solrcloud_backup.py -b "${SOLR_BACKUP_BUCKET}" -t "${LATEST}" restore &
+    # Newest complete backup according to the backup catalog in the bucket
+    export LATEST=$(python3 -m scripts.solrcloud_backup ${SOLR_BACKUP_OPTIONS} -b "${SOLR_BACKUP_BUCKET}" latest)
+    if [ -n "${LATEST}" ]
+    then
+        echo "Start to restore latest backup [${LATEST}]"
+        nohup python3 -m scripts.solrcloud_backup ${SOLR_BACKUP_OPTIONS} -b "${SOLR_BACKUP_BUCKET}" -t "${LATEST}" restore &
+    else
+        echo "No complete backup found, startup with empty index"
+    fi
 else
     echo "Startup with empty index, no backup will be restored"
 fi
@@ -64,4 +69,4 @@ fi
 echo
 echo "You can access Solr via http://$(hostname -i):8983/solr" >&2
 echo 
-/opt/solr/bin/solr start -f -s /data -m ${MEM_JAVA_KB}k -a "${JAVA_OPTS}"
+/opt/solr/bin/solr start -f -s /data -m ${MEM_JAVA} -a "${JAVA_OPTS}"